@@ -0,0 +1,863 @@
+"""
+Storage engine and gRPC service benchmarks. Results are printed as JSON,
+tagged with the commit and environment so runs can be compared.
+
+    python -m bitc.bench suite > results.json
+    python -m bitc.bench storage --keys 100000 --value-sizes 100 4096
+    python -m bitc.bench grpc --keys 20000 --read-ratios 0.5 0.95
+    python -m bitc.bench merge --files 10 --garbage 10 50 90
+    python -m bitc.bench mmap-read --keys 100000 --value-size 100
+    python -m bitc.bench keydir-memory --keys 1000000 10000000
+    python -m bitc.bench rebuild --keys 1000000 --workers 1 4 8
+    python -m bitc.bench bloom --files 200 --keys-per-file 1000
+    python -m bitc.bench tiered --keys 1000000 --budgets 0 10000000
+    python -m bitc.bench server-load --modes thread aio --clients 2000
+    python -m bitc.bench compression --keys 100000 --value-size 1000
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import grpc
+
+from bitc import bitc_pb2, bitc_pb2_grpc, compression, consts, utils
+from bitc.bitc_storage import CaskKeyDirEntry, CaskStorage
+from bitc.cask_file import CaskDataFile, lookup_hint_file
+from bitc.client import BitCdbRpcClient
+from bitc.keydir import CompactKeyDir, KeyDir, TieredKeyDir
+
+ZIPF_THETA = 0.99
+
+
+def _latency_stats(samples):
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "count": count,
+        "mean_us": sum(samples) / count * 1e6,
+        "p50_us": samples[count // 2] * 1e6,
+        "p99_us": samples[min(count - 1, int(count * 0.99))] * 1e6,
+        "max_us": samples[-1] * 1e6,
+    }
+
+
+def _load(storage, num_keys, value_size):
+    value = "v" * value_size
+    keys = ["key-{}".format(i) for i in range(num_keys)]
+    for key in keys:
+        storage.store(key, value)
+    return keys
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def _zipf_indexes(num_keys, count, theta=ZIPF_THETA):
+    """
+    count key indexes drawn from a Zipfian distribution over num_keys keys,
+    as in YCSB. Popular keys are spread over the keyspace rather than being
+    the lowest indexes.
+    """
+    cum_weights = list(
+        itertools.accumulate(1.0 / (rank + 1) ** theta for rank in range(num_keys))
+    )
+    hot = list(range(num_keys))
+    random.shuffle(hot)
+    return [
+        hot[rank]
+        for rank in random.choices(range(num_keys), cum_weights=cum_weights, k=count)
+    ]
+
+
+def _timed_ops(ops):
+    """Run (function, args) pairs, returns throughput and latency stats."""
+    samples = []
+    start = time.perf_counter()
+    for function, args in ops:
+        op_start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - op_start)
+    seconds = time.perf_counter() - start
+    return {
+        "ops": len(samples),
+        "seconds": seconds,
+        "ops_per_sec": len(samples) / seconds,
+        "latency": _latency_stats(samples),
+    }
+
+
+def _run_workloads(put, get, num_keys, num_ops, value_size, read_ratios):
+    """
+    The standard workloads against any put(key, value)/get(key) pair. The
+    sequential PUT phase also loads the keys the later phases read.
+    """
+    value = os.urandom(value_size // 2).hex()
+    keys = ["key-{:012d}".format(i) for i in range(num_keys)]
+    results = {
+        "put_sequential": _timed_ops((put, (key, value)) for key in keys),
+        "put_random": _timed_ops(
+            (put, (keys[random.randrange(num_keys)], value)) for _ in range(num_ops)
+        ),
+        "get_uniform": _timed_ops(
+            (get, (keys[random.randrange(num_keys)],)) for _ in range(num_ops)
+        ),
+        "get_zipf": _timed_ops(
+            (get, (keys[index],)) for index in _zipf_indexes(num_keys, num_ops)
+        ),
+    }
+    for read_ratio in read_ratios:
+        results["mixed_read_{}".format(read_ratio)] = _timed_ops(
+            (
+                (get, (keys[index],))
+                if random.random() < read_ratio
+                else (put, (keys[index], value))
+            )
+            for index in _zipf_indexes(num_keys, num_ops)
+        )
+    return results
+
+
+def bench_storage(
+    num_keys, num_ops, value_sizes, read_ratios, durability, file_size, key_dir
+):
+    """PUT/GET/mixed workloads straight against CaskStorage."""
+    results = {}
+    for value_size in value_sizes:
+        with tempfile.TemporaryDirectory() as db_dir:
+            storage = CaskStorage(
+                db_dir,
+                CompactKeyDir() if key_dir == "compact" else KeyDir(),
+                max_file_size=file_size,
+                durability=durability,
+            )
+            results["value_{}".format(value_size)] = _run_workloads(
+                storage.store,
+                storage.retrieve,
+                num_keys,
+                num_ops,
+                value_size,
+                read_ratios,
+            )
+            storage.close()
+    return {
+        "benchmark": "storage",
+        "keys": num_keys,
+        "ops": num_ops,
+        "durability": durability,
+        "file_size": file_size,
+        "key_dir": key_dir,
+        "results": results,
+    }
+
+
+def bench_grpc(num_keys, num_ops, value_sizes, read_ratios, server_args):
+    """The storage workloads through BitCdbRpcClient against a local server."""
+    results = {}
+    for value_size in value_sizes:
+        with tempfile.TemporaryDirectory() as db_dir:
+            with _local_server(db_dir, server_args) as port:
+                client = BitCdbRpcClient(port=port)
+                results["value_{}".format(value_size)] = _run_workloads(
+                    client.put,
+                    client.get,
+                    num_keys,
+                    num_ops,
+                    value_size,
+                    read_ratios,
+                )
+    return {
+        "benchmark": "grpc",
+        "keys": num_keys,
+        "ops": num_ops,
+        "server_args": server_args,
+        "results": results,
+    }
+
+
+def bench_merge(num_keys, value_size, num_files, garbage_pcts):
+    """
+    Merge of num_files data files of which garbage_pct percent of the
+    records were overwritten since.
+    """
+    results = {}
+    value = "v" * value_size
+    entry_size = consts.DATA_HEADER_SIZE + len("key-{:012d}".format(0)) + value_size
+    file_size = num_keys * entry_size // num_files
+    for garbage_pct in garbage_pcts:
+        with tempfile.TemporaryDirectory() as db_dir:
+            storage = CaskStorage(
+                db_dir,
+                KeyDir(),
+                max_file_size=file_size,
+                durability=consts.DURABILITY_OS,
+            )
+            keys = ["key-{:012d}".format(i) for i in range(num_keys)]
+            for key in keys:
+                storage.store(key, value)
+            files = storage.read_files()
+            for key in random.sample(keys, num_keys * garbage_pct // 100):
+                storage.store(key, value)
+            bytes_before = sum(data_file.size for data_file in files)
+            start = time.perf_counter()
+            storage.merge(files)
+            seconds = time.perf_counter() - start
+            merged_ids = set(data_file.file_id for data_file in files)
+            bytes_after = sum(
+                data_file.size
+                for data_file in storage.read_files()
+                if data_file.file_id in merged_ids
+            )
+            results["garbage_{}".format(garbage_pct)] = {
+                "files": len(files),
+                "seconds": seconds,
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+                "mb_per_sec": bytes_before / seconds / 1e6,
+            }
+            storage.close()
+    return {
+        "benchmark": "merge",
+        "keys": num_keys,
+        "value_size": value_size,
+        "results": results,
+    }
+
+
+def _timed_gets(storage, keys, num_reads, cold):
+    samples = []
+    files = {data_file.basename: data_file for data_file in storage.read_files()}
+    for _ in range(num_reads):
+        key = random.choice(keys)
+        if cold:
+            for data_file in files.values():
+                data_file.drop_page_cache()
+        start = time.perf_counter()
+        storage.retrieve(key)
+        samples.append(time.perf_counter() - start)
+    return _latency_stats(samples)
+
+
+def bench_mmap_read(num_keys, value_size, num_reads, file_size):
+    """GET latency of buffered pread vs mmap, with warm and cold page cache."""
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        writer = CaskStorage(
+            db_dir,
+            KeyDir(),
+            max_file_size=file_size,
+            durability=consts.DURABILITY_OS,
+        )
+        keys = _load(writer, num_keys, value_size)
+        writer.close()
+        for use_mmap in (False, True):
+            storage = CaskStorage(
+                db_dir, KeyDir(), max_file_size=file_size, use_mmap=use_mmap
+            )
+            storage.rebuild_index()
+            mode = "mmap" if use_mmap else "pread"
+            for cache in ("warm", "cold"):
+                results["{}_{}".format(mode, cache)] = _timed_gets(
+                    storage, keys, num_reads, cache == "cold"
+                )
+    return {
+        "benchmark": "mmap-read",
+        "keys": num_keys,
+        "value_size": value_size,
+        "results": results,
+    }
+
+
+def bench_keydir_memory(key_counts):
+    """Memory held by KeyDir and CompactKeyDir per indexed key."""
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        data_file = CaskDataFile(db_dir, consts.DATAFILE_START_INDEX, False)
+        for num_keys in key_counts:
+            for name, factory in (
+                ("dict", KeyDir),
+                ("compact", lambda: CompactKeyDir(capacity=num_keys)),
+            ):
+                gc.collect()
+                tracemalloc.start()
+                key_dir = factory()
+                start = time.perf_counter()
+                for i in range(num_keys):
+                    key_dir.add(
+                        b"key-%d" % i, CaskKeyDirEntry(data_file, 100, i * 100, i)
+                    )
+                load_seconds = time.perf_counter() - start
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results["{}_{}".format(name, num_keys)] = {
+                    "keys": num_keys,
+                    "bytes": current,
+                    "peak_bytes": peak,
+                    "bytes_per_key": current / num_keys,
+                    "load_seconds": load_seconds,
+                }
+                del key_dir
+        data_file.close()
+    return {"benchmark": "keydir-memory", "results": results}
+
+
+def bench_rebuild(num_keys, num_writes, value_size, file_size, worker_counts):
+    """Index rebuild time for a directory of num_writes records over num_keys."""
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        writer = CaskStorage(
+            db_dir,
+            KeyDir(),
+            max_file_size=file_size,
+            durability=consts.DURABILITY_OS,
+        )
+        value = "v" * value_size
+        for i in range(num_writes):
+            writer.store("key-{}".format(random.randrange(num_keys)), value)
+        writer.close()
+        for workers in worker_counts:
+            storage = CaskStorage(db_dir, KeyDir(), max_file_size=file_size)
+            start = time.perf_counter()
+            storage.rebuild_index(workers=workers)
+            progress = storage.rebuild_progress()
+            results["workers_{}".format(workers)] = {
+                "seconds": time.perf_counter() - start,
+                "files": progress["files_total"],
+                "keys": progress["keys_indexed"],
+            }
+    return {
+        "benchmark": "rebuild",
+        "keys": num_keys,
+        "writes": num_writes,
+        "results": results,
+    }
+
+
+def bench_bloom(num_files, keys_per_file, value_size, num_reads, budgets):
+    """
+    Latency of lookups that miss the KeyDir while the index isn't loaded,
+    across num_files data files, with Bloom filter budgets of budgets bytes.
+    A budget of 0 scans every hint file, the path without filters.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        value = "v" * value_size
+        # Fixed width keys, so every file holds exactly keys_per_file records
+        key_format = "key-{:06d}-{:06d}"
+        record_size = (
+            consts.DATA_HEADER_SIZE + len(key_format.format(0, 0)) + value_size
+        )
+        writer = CaskStorage(
+            db_dir,
+            KeyDir(),
+            max_file_size=keys_per_file * record_size,
+            durability=consts.DURABILITY_OS,
+        )
+        for file_id in range(num_files):
+            writer.store_many(
+                [(key_format.format(file_id, i), value) for i in range(keys_per_file)]
+            )
+        writer.close()
+        data_files = utils.get_datafiles(db_dir)
+        oldest = [key_format.format(0, i) for i in range(keys_per_file)]
+        for budget in budgets:
+            storage = CaskStorage(db_dir, KeyDir(), bloom_cache_bytes=budget)
+            # Every file unindexed, newest first, as right after a lazy start
+            unindexed = [
+                (
+                    CaskDataFile(
+                        db_dir, utils.get_file_id_from_absolute_path(data_file), True
+                    ),
+                    utils.get_hint_filename_for_data_file(data_file),
+                    lookup_hint_file,
+                )
+                for data_file in reversed(data_files)
+            ]
+            result = {}
+            for name, keys in (
+                ("miss", ["absent-{}".format(i) for i in range(num_reads)]),
+                ("oldest_file_hit", [random.choice(oldest) for _ in range(num_reads)]),
+            ):
+                samples = []
+                for key in keys:
+                    key = utils.to_bytes(key)
+                    start = time.perf_counter()
+                    storage._lookup_unindexed(key, unindexed)
+                    samples.append(time.perf_counter() - start)
+                result[name] = _latency_stats(samples)
+            if storage._blooms is not None:
+                result["filters"] = storage._blooms.stats()
+            results["budget_{}".format(budget)] = result
+            for data_file, _, _ in unindexed:
+                data_file.close()
+    return {
+        "benchmark": "bloom",
+        "files": num_files,
+        "keys_per_file": keys_per_file,
+        "results": results,
+    }
+
+
+def bench_tiered(num_keys, value_size, num_reads, file_size, budgets):
+    """
+    GET latency and KeyDir memory with a TieredKeyDir of budgets bytes, once
+    the index is loaded. A budget of 0 is the plain in-memory KeyDir.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        writer = CaskStorage(
+            db_dir,
+            KeyDir(),
+            max_file_size=file_size,
+            durability=consts.DURABILITY_OS,
+        )
+        keys = _load(writer, num_keys, value_size)
+        writer.close()
+        for budget in budgets:
+            key_dir = TieredKeyDir(budget) if budget else KeyDir()
+            storage = CaskStorage(db_dir, key_dir, max_file_size=file_size)
+            start = time.perf_counter()
+            storage.rebuild_index(background=False)
+            rebuild_seconds = time.perf_counter() - start
+            results["budget_{}".format(budget)] = {
+                "rebuild_seconds": rebuild_seconds,
+                "get_uniform": _timed_ops(
+                    (storage.retrieve, (random.choice(keys),)) for _ in range(num_reads)
+                ),
+                "get_zipf": _timed_ops(
+                    (storage.retrieve, (keys[index],))
+                    for index in _zipf_indexes(num_keys, num_reads)
+                ),
+                "keydir_bytes": key_dir.memory_usage(),
+            }
+            storage.close()
+    return {
+        "benchmark": "tiered",
+        "keys": num_keys,
+        "value_size": value_size,
+        "results": results,
+    }
+
+
+def _json_value(size):
+    """A JSON document of roughly size bytes, shaped like typical API payloads."""
+    fields = []
+    while sum(len(field) for field in fields) < size:
+        fields.append(
+            '"{}_{}": {{"id": {}, "name": "item-{}", "active": {}, "score": {:.3f}}}'.format(
+                random.choice(("user", "order", "event")),
+                len(fields),
+                random.randrange(10**6),
+                random.randrange(1000),
+                random.choice(("true", "false")),
+                random.random() * 100,
+            )
+        )
+    return ("{" + ", ".join(fields) + "}").encode()
+
+
+def bench_compression(num_keys, value_size, num_reads, min_size, codecs):
+    """Disk footprint, PUT CPU time and GET latency for each codec."""
+    values = [_json_value(value_size) for _ in range(1000)]
+    raw_bytes = sum(len(values[i % len(values)]) for i in range(num_keys))
+    results = {}
+    for codec in codecs:
+        with tempfile.TemporaryDirectory() as db_dir:
+            storage = CaskStorage(
+                db_dir,
+                KeyDir(),
+                max_file_size=64 * 1000 * 1000,
+                durability=consts.DURABILITY_OS,
+                compression=codec,
+                compression_min_size=min_size,
+            )
+            keys = ["key-{}".format(i) for i in range(num_keys)]
+            cpu_start, start = time.process_time(), time.perf_counter()
+            for i, key in enumerate(keys):
+                storage.store(key, values[i % len(values)])
+            put_cpu = time.process_time() - cpu_start
+            put_seconds = time.perf_counter() - start
+            disk_bytes = sum(
+                os.path.getsize(path) for path in utils.get_datafiles(db_dir)
+            )
+            results[codec] = {
+                "disk_bytes": disk_bytes,
+                "ratio": raw_bytes / disk_bytes,
+                "put_cpu_us": put_cpu / num_keys * 1e6,
+                "put_us": put_seconds / num_keys * 1e6,
+                "get": _timed_gets(storage, keys, num_reads, False),
+            }
+            storage.close()
+    return {
+        "benchmark": "compression",
+        "keys": num_keys,
+        "value_size": value_size,
+        "raw_value_bytes": raw_bytes,
+        "min_size": min_size,
+        "results": results,
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _client_load(port, num_keys, num_clients, num_channels, num_requests, value):
+    """
+    num_clients concurrent callers over num_channels connections, each
+    doing GETs and PUTs (one in four) until num_requests are done.
+    """
+    channels = [
+        grpc.aio.insecure_channel("127.0.0.1:{}".format(port))
+        for _ in range(num_channels)
+    ]
+    for channel in channels:
+        await asyncio.wait_for(channel.channel_ready(), 60)
+    stubs = [bitc_pb2_grpc.BitCdbKeyValueServiceStub(channel) for channel in channels]
+    samples, errors = [], {}
+    remaining = [num_requests]
+
+    async def client(stub):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            key = "key-{}".format(random.randrange(num_keys))
+            start = time.perf_counter()
+            try:
+                if random.random() < 0.25:
+                    await stub.put(bitc_pb2.PutRequest(key=key, value=value))
+                else:
+                    await stub.get(bitc_pb2.GetRequest(key=key))
+                samples.append(time.perf_counter() - start)
+            except grpc.aio.AioRpcError as rpc_error:
+                code = rpc_error.code().name
+                errors[code] = errors.get(code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(stubs[i % num_channels]) for i in range(num_clients)))
+    seconds = time.perf_counter() - start
+    for channel in channels:
+        await channel.close()
+    return {
+        "seconds": seconds,
+        "requests_per_sec": len(samples) / seconds,
+        "latency": _latency_stats(samples),
+        "errors": errors,
+    }
+
+
+@contextmanager
+def _local_server(db_dir, server_args):
+    """Run bitc.server in a child process, yields its port once it serves."""
+    port = _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "bitc.server",
+            "--db-dir",
+            db_dir,
+            "--port",
+            str(port),
+        ]
+        + server_args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with grpc.insecure_channel("127.0.0.1:{}".format(port)) as channel:
+            grpc.channel_ready_future(channel).result(timeout=60)
+        yield port
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_server_load(
+    modes, num_keys, num_clients, num_channels, num_requests, value_size, server_args
+):
+    """
+    Throughput and latency of a server process per mode under many
+    concurrent clients, 3 GETs for every PUT of random keys.
+    """
+    results = {}
+    value = "v" * value_size
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as db_dir:
+            with _local_server(db_dir, ["--server-mode", mode] + server_args) as port:
+                with grpc.insecure_channel("127.0.0.1:{}".format(port)) as channel:
+                    stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(channel)
+                    for start in range(0, num_keys, 1000):
+                        stub.multi_put(
+                            bitc_pb2.MultiPutRequest(
+                                items=[
+                                    bitc_pb2.KeyValue(
+                                        key="key-{}".format(i), value=value
+                                    )
+                                    for i in range(start, min(start + 1000, num_keys))
+                                ]
+                            )
+                        )
+                results[mode] = asyncio.run(
+                    _client_load(
+                        port, num_keys, num_clients, num_channels, num_requests, value
+                    )
+                )
+    return {
+        "benchmark": "server-load",
+        "keys": num_keys,
+        "clients": num_clients,
+        "channels": num_channels,
+        "requests": num_requests,
+        "server_args": server_args,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="bitc.bench", description="bitCDB storage and service benchmarks"
+    )
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    suite = subparsers.add_parser(
+        "suite", help="storage, grpc, rebuild and merge benchmarks with defaults"
+    )
+    suite.add_argument("--keys", type=int, default=50000)
+    suite.add_argument("--ops", type=int, default=20000)
+
+    storage = subparsers.add_parser(
+        "storage", help="PUT/GET/mixed workloads against CaskStorage"
+    )
+    grpc_bench = subparsers.add_parser(
+        "grpc", help="PUT/GET/mixed workloads through the gRPC client"
+    )
+    for workload in (storage, grpc_bench):
+        workload.add_argument("--keys", type=int, default=100000)
+        workload.add_argument("--ops", type=int, default=50000)
+        workload.add_argument("--value-sizes", type=int, nargs="+", default=[100, 4096])
+        workload.add_argument(
+            "--read-ratios", type=float, nargs="+", default=[0.5, 0.95]
+        )
+    storage.add_argument(
+        "--durability", choices=consts.DURABILITY_MODES, default=consts.DURABILITY_OS
+    )
+    storage.add_argument("--file-size", type=int, default=64 * 1000 * 1000)
+    storage.add_argument("--key-dir", choices=("dict", "compact"), default="dict")
+    grpc_bench.add_argument(
+        "--server-args",
+        nargs=argparse.REMAINDER,
+        default=["--durability", consts.DURABILITY_OS],
+        help="Extra bitc.server flags, must come last",
+    )
+
+    merge = subparsers.add_parser(
+        "merge", help="Merge of data files holding a given share of garbage"
+    )
+    merge.add_argument("--keys", type=int, default=200000)
+    merge.add_argument("--value-size", type=int, default=100)
+    merge.add_argument("--files", type=int, default=10)
+    merge.add_argument("--garbage", type=int, nargs="+", default=[10, 50, 90])
+
+    mmap_read = subparsers.add_parser(
+        "mmap-read", help="GET latency with and without mmap'd data files"
+    )
+    mmap_read.add_argument("--keys", type=int, default=100000)
+    mmap_read.add_argument("--value-size", type=int, default=100)
+    mmap_read.add_argument("--reads", type=int, default=10000)
+    mmap_read.add_argument("--file-size", type=int, default=4 * 1000 * 1000)
+
+    keydir_memory = subparsers.add_parser(
+        "keydir-memory", help="Memory per key of the KeyDir implementations"
+    )
+    keydir_memory.add_argument("--keys", type=int, nargs="+", default=[1000000])
+
+    rebuild = subparsers.add_parser("rebuild", help="Startup index rebuild time")
+    rebuild.add_argument("--keys", type=int, default=1000000)
+    rebuild.add_argument("--writes", type=int, default=None)
+    rebuild.add_argument("--value-size", type=int, default=100)
+    rebuild.add_argument("--file-size", type=int, default=16 * 1000 * 1000)
+    rebuild.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+
+    bloom = subparsers.add_parser(
+        "bloom", help="Lookups of keys not indexed yet, with and without Bloom filters"
+    )
+    bloom.add_argument("--files", type=int, default=200)
+    bloom.add_argument("--keys-per-file", type=int, default=1000)
+    bloom.add_argument("--value-size", type=int, default=100)
+    bloom.add_argument("--reads", type=int, default=200)
+    bloom.add_argument(
+        "--budgets",
+        type=int,
+        nargs="+",
+        default=[0, 64 * 1024, consts.DEFAULT_BLOOM_CACHE_BYTES],
+        help="Bloom filter memory budgets in bytes, 0 for no filters",
+    )
+
+    tiered = subparsers.add_parser(
+        "tiered", help="GET latency and KeyDir memory of the tiered KeyDir"
+    )
+    tiered.add_argument("--keys", type=int, default=1000000)
+    tiered.add_argument("--value-size", type=int, default=100)
+    tiered.add_argument("--reads", type=int, default=10000)
+    tiered.add_argument("--file-size", type=int, default=16 * 1000 * 1000)
+    tiered.add_argument(
+        "--budgets",
+        type=int,
+        nargs="+",
+        default=[0, 10 * 1000 * 1000],
+        help="KeyDir memory budgets in bytes, 0 for the in-memory KeyDir",
+    )
+
+    server_load = subparsers.add_parser(
+        "server-load", help="Server throughput and latency under concurrent clients"
+    )
+    server_load.add_argument(
+        "--modes", nargs="+", choices=consts.SERVER_MODES, default=consts.SERVER_MODES
+    )
+    server_load.add_argument("--keys", type=int, default=10000)
+    server_load.add_argument("--clients", type=int, default=1000)
+    server_load.add_argument("--channels", type=int, default=8)
+    server_load.add_argument("--requests", type=int, default=50000)
+    server_load.add_argument("--value-size", type=int, default=100)
+    server_load.add_argument(
+        "--server-args",
+        nargs=argparse.REMAINDER,
+        default=["--durability", consts.DURABILITY_BATCH],
+        help="Extra bitc.server flags, must come last",
+    )
+
+    compression_bench = subparsers.add_parser(
+        "compression", help="Disk footprint and CPU cost of value compression"
+    )
+    compression_bench.add_argument("--keys", type=int, default=100000)
+    compression_bench.add_argument("--value-size", type=int, default=1000)
+    compression_bench.add_argument("--reads", type=int, default=10000)
+    compression_bench.add_argument(
+        "--min-size", type=int, default=consts.DEFAULT_COMPRESSION_MIN_SIZE
+    )
+    compression_bench.add_argument(
+        "--codecs",
+        nargs="+",
+        choices=compression.available_codecs(),
+        default=compression.available_codecs(),
+    )
+
+    args = parser.parse_args()
+    if args.benchmark == "suite":
+        result = {
+            "benchmark": "suite",
+            "results": [
+                bench_storage(
+                    args.keys,
+                    args.ops,
+                    [100, 4096],
+                    [0.5, 0.95],
+                    consts.DURABILITY_OS,
+                    64 * 1000 * 1000,
+                    "dict",
+                ),
+                bench_grpc(
+                    args.keys // 5,
+                    args.ops // 5,
+                    [100],
+                    [0.95],
+                    ["--durability", consts.DURABILITY_OS],
+                ),
+                bench_rebuild(
+                    args.keys, 2 * args.keys, 100, 4 * 1000 * 1000, [1, os.cpu_count()]
+                ),
+                bench_merge(args.keys, 100, 10, [10, 50, 90]),
+            ],
+        }
+    elif args.benchmark == "storage":
+        result = bench_storage(
+            args.keys,
+            args.ops,
+            args.value_sizes,
+            args.read_ratios,
+            args.durability,
+            args.file_size,
+            args.key_dir,
+        )
+    elif args.benchmark == "grpc":
+        result = bench_grpc(
+            args.keys, args.ops, args.value_sizes, args.read_ratios, args.server_args
+        )
+    elif args.benchmark == "merge":
+        result = bench_merge(args.keys, args.value_size, args.files, args.garbage)
+    elif args.benchmark == "mmap-read":
+        result = bench_mmap_read(args.keys, args.value_size, args.reads, args.file_size)
+    elif args.benchmark == "keydir-memory":
+        result = bench_keydir_memory(args.keys)
+    elif args.benchmark == "rebuild":
+        result = bench_rebuild(
+            args.keys,
+            args.writes or 2 * args.keys,
+            args.value_size,
+            args.file_size,
+            args.workers,
+        )
+    elif args.benchmark == "bloom":
+        result = bench_bloom(
+            args.files, args.keys_per_file, args.value_size, args.reads, args.budgets
+        )
+    elif args.benchmark == "tiered":
+        result = bench_tiered(
+            args.keys, args.value_size, args.reads, args.file_size, args.budgets
+        )
+    elif args.benchmark == "server-load":
+        result = bench_server_load(
+            args.modes,
+            args.keys,
+            args.clients,
+            args.channels,
+            args.requests,
+            args.value_size,
+            args.server_args,
+        )
+    elif args.benchmark == "compression":
+        result = bench_compression(
+            args.keys, args.value_size, args.reads, args.min_size, args.codecs
+        )
+    result["environment"] = _environment()
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
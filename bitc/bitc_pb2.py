@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\nbitc.proto"\x19\n\nGetRequest\x12\x0b\n\x03key\x18\x01 \x01(\t"(\n\nPutRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t"\x1c\n\rDeleteRequest\x12\x0b\n\x03key\x18\x01 \x01(\t"\x19\n\x08GetReply\x12\r\n\x05value\x18\x01 \x01(\t"\n\n\x08PutReply"\x1d\n\x0b\x44\x65leteReply\x12\x0e\n\x06result\x18\x01 \x01(\x08\x32\x83\x01\n\x15\x42itCdbKeyValueService\x12\x1f\n\x03get\x12\x0b.GetRequest\x1a\t.GetReply"\x00\x12\x1f\n\x03put\x12\x0b.PutRequest\x1a\t.PutReply"\x00\x12(\n\x06\x64\x65lete\x12\x0e.DeleteRequest\x1a\x0c.DeleteReply"\x00\x62\x06proto3'
+    b'\n\nbitc.proto"\x19\n\nGetRequest\x12\x0b\n\x03key\x18\x01 \x01(\t"5\n\nPutRequest\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x0b\n\x03ttl\x18\x03 \x01(\r"\x1c\n\rDeleteRequest\x12\x0b\n\x03key\x18\x01 \x01(\t"\x19\n\x08GetReply\x12\r\n\x05value\x18\x01 \x01(\t"\n\n\x08PutReply"\x1d\n\x0b\x44\x65leteReply\x12\x0e\n\x06result\x18\x01 \x01(\x08"3\n\x08KeyValue\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\x12\x0b\n\x03ttl\x18\x03 \x01(\r"\x1f\n\x0fMultiGetRequest\x12\x0c\n\x04keys\x18\x01 \x03(\t")\n\rMultiGetReply\x12\x18\n\x05items\x18\x01 \x03(\x0b\x32\t.KeyValue"+\n\x0fMultiPutRequest\x12\x18\n\x05items\x18\x01 \x03(\x0b\x32\t.KeyValue"\x0f\n\rMultiPutReply""\n\x12MultiDeleteRequest\x12\x0c\n\x04keys\x18\x01 \x03(\t"#\n\x10MultiDeleteReply\x12\x0f\n\x07results\x18\x01 \x03(\x08" \n\x0ePutStreamReply\x12\x0e\n\x06stored\x18\x01 \x01(\x04"\x1f\n\rExportRequest\x12\x0e\n\x06prefix\x18\x01 \x01(\t"H\n\x0bScanRequest\x12\r\n\x05start\x18\x01 \x01(\t\x12\x0b\n\x03\x65nd\x18\x02 \x01(\t\x12\r\n\x05limit\x18\x03 \x01(\r\x12\x0e\n\x06prefix\x18\x04 \x01(\t"G\n\tScanReply\x12\x18\n\x05items\x18\x01 \x03(\x0b\x32\t.KeyValue\x12\x12\n\nnext_start\x18\x02 \x01(\t\x12\x0c\n\x04more\x18\x03 \x01(\x08"\x1e\n\x0f\x42ytesGetRequest\x12\x0b\n\x03key\x18\x01 \x01(\x0c"-\n\rBytesGetReply\x12\r\n\x05value\x18\x01 \x01(\x0c\x12\r\n\x05\x66ound\x18\x02 \x01(\x08":\n\x0f\x42ytesPutRequest\x12\x0b\n\x03key\x18\x01 \x01(\x0c\x12\r\n\x05value\x18\x02 \x01(\x0c\x12\x0b\n\x03ttl\x18\x03 \x01(\r"!\n\x12\x42ytesDeleteRequest\x12\x0b\n\x03key\x18\x01 \x01(\x0c"G\n\rBytesKeyValue\x12\x0b\n\x03key\x18\x01 \x01(\x0c\x12\r\n\x05value\x18\x02 \x01(\x0c\x12\r\n\x05\x66ound\x18\x03 \x01(\x08\x12\x0b\n\x03ttl\x18\x04 \x01(\r"$\n\x14\x42ytesMultiGetRequest\x12\x0c\n\x04keys\x18\x01 \x03(\x0c"3\n\x12\x42ytesMultiGetReply\x12\x1d\n\x05items\x18\x01 \x03(\x0b\x32\x0e.BytesKeyValue"5\n\x14\x42ytesMultiPutRequest\x12\x1d\n\x05items\x18\x01 \x03(\x0b\x32\x0e.BytesKeyValue"\'\n\x17\x42ytesMultiDeleteRequest\x12\x0c\n\x04keys\x18\x01 \x03(\x0c"$\n\x12\x42ytesExportRequest\x12\x0e\n\x06prefix\x18\x01 \x01(\x0c"M\n\x10\x42ytesScanRequest\x12\r\n\x05start\x18\x01 \x01(\x0c\x12\x0b\n\x03\x65nd\x18\x02 \x01(\x0c\x12\r\n\x05limit\x18\x03 \x01(\r\x12\x0e\n\x06prefix\x18\x04 \x01(\x0c"Q\n\x0e\x42ytesScanReply\x12\x1d\n\x05items\x18\x01 \x03(\x0b\x32\x0e.BytesKeyValue\x12\x12\n\nnext_start\x18\x02 \x01(\x0c\x12\x0c\n\x04more\x18\x03 \x01(\x08\x32\x9e\x03\n\x15\x42itCdbKeyValueService\x12\x1f\n\x03get\x12\x0b.GetRequest\x1a\t.GetReply"\x00\x12\x1f\n\x03put\x12\x0b.PutRequest\x1a\t.PutReply"\x00\x12(\n\x06\x64\x65lete\x12\x0e.DeleteRequest\x1a\x0c.DeleteReply"\x00\x12/\n\tmulti_get\x12\x10.MultiGetRequest\x1a\x0e.MultiGetReply"\x00\x12/\n\tmulti_put\x12\x10.MultiPutRequest\x1a\x0e.MultiPutReply"\x00\x12\x38\n\x0cmulti_delete\x12\x13.MultiDeleteRequest\x1a\x11.MultiDeleteReply"\x00\x12\x30\n\nput_stream\x12\x0b.PutRequest\x1a\x0f.PutStreamReply"\x00(\x01\x30\x01\x12\'\n\x06\x65xport\x12\x0e.ExportRequest\x1a\t.KeyValue"\x00\x30\x01\x12"\n\x04scan\x12\x0c.ScanRequest\x1a\n.ScanReply"\x00\x32\xe1\x03\n\x17\x42itCdbKeyValueServiceV2\x12)\n\x03get\x12\x10.BytesGetRequest\x1a\x0e.BytesGetReply"\x00\x12$\n\x03put\x12\x10.BytesPutRequest\x1a\t.PutReply"\x00\x12-\n\x06\x64\x65lete\x12\x13.BytesDeleteRequest\x1a\x0c.DeleteReply"\x00\x12\x39\n\tmulti_get\x12\x15.BytesMultiGetRequest\x1a\x13.BytesMultiGetReply"\x00\x12\x34\n\tmulti_put\x12\x15.BytesMultiPutRequest\x1a\x0e.MultiPutReply"\x00\x12=\n\x0cmulti_delete\x12\x18.BytesMultiDeleteRequest\x1a\x11.MultiDeleteReply"\x00\x12\x35\n\nput_stream\x12\x10.BytesPutRequest\x1a\x0f.PutStreamReply"\x00(\x01\x30\x01\x12\x31\n\x06\x65xport\x12\x13.BytesExportRequest\x1a\x0e.BytesKeyValue"\x00\x30\x01\x12,\n\x04scan\x12\x11.BytesScanRequest\x1a\x0f.BytesScanReply"\x00\x62\x06proto3'
 )
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
@@ -24,15 +24,63 @@ if _descriptor._USE_C_DESCRIPTORS == False:
     _GETREQUEST._serialized_start = 14
     _GETREQUEST._serialized_end = 39
     _PUTREQUEST._serialized_start = 41
-    _PUTREQUEST._serialized_end = 81
-    _DELETEREQUEST._serialized_start = 83
-    _DELETEREQUEST._serialized_end = 111
-    _GETREPLY._serialized_start = 113
-    _GETREPLY._serialized_end = 138
-    _PUTREPLY._serialized_start = 140
-    _PUTREPLY._serialized_end = 150
-    _DELETEREPLY._serialized_start = 152
-    _DELETEREPLY._serialized_end = 181
-    _BITCDBKEYVALUESERVICE._serialized_start = 184
-    _BITCDBKEYVALUESERVICE._serialized_end = 315
+    _PUTREQUEST._serialized_end = 94
+    _DELETEREQUEST._serialized_start = 96
+    _DELETEREQUEST._serialized_end = 124
+    _GETREPLY._serialized_start = 126
+    _GETREPLY._serialized_end = 151
+    _PUTREPLY._serialized_start = 153
+    _PUTREPLY._serialized_end = 163
+    _DELETEREPLY._serialized_start = 165
+    _DELETEREPLY._serialized_end = 194
+    _KEYVALUE._serialized_start = 196
+    _KEYVALUE._serialized_end = 247
+    _MULTIGETREQUEST._serialized_start = 249
+    _MULTIGETREQUEST._serialized_end = 280
+    _MULTIGETREPLY._serialized_start = 282
+    _MULTIGETREPLY._serialized_end = 323
+    _MULTIPUTREQUEST._serialized_start = 325
+    _MULTIPUTREQUEST._serialized_end = 368
+    _MULTIPUTREPLY._serialized_start = 370
+    _MULTIPUTREPLY._serialized_end = 385
+    _MULTIDELETEREQUEST._serialized_start = 387
+    _MULTIDELETEREQUEST._serialized_end = 421
+    _MULTIDELETEREPLY._serialized_start = 423
+    _MULTIDELETEREPLY._serialized_end = 458
+    _PUTSTREAMREPLY._serialized_start = 460
+    _PUTSTREAMREPLY._serialized_end = 492
+    _EXPORTREQUEST._serialized_start = 494
+    _EXPORTREQUEST._serialized_end = 525
+    _SCANREQUEST._serialized_start = 527
+    _SCANREQUEST._serialized_end = 599
+    _SCANREPLY._serialized_start = 601
+    _SCANREPLY._serialized_end = 672
+    _BYTESGETREQUEST._serialized_start = 674
+    _BYTESGETREQUEST._serialized_end = 704
+    _BYTESGETREPLY._serialized_start = 706
+    _BYTESGETREPLY._serialized_end = 751
+    _BYTESPUTREQUEST._serialized_start = 753
+    _BYTESPUTREQUEST._serialized_end = 811
+    _BYTESDELETEREQUEST._serialized_start = 813
+    _BYTESDELETEREQUEST._serialized_end = 846
+    _BYTESKEYVALUE._serialized_start = 848
+    _BYTESKEYVALUE._serialized_end = 919
+    _BYTESMULTIGETREQUEST._serialized_start = 921
+    _BYTESMULTIGETREQUEST._serialized_end = 957
+    _BYTESMULTIGETREPLY._serialized_start = 959
+    _BYTESMULTIGETREPLY._serialized_end = 1010
+    _BYTESMULTIPUTREQUEST._serialized_start = 1012
+    _BYTESMULTIPUTREQUEST._serialized_end = 1065
+    _BYTESMULTIDELETEREQUEST._serialized_start = 1067
+    _BYTESMULTIDELETEREQUEST._serialized_end = 1106
+    _BYTESEXPORTREQUEST._serialized_start = 1108
+    _BYTESEXPORTREQUEST._serialized_end = 1144
+    _BYTESSCANREQUEST._serialized_start = 1146
+    _BYTESSCANREQUEST._serialized_end = 1223
+    _BYTESSCANREPLY._serialized_start = 1225
+    _BYTESSCANREPLY._serialized_end = 1306
+    _BITCDBKEYVALUESERVICE._serialized_start = 1309
+    _BITCDBKEYVALUESERVICE._serialized_end = 1723
+    _BITCDBKEYVALUESERVICEV2._serialized_start = 1726
+    _BITCDBKEYVALUESERVICEV2._serialized_end = 2207
 # @@protoc_insertion_point(module_scope)
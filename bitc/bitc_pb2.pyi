@@ -1,9 +1,136 @@
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import (
+    ClassVar as _ClassVar,
+    Iterable as _Iterable,
+    Mapping as _Mapping,
+    Optional as _Optional,
+    Union as _Union,
+)
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
+class BytesDeleteRequest(_message.Message):
+    __slots__ = ["key"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    key: bytes
+    def __init__(self, key: _Optional[bytes] = ...) -> None: ...
+
+class BytesExportRequest(_message.Message):
+    __slots__ = ["prefix"]
+    PREFIX_FIELD_NUMBER: _ClassVar[int]
+    prefix: bytes
+    def __init__(self, prefix: _Optional[bytes] = ...) -> None: ...
+
+class BytesGetReply(_message.Message):
+    __slots__ = ["found", "value"]
+    FOUND_FIELD_NUMBER: _ClassVar[int]
+    VALUE_FIELD_NUMBER: _ClassVar[int]
+    found: bool
+    value: bytes
+    def __init__(self, value: _Optional[bytes] = ..., found: bool = ...) -> None: ...
+
+class BytesGetRequest(_message.Message):
+    __slots__ = ["key"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    key: bytes
+    def __init__(self, key: _Optional[bytes] = ...) -> None: ...
+
+class BytesKeyValue(_message.Message):
+    __slots__ = ["found", "key", "ttl", "value"]
+    FOUND_FIELD_NUMBER: _ClassVar[int]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    TTL_FIELD_NUMBER: _ClassVar[int]
+    VALUE_FIELD_NUMBER: _ClassVar[int]
+    found: bool
+    key: bytes
+    ttl: int
+    value: bytes
+    def __init__(
+        self,
+        key: _Optional[bytes] = ...,
+        value: _Optional[bytes] = ...,
+        found: bool = ...,
+        ttl: _Optional[int] = ...,
+    ) -> None: ...
+
+class BytesMultiDeleteRequest(_message.Message):
+    __slots__ = ["keys"]
+    KEYS_FIELD_NUMBER: _ClassVar[int]
+    keys: _containers.RepeatedScalarFieldContainer[bytes]
+    def __init__(self, keys: _Optional[_Iterable[bytes]] = ...) -> None: ...
+
+class BytesMultiGetReply(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[BytesKeyValue]
+    def __init__(
+        self, items: _Optional[_Iterable[_Union[BytesKeyValue, _Mapping]]] = ...
+    ) -> None: ...
+
+class BytesMultiGetRequest(_message.Message):
+    __slots__ = ["keys"]
+    KEYS_FIELD_NUMBER: _ClassVar[int]
+    keys: _containers.RepeatedScalarFieldContainer[bytes]
+    def __init__(self, keys: _Optional[_Iterable[bytes]] = ...) -> None: ...
+
+class BytesMultiPutRequest(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[BytesKeyValue]
+    def __init__(
+        self, items: _Optional[_Iterable[_Union[BytesKeyValue, _Mapping]]] = ...
+    ) -> None: ...
+
+class BytesPutRequest(_message.Message):
+    __slots__ = ["key", "ttl", "value"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    TTL_FIELD_NUMBER: _ClassVar[int]
+    VALUE_FIELD_NUMBER: _ClassVar[int]
+    key: bytes
+    ttl: int
+    value: bytes
+    def __init__(
+        self,
+        key: _Optional[bytes] = ...,
+        value: _Optional[bytes] = ...,
+        ttl: _Optional[int] = ...,
+    ) -> None: ...
+
+class BytesScanReply(_message.Message):
+    __slots__ = ["items", "more", "next_start"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    MORE_FIELD_NUMBER: _ClassVar[int]
+    NEXT_START_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[BytesKeyValue]
+    more: bool
+    next_start: bytes
+    def __init__(
+        self,
+        items: _Optional[_Iterable[_Union[BytesKeyValue, _Mapping]]] = ...,
+        next_start: _Optional[bytes] = ...,
+        more: bool = ...,
+    ) -> None: ...
+
+class BytesScanRequest(_message.Message):
+    __slots__ = ["end", "limit", "prefix", "start"]
+    END_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    PREFIX_FIELD_NUMBER: _ClassVar[int]
+    START_FIELD_NUMBER: _ClassVar[int]
+    end: bytes
+    limit: int
+    prefix: bytes
+    start: bytes
+    def __init__(
+        self,
+        start: _Optional[bytes] = ...,
+        end: _Optional[bytes] = ...,
+        limit: _Optional[int] = ...,
+        prefix: _Optional[bytes] = ...,
+    ) -> None: ...
+
 class DeleteReply(_message.Message):
     __slots__ = ["result"]
     RESULT_FIELD_NUMBER: _ClassVar[int]
@@ -16,6 +143,12 @@ class DeleteRequest(_message.Message):
     key: str
     def __init__(self, key: _Optional[str] = ...) -> None: ...
 
+class ExportRequest(_message.Message):
+    __slots__ = ["prefix"]
+    PREFIX_FIELD_NUMBER: _ClassVar[int]
+    prefix: str
+    def __init__(self, prefix: _Optional[str] = ...) -> None: ...
+
 class GetReply(_message.Message):
     __slots__ = ["value"]
     VALUE_FIELD_NUMBER: _ClassVar[int]
@@ -28,16 +161,113 @@ class GetRequest(_message.Message):
     key: str
     def __init__(self, key: _Optional[str] = ...) -> None: ...
 
+class KeyValue(_message.Message):
+    __slots__ = ["key", "ttl", "value"]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    TTL_FIELD_NUMBER: _ClassVar[int]
+    VALUE_FIELD_NUMBER: _ClassVar[int]
+    key: str
+    ttl: int
+    value: str
+    def __init__(
+        self,
+        key: _Optional[str] = ...,
+        value: _Optional[str] = ...,
+        ttl: _Optional[int] = ...,
+    ) -> None: ...
+
+class MultiDeleteReply(_message.Message):
+    __slots__ = ["results"]
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    results: _containers.RepeatedScalarFieldContainer[bool]
+    def __init__(self, results: _Optional[_Iterable[bool]] = ...) -> None: ...
+
+class MultiDeleteRequest(_message.Message):
+    __slots__ = ["keys"]
+    KEYS_FIELD_NUMBER: _ClassVar[int]
+    keys: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, keys: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class MultiGetReply(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[KeyValue]
+    def __init__(
+        self, items: _Optional[_Iterable[_Union[KeyValue, _Mapping]]] = ...
+    ) -> None: ...
+
+class MultiGetRequest(_message.Message):
+    __slots__ = ["keys"]
+    KEYS_FIELD_NUMBER: _ClassVar[int]
+    keys: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, keys: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class MultiPutReply(_message.Message):
+    __slots__ = []
+    def __init__(self) -> None: ...
+
+class MultiPutRequest(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[KeyValue]
+    def __init__(
+        self, items: _Optional[_Iterable[_Union[KeyValue, _Mapping]]] = ...
+    ) -> None: ...
+
 class PutReply(_message.Message):
     __slots__ = []
     def __init__(self) -> None: ...
 
 class PutRequest(_message.Message):
-    __slots__ = ["key", "value"]
+    __slots__ = ["key", "ttl", "value"]
     KEY_FIELD_NUMBER: _ClassVar[int]
+    TTL_FIELD_NUMBER: _ClassVar[int]
     VALUE_FIELD_NUMBER: _ClassVar[int]
     key: str
+    ttl: int
     value: str
     def __init__(
-        self, key: _Optional[str] = ..., value: _Optional[str] = ...
+        self,
+        key: _Optional[str] = ...,
+        value: _Optional[str] = ...,
+        ttl: _Optional[int] = ...,
+    ) -> None: ...
+
+class PutStreamReply(_message.Message):
+    __slots__ = ["stored"]
+    STORED_FIELD_NUMBER: _ClassVar[int]
+    stored: int
+    def __init__(self, stored: _Optional[int] = ...) -> None: ...
+
+class ScanReply(_message.Message):
+    __slots__ = ["items", "more", "next_start"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    MORE_FIELD_NUMBER: _ClassVar[int]
+    NEXT_START_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[KeyValue]
+    more: bool
+    next_start: str
+    def __init__(
+        self,
+        items: _Optional[_Iterable[_Union[KeyValue, _Mapping]]] = ...,
+        next_start: _Optional[str] = ...,
+        more: bool = ...,
+    ) -> None: ...
+
+class ScanRequest(_message.Message):
+    __slots__ = ["end", "limit", "prefix", "start"]
+    END_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    PREFIX_FIELD_NUMBER: _ClassVar[int]
+    START_FIELD_NUMBER: _ClassVar[int]
+    end: str
+    limit: int
+    prefix: str
+    start: str
+    def __init__(
+        self,
+        start: _Optional[str] = ...,
+        end: _Optional[str] = ...,
+        limit: _Optional[int] = ...,
+        prefix: _Optional[str] = ...,
     ) -> None: ...
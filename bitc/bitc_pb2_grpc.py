@@ -29,6 +29,36 @@ class BitCdbKeyValueServiceStub(object):
             request_serializer=bitc__pb2.DeleteRequest.SerializeToString,
             response_deserializer=bitc__pb2.DeleteReply.FromString,
         )
+        self.multi_get = channel.unary_unary(
+            "/BitCdbKeyValueService/multi_get",
+            request_serializer=bitc__pb2.MultiGetRequest.SerializeToString,
+            response_deserializer=bitc__pb2.MultiGetReply.FromString,
+        )
+        self.multi_put = channel.unary_unary(
+            "/BitCdbKeyValueService/multi_put",
+            request_serializer=bitc__pb2.MultiPutRequest.SerializeToString,
+            response_deserializer=bitc__pb2.MultiPutReply.FromString,
+        )
+        self.multi_delete = channel.unary_unary(
+            "/BitCdbKeyValueService/multi_delete",
+            request_serializer=bitc__pb2.MultiDeleteRequest.SerializeToString,
+            response_deserializer=bitc__pb2.MultiDeleteReply.FromString,
+        )
+        self.put_stream = channel.stream_stream(
+            "/BitCdbKeyValueService/put_stream",
+            request_serializer=bitc__pb2.PutRequest.SerializeToString,
+            response_deserializer=bitc__pb2.PutStreamReply.FromString,
+        )
+        self.export = channel.unary_stream(
+            "/BitCdbKeyValueService/export",
+            request_serializer=bitc__pb2.ExportRequest.SerializeToString,
+            response_deserializer=bitc__pb2.KeyValue.FromString,
+        )
+        self.scan = channel.unary_unary(
+            "/BitCdbKeyValueService/scan",
+            request_serializer=bitc__pb2.ScanRequest.SerializeToString,
+            response_deserializer=bitc__pb2.ScanReply.FromString,
+        )
 
 
 class BitCdbKeyValueServiceServicer(object):
@@ -52,6 +82,42 @@ class BitCdbKeyValueServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def multi_get(self, request, context):
+        """Batch handlers, a multi_put is written as a single batch"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def multi_put(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def multi_delete(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def put_stream(self, request_iterator, context):
+        """Bulk load over one stream, acked after every stored batch"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def export(self, request, context):
+        """Every live key/value, in data file order"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def scan(self, request, context):
+        """One page of keys in lexicographic order, needs the ordered index"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
 
 def add_BitCdbKeyValueServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -70,6 +136,36 @@ def add_BitCdbKeyValueServiceServicer_to_server(servicer, server):
             request_deserializer=bitc__pb2.DeleteRequest.FromString,
             response_serializer=bitc__pb2.DeleteReply.SerializeToString,
         ),
+        "multi_get": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_get,
+            request_deserializer=bitc__pb2.MultiGetRequest.FromString,
+            response_serializer=bitc__pb2.MultiGetReply.SerializeToString,
+        ),
+        "multi_put": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_put,
+            request_deserializer=bitc__pb2.MultiPutRequest.FromString,
+            response_serializer=bitc__pb2.MultiPutReply.SerializeToString,
+        ),
+        "multi_delete": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_delete,
+            request_deserializer=bitc__pb2.MultiDeleteRequest.FromString,
+            response_serializer=bitc__pb2.MultiDeleteReply.SerializeToString,
+        ),
+        "put_stream": grpc.stream_stream_rpc_method_handler(
+            servicer.put_stream,
+            request_deserializer=bitc__pb2.PutRequest.FromString,
+            response_serializer=bitc__pb2.PutStreamReply.SerializeToString,
+        ),
+        "export": grpc.unary_stream_rpc_method_handler(
+            servicer.export,
+            request_deserializer=bitc__pb2.ExportRequest.FromString,
+            response_serializer=bitc__pb2.KeyValue.SerializeToString,
+        ),
+        "scan": grpc.unary_unary_rpc_method_handler(
+            servicer.scan,
+            request_deserializer=bitc__pb2.ScanRequest.FromString,
+            response_serializer=bitc__pb2.ScanReply.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
         "BitCdbKeyValueService", rpc_method_handlers
@@ -167,3 +263,617 @@ class BitCdbKeyValueService(object):
             timeout,
             metadata,
         )
+
+    @staticmethod
+    def multi_get(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueService/multi_get",
+            bitc__pb2.MultiGetRequest.SerializeToString,
+            bitc__pb2.MultiGetReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def multi_put(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueService/multi_put",
+            bitc__pb2.MultiPutRequest.SerializeToString,
+            bitc__pb2.MultiPutReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def multi_delete(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueService/multi_delete",
+            bitc__pb2.MultiDeleteRequest.SerializeToString,
+            bitc__pb2.MultiDeleteReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def put_stream(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            "/BitCdbKeyValueService/put_stream",
+            bitc__pb2.PutRequest.SerializeToString,
+            bitc__pb2.PutStreamReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def export(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            "/BitCdbKeyValueService/export",
+            bitc__pb2.ExportRequest.SerializeToString,
+            bitc__pb2.KeyValue.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def scan(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueService/scan",
+            bitc__pb2.ScanRequest.SerializeToString,
+            bitc__pb2.ScanReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+
+class BitCdbKeyValueServiceV2Stub(object):
+    """Binary safe version of BitCdbKeyValueService, keys and values are
+    stored and returned as they are sent.
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.get = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/get",
+            request_serializer=bitc__pb2.BytesGetRequest.SerializeToString,
+            response_deserializer=bitc__pb2.BytesGetReply.FromString,
+        )
+        self.put = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/put",
+            request_serializer=bitc__pb2.BytesPutRequest.SerializeToString,
+            response_deserializer=bitc__pb2.PutReply.FromString,
+        )
+        self.delete = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/delete",
+            request_serializer=bitc__pb2.BytesDeleteRequest.SerializeToString,
+            response_deserializer=bitc__pb2.DeleteReply.FromString,
+        )
+        self.multi_get = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/multi_get",
+            request_serializer=bitc__pb2.BytesMultiGetRequest.SerializeToString,
+            response_deserializer=bitc__pb2.BytesMultiGetReply.FromString,
+        )
+        self.multi_put = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/multi_put",
+            request_serializer=bitc__pb2.BytesMultiPutRequest.SerializeToString,
+            response_deserializer=bitc__pb2.MultiPutReply.FromString,
+        )
+        self.multi_delete = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/multi_delete",
+            request_serializer=bitc__pb2.BytesMultiDeleteRequest.SerializeToString,
+            response_deserializer=bitc__pb2.MultiDeleteReply.FromString,
+        )
+        self.put_stream = channel.stream_stream(
+            "/BitCdbKeyValueServiceV2/put_stream",
+            request_serializer=bitc__pb2.BytesPutRequest.SerializeToString,
+            response_deserializer=bitc__pb2.PutStreamReply.FromString,
+        )
+        self.export = channel.unary_stream(
+            "/BitCdbKeyValueServiceV2/export",
+            request_serializer=bitc__pb2.BytesExportRequest.SerializeToString,
+            response_deserializer=bitc__pb2.BytesKeyValue.FromString,
+        )
+        self.scan = channel.unary_unary(
+            "/BitCdbKeyValueServiceV2/scan",
+            request_serializer=bitc__pb2.BytesScanRequest.SerializeToString,
+            response_deserializer=bitc__pb2.BytesScanReply.FromString,
+        )
+
+
+class BitCdbKeyValueServiceV2Servicer(object):
+    """Binary safe version of BitCdbKeyValueService, keys and values are
+    stored and returned as they are sent.
+    """
+
+    def get(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def put(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def delete(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def multi_get(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def multi_put(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def multi_delete(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def put_stream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def export(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def scan(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+
+def add_BitCdbKeyValueServiceV2Servicer_to_server(servicer, server):
+    rpc_method_handlers = {
+        "get": grpc.unary_unary_rpc_method_handler(
+            servicer.get,
+            request_deserializer=bitc__pb2.BytesGetRequest.FromString,
+            response_serializer=bitc__pb2.BytesGetReply.SerializeToString,
+        ),
+        "put": grpc.unary_unary_rpc_method_handler(
+            servicer.put,
+            request_deserializer=bitc__pb2.BytesPutRequest.FromString,
+            response_serializer=bitc__pb2.PutReply.SerializeToString,
+        ),
+        "delete": grpc.unary_unary_rpc_method_handler(
+            servicer.delete,
+            request_deserializer=bitc__pb2.BytesDeleteRequest.FromString,
+            response_serializer=bitc__pb2.DeleteReply.SerializeToString,
+        ),
+        "multi_get": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_get,
+            request_deserializer=bitc__pb2.BytesMultiGetRequest.FromString,
+            response_serializer=bitc__pb2.BytesMultiGetReply.SerializeToString,
+        ),
+        "multi_put": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_put,
+            request_deserializer=bitc__pb2.BytesMultiPutRequest.FromString,
+            response_serializer=bitc__pb2.MultiPutReply.SerializeToString,
+        ),
+        "multi_delete": grpc.unary_unary_rpc_method_handler(
+            servicer.multi_delete,
+            request_deserializer=bitc__pb2.BytesMultiDeleteRequest.FromString,
+            response_serializer=bitc__pb2.MultiDeleteReply.SerializeToString,
+        ),
+        "put_stream": grpc.stream_stream_rpc_method_handler(
+            servicer.put_stream,
+            request_deserializer=bitc__pb2.BytesPutRequest.FromString,
+            response_serializer=bitc__pb2.PutStreamReply.SerializeToString,
+        ),
+        "export": grpc.unary_stream_rpc_method_handler(
+            servicer.export,
+            request_deserializer=bitc__pb2.BytesExportRequest.FromString,
+            response_serializer=bitc__pb2.BytesKeyValue.SerializeToString,
+        ),
+        "scan": grpc.unary_unary_rpc_method_handler(
+            servicer.scan,
+            request_deserializer=bitc__pb2.BytesScanRequest.FromString,
+            response_serializer=bitc__pb2.BytesScanReply.SerializeToString,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+        "BitCdbKeyValueServiceV2", rpc_method_handlers
+    )
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+# This class is part of an EXPERIMENTAL API.
+class BitCdbKeyValueServiceV2(object):
+    """Binary safe version of BitCdbKeyValueService, keys and values are
+    stored and returned as they are sent.
+    """
+
+    @staticmethod
+    def get(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/get",
+            bitc__pb2.BytesGetRequest.SerializeToString,
+            bitc__pb2.BytesGetReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def put(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/put",
+            bitc__pb2.BytesPutRequest.SerializeToString,
+            bitc__pb2.PutReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def delete(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/delete",
+            bitc__pb2.BytesDeleteRequest.SerializeToString,
+            bitc__pb2.DeleteReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def multi_get(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/multi_get",
+            bitc__pb2.BytesMultiGetRequest.SerializeToString,
+            bitc__pb2.BytesMultiGetReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def multi_put(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/multi_put",
+            bitc__pb2.BytesMultiPutRequest.SerializeToString,
+            bitc__pb2.MultiPutReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def multi_delete(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/multi_delete",
+            bitc__pb2.BytesMultiDeleteRequest.SerializeToString,
+            bitc__pb2.MultiDeleteReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def put_stream(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            "/BitCdbKeyValueServiceV2/put_stream",
+            bitc__pb2.BytesPutRequest.SerializeToString,
+            bitc__pb2.PutStreamReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def export(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/export",
+            bitc__pb2.BytesExportRequest.SerializeToString,
+            bitc__pb2.BytesKeyValue.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def scan(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/BitCdbKeyValueServiceV2/scan",
+            bitc__pb2.BytesScanRequest.SerializeToString,
+            bitc__pb2.BytesScanReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
@@ -1,44 +1,233 @@
 import glob
+import heapq
 import logging
+import multiprocessing
 import os
 import tempfile
 import time
-from threading import RLock
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Condition, Lock, RLock, Thread
 
-from bitc.consts import DATAFILE_START_INDEX, DATA_HEADER_SIZE, TOMBSTONE_ENTRY
+from bitc.consts import DATAFILE_START_INDEX, DATA_HEADER_SIZE
+from bitc.bloom import BloomFilter, BloomFilterCache, key_hashes, write_bloom_file
+from bitc.cache import ValueCache
 from bitc.logger import CustomAdapter
+from bitc.utils import CaskIOException
 from bitc.cask_file import (
+    CaskDataEncoder,
     CaskDataFile,
+    CaskHintEncoder,
     CaskHintFile,
+    lookup_data_file,
+    lookup_hint_file,
+    scan_data_file,
+    scan_file_entries,
+    scan_hint_file,
 )
-from bitc import utils
+from bitc.compression import codec_id
+from bitc.index_file import read_index_file, write_index_file
+from bitc.snapshot import read_snapshot, write_snapshot
+from bitc import consts, metrics, utils
 
 
 class CaskKeyDirEntry(object):
-    def __init__(self, file_obj, value_size, value_pos, tstamp):
+    __slots__ = ("value_size", "value_pos", "tstamp", "file_obj", "expires")
+
+    def __init__(self, file_obj, value_size, value_pos, tstamp, expires=0):
         self.value_size = value_size
         self.value_pos = value_pos
         self.tstamp = tstamp
         self.file_obj = file_obj
+        # Epoch seconds the key expires at, 0 if it never does
+        self.expires = expires
+
+    def expired(self, now):
+        return 0 < self.expires <= now
 
     def __repr__(self):
-        return "size={},position={},timestamp={}, filename={}".format(
-            self.value_size, self.value_pos, self.tstamp, self.file_name
+        return "size={},position={},timestamp={},expires={}, filename={}".format(
+            self.value_size,
+            self.value_pos,
+            self.tstamp,
+            self.expires,
+            self.file_obj.basename,
         )
 
 
+class CaskWriteOp(object):
+    """A store or delete waiting in the group commit queue."""
+
+    __slots__ = (
+        "key",
+        "value",
+        "is_delete",
+        "expires",
+        "size",
+        "done",
+        "result",
+        "error",
+    )
+
+    def __init__(self, key, value, is_delete=False, expires=0):
+        self.key = utils.to_bytes(key)
+        self.value = utils.to_bytes(value)
+        self.is_delete = is_delete
+        self.expires = expires
+        self.size = DATA_HEADER_SIZE + len(self.key) + len(self.value)
+        if expires:
+            self.size += consts.EXPIRY_SIZE
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class CaskMergeOutput(object):
+    """
+    A data and hint file pair written by merge, with the Bloom filter of
+    the data file and, with sorted_index, its sorted index. Record bytes
+    are copied as they are from the source file, only hint entries are
+    encoded.
+    """
+
+    def __init__(self, path, file_id, sorted_index=False):
+        self.file_id = file_id
+        self.data_file = CaskDataFile(path, file_id, False)
+        self.hint_file = CaskHintFile(path, file_id, False)
+        self.size = 0
+        self._hint_encoder = CaskHintEncoder()
+        self._hint_buf = bytearray()
+        # key: (data file, offset) of the record copied for it, only keys
+        # the KeyDir still points there are moved over
+        self.moved = {}
+        self._sorted_index = sorted_index
+        # Later records of a key win, as in a hint file
+        self._entries = {}
+
+    def add_entry(
+        self, timestamp, key, entry_size, expires=0, tombstone=False, moved_from=None
+    ):
+        """
+        Account for a record that the next copy() call will write.
+        moved_from is the (data file, offset) of the copied record when the
+        KeyDir points at it.
+        """
+        self._entries[key] = (entry_size, self.size, timestamp, expires, tombstone)
+        if moved_from is not None:
+            self.moved[key] = moved_from
+        self._hint_buf += self._hint_encoder.encode(
+            timestamp, key, self.size, entry_size, expires, tombstone
+        )
+        self.size += entry_size
+        if len(self._hint_buf) >= consts.MERGE_BUFFER_SIZE:
+            self.hint_file.append(self._hint_buf)
+            self._hint_buf = bytearray()
+
+    def copy(self, raw_entries):
+        self.data_file.append(raw_entries)
+
+    def finish(self, sync):
+        if self._hint_buf:
+            self.hint_file.append(self._hint_buf)
+        if sync:
+            self.data_file.sync()
+            self.hint_file.sync()
+        self.data_file.close()
+        self.hint_file.close()
+        write_bloom_file(
+            utils.get_bloom_filename_for_data_file(self.data_file.name),
+            BloomFilter.for_keys(self._entries),
+            sync,
+        )
+        if self._sorted_index:
+            write_index_file(
+                utils.get_index_filename_for_data_file(self.data_file.name),
+                self._entries,
+                sync,
+            )
+
+
 class CaskStorage(object):
-    def __init__(self, file_path, key_dir, os_sync=True, max_file_size=100):
+    def __init__(
+        self,
+        file_path,
+        key_dir,
+        max_file_size=100,
+        durability=consts.DURABILITY_ALWAYS,
+        batch_window_ms=consts.DEFAULT_BATCH_WINDOW_MS,
+        batch_max_bytes=consts.DEFAULT_BATCH_MAX_BYTES,
+        use_mmap=False,
+        merge_bytes_per_sec=0,
+        cache_bytes=0,
+        compression="none",
+        compression_min_size=consts.DEFAULT_COMPRESSION_MIN_SIZE,
+        keydir_snapshot=False,
+        bloom_cache_bytes=consts.DEFAULT_BLOOM_CACHE_BYTES,
+    ):
+        if durability not in consts.DURABILITY_MODES:
+            raise ValueError("Unknown durability mode {}".format(durability))
         self._file_path = file_path
         self._key_dir = key_dir
         self._data_file = None
         self._hint_file = None
         self._next_id = self._get_next_id()
-        self._os_sync = os_sync
+        self._durability = durability
+        self._os_sync = durability != consts.DURABILITY_OS
+        self._batch_window = batch_window_ms / 1000.0
+        self._batch_max_bytes = batch_max_bytes
         self._max_file_size = max_file_size
+        self._use_mmap = use_mmap
         self._read_files = {}
-        self._lock = RLock()
+        self._rebuild_progress = {}
+        # While the index loads in the background: data files not indexed
+        # yet, newest first, and keys deleted before their file was indexed.
+        self._unindexed_files = ()
+        self._loading_deletes = set()
+        self._lock = metrics.TimedLock(RLock(), metrics.LOCK_WAIT)
         self._merge_running = False
+        self._merge_bytes_per_sec = merge_bytes_per_sec
+        # Bytes of each data file no longer referenced by the KeyDir,
+        # guarded by _lock
+        self._dead_bytes = {}
+        # Hot values, keyed by key and checked against the KeyDir entry
+        self._cache = ValueCache(cache_bytes) if cache_bytes > 0 else None
+        # Bloom filters of sealed data files, consulted for keys of files
+        # not indexed yet. Written whatever the budget, 0 only stops using them.
+        self._blooms = (
+            BloomFilterCache(bloom_cache_bytes) if bloom_cache_bytes > 0 else None
+        )
+        # A TieredKeyDir only holds part of the keys in memory, the rest is
+        # looked up in the sorted index files written next to hint files.
+        self._tiered = hasattr(key_dir, "attach_index")
+        # Threads writing the filter and sorted index of the files rotated
+        # out, by data file, guarded by _lock. close() and merge() wait
+        # for them.
+        self._seal_threads = {}
+        if self._tiered:
+            if keydir_snapshot:
+                raise ValueError("KeyDir snapshots need the whole KeyDir in memory")
+            key_dir.use_bloom_filters(self._blooms)
+        # Values are compressed when written, data files decode any codec
+        self._data_encoder = CaskDataEncoder(
+            codec_id(compression), compression_min_size
+        )
+        self._hint_encoder = CaskHintEncoder()
+        # KeyDir snapshots are written on demand and on close, and loaded
+        # by rebuild_index. Merges bump the generation, a snapshot taken
+        # before one is never published after it.
+        self._keydir_snapshot = keydir_snapshot
+        self._snapshot_path = os.path.join(file_path, consts.KEYDIR_SNAPSHOT_FILE)
+        self._snapshot_write_lock = Lock()
+        self._merge_generation = 0
+        # (expires, key) of every key written with a TTL, guarded by _lock.
+        # Entries go stale when the key is written again, sweep_expired
+        # checks them against the KeyDir.
+        self._expiry_heap = []
+        # Group commit state, guarded by _commit_cond
+        self._commit_cond = Condition()
+        self._pending = []
+        self._pending_bytes = 0
+        self._committing = False
         self.logger = CustomAdapter(
             logging.getLogger(__name__),
             {"logger": "{}".format("CASKSTORAGE")},
@@ -60,173 +249,1470 @@ class CaskStorage(object):
             self._hint_file = None
 
     def _create_new_data_file(self, file_id):
-        return CaskDataFile(self._file_path, file_id, False, os_sync=self._os_sync)
+        # Syncing is done per batch by the group commit, not per record
+        return CaskDataFile(self._file_path, file_id, False, use_mmap=self._use_mmap)
 
     def _create_new_hint_file(self, file_id):
-        return CaskHintFile(self._file_path, file_id, False, os_sync=self._os_sync)
+        return CaskHintFile(self._file_path, file_id, False)
+
+    def _publish_read_files(self, added=(), removed=()):
+        # _read_files is never mutated in place, readers and merge work on
+        # whatever snapshot they picked up while writers swap in a new map.
+        read_files = dict(self._read_files)
+        for basename in removed:
+            read_files.pop(basename, None)
+        for data_file in added:
+            read_files[data_file.basename] = data_file
+        self._read_files = read_files
 
     def _create_new_files(self):
+        # Appending to a file reopened after close() outdates its filter
+        # and sorted index
+        data_file_path = os.path.join(
+            self._file_path, consts.DATA_FILE_NAME_FORMAT.format(self._next_id)
+        )
+        for path in (
+            utils.get_bloom_filename_for_data_file(data_file_path),
+            utils.get_index_filename_for_data_file(data_file_path),
+        ):
+            if os.path.exists(path):
+                os.remove(path)
         self._data_file = self._create_new_data_file(self._next_id)
         self._hint_file = self._create_new_hint_file(self._next_id)
-        self._read_files[self._data_file.basename] = self._data_file
+        if self._tiered:
+            self._key_dir.track_file(self._data_file)
+        self._dead_bytes[self._data_file] = 0
+        self._publish_read_files(added=(self._data_file,))
 
     def _rotate_files(self):
-        last_write_file = self._data_file
         self._next_id += 1
+        # Sealed rather than closed, in flight readers may still hold it.
+        # Sealing also maps the file when mmap reads are enabled.
+        sealed = self._data_file
+        sealed.seal()
+        self._data_file = None
         self._close_current_write_files()
-        self._data_file = self._create_new_data_file(self._next_id)
-        self._hint_file = self._create_new_hint_file(self._next_id)
-        self._read_files[last_write_file.basename] = CaskDataFile(
-            self._file_path, last_write_file.file_id, True
-        )
-        self._read_files[self._data_file.basename] = self._data_file
+        self._create_new_files()
+        # Built from the hint file off the write path
+        thread = Thread(target=self._seal_in_background, args=(sealed,), daemon=True)
+        self._seal_threads[sealed] = thread
+        thread.start()
+
+    def _seal_in_background(self, data_file):
+        try:
+            self._seal_file(data_file)
+        finally:
+            with self._lock:
+                self._seal_threads.pop(data_file, None)
+
+    def _wait_for_seals(self, files=None):
+        """Wait for the seal threads of files, by default of every file."""
+        with self._lock:
+            threads = [
+                thread
+                for data_file, thread in self._seal_threads.items()
+                if files is None or data_file in files
+            ]
+        for thread in threads:
+            thread.join()
 
-    def _check_write(self, data_len):
+    def _is_current(self, data_file):
+        return self._read_files.get(data_file.basename) is data_file
+
+    def _seal_file(self, data_file):
+        """
+        Write the Bloom filter of a sealed data file and, with a tiered
+        KeyDir, its sorted index, both from its hint file. Skipped once a
+        merge replaced the file.
+        """
+        if not self._is_current(data_file):
+            return
+        try:
+            entries = scan_file_entries(
+                utils.get_hint_filename_for_data_file(data_file.name)
+            )
+        except (OSError, CaskIOException) as ex:
+            if self._is_current(data_file):
+                self.logger.warning(
+                    "Could not read hint file of {}: {}".format(data_file.basename, ex)
+                )
+            return
+        self._write_bloom(data_file, entries)
+        if self._tiered:
+            self._write_sorted_index(data_file, entries)
+
+    def _write_sorted_index(self, data_file, entries):
+        """
+        Write the sorted index of data_file from entries, as returned by
+        scan_file_entries, and attach it to the KeyDir. Skipped like the
+        Bloom filter if a merge replaced data_file meanwhile.
+        """
+        path = utils.get_index_filename_for_data_file(data_file.name)
+        temp_path = path + ".tmp"
+        try:
+            write_index_file(temp_path, entries, self._os_sync)
+            index = read_index_file(temp_path)
+            if index is None:
+                raise CaskIOException("Unreadable index {}".format(temp_path))
+            with self._lock:
+                if self._is_current(data_file):
+                    os.replace(temp_path, path)
+                    self._key_dir.attach_index(data_file, index)
+                    return
+            os.remove(temp_path)
+        except (OSError, CaskIOException) as ex:
+            # Its entries stay in memory
+            self.logger.error(
+                "Could not write sorted index of {}: {}".format(data_file.basename, ex)
+            )
+
+    def _write_bloom(self, data_file, keys):
+        """
+        Write the Bloom filter of keys as the one of data_file. It is only
+        published while data_file is still the file of its id, a merge may
+        have replaced it in the meantime.
+        """
+        path = utils.get_bloom_filename_for_data_file(data_file.name)
+        temp_path = path + ".tmp"
+        try:
+            write_bloom_file(temp_path, BloomFilter.for_keys(keys), self._os_sync)
+            with self._lock:
+                if self._is_current(data_file):
+                    os.replace(temp_path, path)
+                    return
+            os.remove(temp_path)
+        except (OSError, CaskIOException) as ex:
+            self.logger.warning(
+                "Could not write Bloom filter of {}: {}".format(data_file.basename, ex)
+            )
+
+    def _check_write(self, entry_len):
         if self._data_file is None:
             self._create_new_files()
-        elif self._data_file.size + DATA_HEADER_SIZE + data_len > self._max_file_size:
+        elif (
+            self._data_file.size > 0
+            and self._data_file.size + entry_len > self._max_file_size
+        ):
             self._rotate_files()
 
-    def store(self, key, value):
-        with self._lock:
-            self._check_write(len(key) + len(value))
-            current_offset = self._data_file.size
-            timestamp = round(time.time())
-            self._data_file.write(timestamp, key, value)
-            entry_size = DATA_HEADER_SIZE + len(key) + len(value)
-            self._hint_file.write(key, timestamp, current_offset, entry_size)
-            self._key_dir.add(
-                key,
-                CaskKeyDirEntry(self._data_file, entry_size, current_offset, timestamp),
-            )
+    def _commit(self, ops):
+        """
+        Group commit. The first caller to find no commit in progress becomes
+        the leader, takes everything queued so far and writes it with one
+        write and one sync per file. Callers queued meanwhile wait until the
+        batch holding their ops is durable, then one of the leftovers leads
+        the next batch. The ops of one call are queued together, so they
+        always end up in the same batch.
+        """
+        batch = None
+        last_op = ops[-1]
+        with self._commit_cond:
+            self._pending.extend(ops)
+            self._pending_bytes += sum(op.size for op in ops)
+            self._commit_cond.notify_all()
+            while self._committing and not last_op.done:
+                self._commit_cond.wait()
+            if not last_op.done:
+                self._committing = True
+                if self._durability == consts.DURABILITY_BATCH:
+                    deadline = time.monotonic() + self._batch_window
+                    while self._pending_bytes < self._batch_max_bytes:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._commit_cond.wait(remaining)
+                batch, self._pending = self._pending, []
+                self._pending_bytes = 0
+        if batch is not None:
+            try:
+                self._write_batch(batch)
+            except Exception as ex:
+                self.logger.error(
+                    "Batch of {} writes failed: {}".format(len(batch), ex)
+                )
+                for pending_op in batch:
+                    pending_op.error = ex
+            finally:
+                with self._commit_cond:
+                    for pending_op in batch:
+                        pending_op.done = True
+                    self._committing = False
+                    self._commit_cond.notify_all()
+        if last_op.error is not None:
+            raise last_op.error
+        return [op.result for op in ops]
 
-    def retrieve(self, key):
+    def _write_batch(self, batch):
         with self._lock:
-            entry = self._key_dir.get(key)
-            if entry is not None:
-                data_file = self._read_files[entry.file_obj.basename]
-                self.logger.debug(
-                    "Reading size {} from offset {} from file {}".format(
-                        entry.value_size, entry.value_pos, data_file
+            data_buf, hint_buf, updates = bytearray(), bytearray(), []
+            # Key liveness as seen by earlier ops of this batch
+            live = {}
+            for op in batch:
+                exists = live[op.key] if op.key in live else self._exists(op.key)
+                if op.is_delete:
+                    op.result = exists
+                    if not exists:
+                        continue
+                timestamp = round(time.time())
+                entry = self._data_encoder.encode(
+                    timestamp, op.key, op.value, op.expires, op.is_delete
+                )
+                if (
+                    self._data_file is not None
+                    and self._data_file.size + len(data_buf) + len(entry)
+                    > self._max_file_size
+                ):
+                    self._flush_batch(data_buf, hint_buf, updates)
+                    data_buf, hint_buf, updates = bytearray(), bytearray(), []
+                self._check_write(len(entry))
+                current_offset = self._data_file.size + len(data_buf)
+                data_buf += entry
+                hint_buf += self._hint_encoder.encode(
+                    timestamp,
+                    op.key,
+                    current_offset,
+                    len(entry),
+                    op.expires,
+                    op.is_delete,
+                )
+                updates.append(
+                    (
+                        op,
+                        CaskKeyDirEntry(
+                            self._data_file,
+                            len(entry),
+                            current_offset,
+                            timestamp,
+                            op.expires,
+                        ),
                     )
                 )
-                return data_file.read(entry.value_pos, entry.value_size)
+                live[op.key] = not op.is_delete
+            self._flush_batch(data_buf, hint_buf, updates)
+
+    def _flush_batch(self, data_buf, hint_buf, updates):
+        if not data_buf:
+            return
+        self._data_file.append(data_buf)
+        self._hint_file.append(hint_buf)
+        if self._os_sync:
+            self._data_file.sync()
+            self._hint_file.sync()
+        # Only publish to the index once the batch is durable
+        for op, entry in updates:
+            if self._cache is not None:
+                self._cache.invalidate(op.key)
+            old_entry = self._key_dir.get(op.key)
+            if old_entry is not None:
+                self._mark_dead(old_entry.file_obj, old_entry.value_size)
+            if op.is_delete:
+                if self._unindexed_files:
+                    # Keep the background indexer from resurrecting it
+                    self._loading_deletes.add(op.key)
+                if old_entry is not None:
+                    self._key_dir.delete(op.key)
+                # The tombstone itself is garbage as soon as it is written
+                self._mark_dead(entry.file_obj, entry.value_size)
             else:
-                return None
+                self._key_dir.add(op.key, entry)
+                if entry.expires:
+                    heapq.heappush(self._expiry_heap, (entry.expires, op.key))
 
-    def delete(self, key):
+    def _mark_dead(self, data_file, size):
+        if data_file in self._dead_bytes:
+            self._dead_bytes[data_file] += size
+
+    def file_stats(self):
+        """Live and dead bytes of every data file, oldest first."""
         with self._lock:
+            return [
+                {
+                    "file": data_file.basename,
+                    "size": data_file.size,
+                    "dead_bytes": dead_bytes,
+                    "live_bytes": data_file.size - dead_bytes,
+                }
+                for data_file, dead_bytes in sorted(
+                    self._dead_bytes.items(), key=lambda item: item[0].file_id
+                )
+            ]
+
+    def merge_candidates(self, dead_ratio, min_dead_bytes):
+        """
+        Rotated data files worth compacting: at least dead_ratio of the file
+        or min_dead_bytes of it is garbage.
+        """
+        with self._lock:
+            return [
+                data_file
+                for data_file, dead_bytes in self._dead_bytes.items()
+                if data_file is not self._data_file
+                and data_file.size > 0
+                and (
+                    dead_bytes / data_file.size >= dead_ratio
+                    or dead_bytes >= min_dead_bytes
+                )
+            ]
+
+    def _lookup_unindexed(self, key, unindexed):
+        """Find key in data files the background indexer hasn't reached."""
+        if key in self._loading_deletes:
+            return None
+        missing = object()
+        hashes = key_hashes(key) if self._blooms is not None else None
+        for data_file, file_name, lookup in unindexed:
+            if hashes is not None:
+                bloom = self._blooms.get(data_file)
+                if bloom is not None and not bloom.may_contain(hashes):
+                    metrics.BLOOM_SKIPPED_FILES.inc()
+                    continue
+            found = lookup(file_name, key, missing)
+            if found is missing:
+                continue
+            # None when the newest record of the key is a tombstone
+            return CaskKeyDirEntry(data_file, *found) if found is not None else None
+        return None
+
+    def _exists(self, key):
+        # An expired key doesn't exist, deleting it writes no tombstone
+        return self._find_entry(key) is not None
+
+    def store(self, key, value, ttl=0):
+        """Store value under key, expiring after ttl seconds unless ttl is 0."""
+        self._commit([CaskWriteOp(key, value, expires=utils.expiry_time(ttl))])
+
+    def store_many(self, items):
+        """
+        Store (key, value) or (key, value, ttl) tuples as one batch, a single
+        write and sync.
+        """
+        if items:
+            self._commit(
+                [
+                    CaskWriteOp(
+                        item[0],
+                        item[1],
+                        expires=utils.expiry_time(item[2] if len(item) > 2 else 0),
+                    )
+                    for item in items
+                ]
+            )
+
+    def _find_entry(self, key, promote=False):
+        # No lock here. Entries are replaced, never modified, and each one
+        # pins the file object it was written to, so rotation or a merge
+        # swap can't pull the file out from under a read.
+        # Snapshot the unindexed files before the KeyDir lookup, a file
+        # leaves the list only after its keys are in the KeyDir.
+        unindexed = self._unindexed_files
+        if promote and self._tiered:
+            # A read, keep the key in memory if it was on disk
+            entry = self._key_dir.lookup(key)
+        else:
             entry = self._key_dir.get(key)
+        if entry is None and unindexed:
+            entry = self._lookup_unindexed(key, unindexed)
+        if entry is not None and entry.expires and entry.expired(time.time()):
+            return None
+        return entry
+
+    def _read_entry(self, key, entry):
+        if self._cache is not None:
+            value = self._cache.get(key, entry.file_obj, entry.value_pos)
+            if value is not None:
+                return value
+        value = entry.file_obj.read(entry.value_pos, entry.value_size)
+        if self._cache is not None and value is not None:
+            self._cache.put(key, entry.file_obj, entry.value_pos, value)
+        return value
+
+    def retrieve(self, key):
+        """Value of key as bytes, None if it doesn't exist. Keys may be str or bytes."""
+        key = utils.to_bytes(key)
+        entry = self._find_entry(key, promote=True)
+        if entry is not None:
+            data_file = entry.file_obj
+            self.logger.debug(
+                "Reading size {} from offset {} from file {}".format(
+                    entry.value_size, entry.value_pos, data_file.basename
+                )
+            )
+            return self._read_entry(key, entry)
+        else:
+            return None
+
+    def retrieve_many(self, keys):
+        """
+        Values of keys in the same order, None for missing ones. Reads are
+        issued in file and offset order to keep disk access sequential.
+        """
+        keys = [utils.to_bytes(key) for key in keys]
+        values = [None] * len(keys)
+        located = []
+        for index, key in enumerate(keys):
+            entry = self._find_entry(key, promote=True)
             if entry is not None:
-                self.store(key, TOMBSTONE_ENTRY)
+                located.append((entry.file_obj.file_id, entry.value_pos, index, entry))
+        located.sort(key=lambda item: item[:3])
+        for _, _, index, entry in located:
+            values[index] = self._read_entry(keys[index], entry)
+        return values
+
+    def delete(self, key):
+        return self._commit([CaskWriteOp(key, b"", is_delete=True)])[0]
+
+    def scan(self, start=b"", end=None, limit=consts.DEFAULT_SCAN_LIMIT):
+        """
+        Up to limit live (key, value) pairs with start <= key < end, in key
+        order, and the key to resume from, None once the range is done.
+        Values are read in file and offset order. Needs a KeyDir with an
+        ordered index, e.g. OrderedKeyDir.
+        """
+        key_range = getattr(self._key_dir, "range", None)
+        if key_range is None:
+            raise CaskIOException("Scans need the ordered index")
+        if self._unindexed_files:
+            raise CaskIOException("Scans are unavailable until the index is loaded")
+        start = utils.to_bytes(start)
+        end = utils.to_bytes(end) if end is not None else None
+        keys = key_range(start, end, limit)
+        next_start = keys[-1] + b"\x00" if len(keys) == limit else None
+        items = [
+            (key, value)
+            for key, value in zip(keys, self.retrieve_many(keys))
+            if value is not None
+        ]
+        return items, next_start
+
+    def delete_many(self, keys):
+        """Delete keys as one batch, returns whether each key existed."""
+        if not keys:
+            return []
+        return self._commit([CaskWriteOp(key, b"", is_delete=True) for key in keys])
+
+    def export(self, prefix=b""):
+        """
+        Yield (key, value) of every live key starting with prefix, reading
+        the data files in file and offset order.
+
+        The lock is only held to snapshot the data files and their current
+        ends, writes and merges go on while the caller consumes the
+        records. A key written or moved by a merge past that snapshot is
+        yielded once with its current value when its old record is reached,
+        a key deleted in the meantime is left out.
+        """
+        prefix = utils.to_bytes(prefix)
+        with self._lock:
+            data_files = sorted(
+                self._read_files.values(), key=lambda data_file: data_file.file_id
+            )
+            snapshot_ends = {data_file: data_file.size for data_file in data_files}
+        moved = set()
+        for data_file in data_files:
+            with data_file.raw_view() as view:
+                records = view[: snapshot_ends[data_file]]
+                try:
+                    for key, _, offset, *_ in data_file.iter_raw_entries(records):
+                        if not key.startswith(prefix):
+                            continue
+                        entry = self._find_entry(key)
+                        if entry is None:
+                            continue
+                        snapshot_end = snapshot_ends.get(entry.file_obj)
+                        if snapshot_end is not None and entry.value_pos < snapshot_end:
+                            # The live record is part of the snapshot, it is
+                            # exported when the scan reaches it.
+                            if (
+                                entry.file_obj is not data_file
+                                or entry.value_pos != offset
+                            ):
+                                continue
+                        elif key in moved:
+                            continue
+                        else:
+                            moved.add(key)
+                        value = entry.file_obj.read(entry.value_pos, entry.value_size)
+                        if value is not None:
+                            yield key, value
+                finally:
+                    records.release()
+
+    def sweep_expired(self, limit=consts.DEFAULT_TTL_SWEEP_BATCH):
+        """
+        Drop up to limit expired keys from the KeyDir, earliest expiry first,
+        and return how many were. Their records are left for merge to
+        reclaim. The lock is held for one batch, callers sweep in steps.
+        Nothing is swept while the index loads, older records of a key
+        would show through in the files not indexed yet.
+        """
+        now = time.time()
+        swept = 0
+        with self._lock:
+            if self._unindexed_files:
+                return 0
+            heap = self._expiry_heap
+            for _ in range(limit):
+                if not heap or heap[0][0] > now:
+                    break
+                expires, key = heapq.heappop(heap)
+                entry = self._key_dir.get(key)
+                if entry is None or entry.expires != expires:
+                    continue
                 self._key_dir.delete(key)
-                return True
-            else:
-                return False
+                self._mark_dead(entry.file_obj, entry.value_size)
+                if self._cache is not None:
+                    self._cache.invalidate(key)
+                swept += 1
+        metrics.TTL_EXPIRED_KEYS.inc(swept)
+        return swept
 
-    def merge(self):
+    def merge(self, files=None):
+        """
+        Compact files, by default every data file but the newest one once
+        there are at least three of them. The active file is never merged.
+        """
+        with self._lock:
+            if (
+                self._merge_running
+                or self._unindexed_files
+                or not self._rebuild_progress.get("done", True)
+            ):
+                return
+            self._merge_running = True
         try:
             with self._lock:
-                if self._merge_running:
-                    return
-                else:
-                    self._merge_running = True
-                files_to_merge = utils.get_datafiles(self._file_path)
-                if not files_to_merge or len(files_to_merge) < 3:
+                read_files = self._read_files
+                if files is None:
+                    data_files = utils.get_datafiles(self._file_path)
+                    if len(data_files) < 3:
+                        return
+                    # Leave last file where current writes are landing
+                    files = [read_files[os.path.basename(f)] for f in data_files[:-1]]
+                sources = sorted(
+                    (
+                        data_file
+                        for data_file in files
+                        if data_file is not self._data_file
+                        and read_files.get(data_file.basename) is data_file
+                    ),
+                    key=lambda data_file: data_file.file_id,
+                )
+                if not sources:
                     return
-                # Leave last file where current writes are landing
-                files_to_merge = files_to_merge[:-1]
-            key_val_map = {}
-            merged_index = {}
-            last_id = utils.get_file_id_from_absolute_path(files_to_merge[-1])
-            for datafile in reversed(files_to_merge):
-                datafile_obj = self._read_files[os.path.basename(datafile)]
-                for (
-                    key,
-                    _,
-                    _,
-                    timestamp,
-                    value,
-                ) in datafile_obj.read_all_entries():
-                    if (
-                        key not in key_val_map
-                        or key_val_map[key][1] == datafile_obj.basename
-                    ):
-                        key_val_map[key] = (value, datafile_obj.basename, timestamp)
-            with tempfile.TemporaryDirectory(dir=self._file_path) as tempdir:
-                new_data_file = CaskDataFile(
-                    tempdir, last_id, False, os_sync=self._os_sync
-                )
-                new_hint_file = CaskHintFile(tempdir, last_id, False)
-                for key, metadata in key_val_map.items():
-                    current_offset = new_data_file.size
-                    new_data_file.write(metadata[2], key, metadata[0])
-                    entry_size = DATA_HEADER_SIZE + len(key) + len(metadata[0])
-                    new_hint_file.write(key, metadata[2], current_offset, entry_size)
-                    merged_index[key] = (
+                merged_ids = set(source.file_id for source in sources)
+                unmerged_ids = [
+                    data_file.file_id
+                    for data_file in read_files.values()
+                    if data_file.file_id not in merged_ids
+                ]
+            # Let the seal threads of the sources finish before their hint
+            # files go away
+            self._wait_for_seals(sources)
+            self.logger.debug(
+                "Merging {}".format([source.basename for source in sources])
+            )
+            with metrics.MERGE_DURATION.time():
+                self._merge_files(sources, unmerged_ids)
+            metrics.MERGE_FILES.inc(len(sources))
+        finally:
+            self._merge_running = False
+
+    def _merge_files(self, sources, unmerged_ids):
+        """
+        Stream the live records of sources, oldest first, into new files of
+        at most max_file_size. A record is live when the KeyDir still points
+        at its file and offset, so nothing but the current record is held in
+        memory.
+
+        Outputs reuse the ids of the merged files. A record goes to the
+        open output, or to a new one taking the id of its source, so it
+        never lands in a file newer than its source. Outputs don't span
+        files that were not merged, so with rebuild picking the newest file
+        a moved record still shadows older records of its key left in them.
+        """
+        free_ids = deque(source.file_id for source in sources)
+        outputs = []
+        throttle = utils.RateLimiter(self._merge_bytes_per_sec)
+        now = time.time()
+        # (key, source, offset) of keys the KeyDir points at a tombstone or
+        # an expired record for, dropped from it once the merged files are
+        # swapped in
+        dead_keys = []
+        with tempfile.TemporaryDirectory(dir=self._file_path) as tempdir:
+            for source in sources:
+                output = outputs[-1] if outputs else None
+                if output is not None and any(
+                    output.file_id < file_id < source.file_id
+                    for file_id in unmerged_ids
+                ):
+                    output = None
+                # A tombstone has to outlive every older record of its key,
+                # so it is kept while older files are left out of the merge.
+                # So is an expired record, it shadows older ones the same way.
+                keep_tombstones = any(
+                    file_id < source.file_id for file_id in unmerged_ids
+                )
+                # Contiguous live records are copied with a single write
+                run_start, run_end = None, None
+                with source.raw_view() as view:
+                    for (
+                        key,
                         entry_size,
-                        current_offset,
+                        offset,
                         timestamp,
-                    )
-                with self._lock:
-                    new_data_file.close()
-                    new_hint_file.close()
+                        expires,
+                        tombstone,
+                    ) in source.iter_raw_entries(view):
+                        throttle.consume(entry_size)
+                        entry = self._key_dir.get(key)
+                        if entry is not None and (
+                            entry.file_obj is not source or entry.value_pos != offset
+                        ):
+                            continue
+                        if tombstone or 0 < expires <= now:
+                            if entry is not None:
+                                # Expired, or a deletion indexed before
+                                # tombstones were flagged
+                                dead_keys.append((key, source, offset))
+                            if not keep_tombstones:
+                                continue
+                        elif entry is None:
+                            continue
+                        if not source.raw_entry_intact(view, offset, entry_size):
+                            # Left behind, a copy would get a valid hint
+                            # entry and outlive the corrupt file.
+                            self.logger.error(
+                                "Mismatching CRC in {} at offset {}, "
+                                "record not merged".format(source.name, offset)
+                            )
+                            continue
+                        if output is None or (
+                            output.size > 0
+                            and output.size + entry_size > self._max_file_size
+                        ):
+                            while free_ids and free_ids[0] < source.file_id:
+                                free_ids.popleft()
+                            # Once the source's id is taken, by an output that
+                            # got too big for records of this source alone, let
+                            # that output grow past the limit.
+                            if free_ids and free_ids[0] == source.file_id:
+                                if run_start is not None:
+                                    output.copy(view[run_start:run_end])
+                                    run_start = None
+                                output = CaskMergeOutput(
+                                    tempdir, free_ids.popleft(), self._tiered
+                                )
+                                outputs.append(output)
+                        if run_start is None or run_end != offset:
+                            if run_start is not None:
+                                output.copy(view[run_start:run_end])
+                            run_start = offset
+                        run_end = offset + entry_size
+                        output.add_entry(
+                            timestamp,
+                            key,
+                            entry_size,
+                            expires,
+                            tombstone,
+                            (source, offset) if entry is not None else None,
+                        )
+                    if run_start is not None:
+                        output.copy(view[run_start:run_end])
+            for output in outputs:
+                output.finish(self._os_sync)
+            with self._lock:
+                self._swap_merged_files(sources, outputs, dead_keys)
+
+    def _swap_merged_files(self, sources, outputs, dead_keys=()):
+        """
+        Put the outputs in place of the sources, so that a crash at any
+        point leaves files that rebuild to the same index. Records only
+        move to an output of the same or a lower id, so ids are swapped
+        oldest first: when a source is replaced or deleted, the outputs
+        holding its records are in place and every older file that may
+        hold an older record of those keys is gone. An id's hint, Bloom
+        filter and sorted index files are removed before its data file is
+        replaced and the new ones added after, they never describe another
+        data file.
+        """
+        outputs = {output.file_id: output for output in outputs}
+        # Merged files reuse ids, a snapshot pointing into them is stale
+        self._merge_generation += 1
+        if os.path.exists(self._snapshot_path):
+            os.remove(self._snapshot_path)
+            if self._os_sync:
+                utils.sync_dir(self._file_path)
+        # Old file objects are only dropped from the map, readers still
+        # holding an entry for them keep the handle alive.
+        removed = []
+        unsynced = False
+        for source in sorted(sources, key=lambda source: source.file_id):
+            hint_file_path = utils.get_hint_filename_for_data_file(source.name)
+            bloom_file_path = utils.get_bloom_filename_for_data_file(source.name)
+            index_file_path = utils.get_index_filename_for_data_file(source.name)
+            for path in (hint_file_path, bloom_file_path, index_file_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            output = outputs.get(source.file_id)
+            if output is not None:
+                os.rename(output.data_file.name, source.name)
+                os.rename(output.hint_file.name, hint_file_path)
+                os.rename(
+                    utils.get_bloom_filename_for_data_file(output.data_file.name),
+                    bloom_file_path,
+                )
+                if self._tiered:
                     os.rename(
-                        new_data_file.name,
-                        os.path.join(self._file_path, new_data_file.basename),
+                        utils.get_index_filename_for_data_file(output.data_file.name),
+                        index_file_path,
                     )
-                    os.rename(
-                        new_hint_file.name,
-                        os.path.join(self._file_path, new_hint_file.basename),
+                unsynced = True
+                continue
+            if unsynced and self._os_sync:
+                # Outputs holding its records must not be lost with it
+                utils.sync_dir(self._file_path)
+                unsynced = False
+            os.remove(source.name)
+            removed.append(source.basename)
+        if unsynced and self._os_sync:
+            utils.sync_dir(self._file_path)
+        # Fresh objects for the merged files, so they get their own
+        # mapping while readers of the old ones keep theirs.
+        new_data_files = [
+            CaskDataFile(self._file_path, file_id, True, use_mmap=self._use_mmap)
+            for file_id in sorted(outputs)
+        ]
+        self._publish_read_files(added=new_data_files, removed=removed)
+        metrics.MERGE_BYTES_RECLAIMED.inc(
+            sum(source.size for source in sources)
+            - sum(data_file.size for data_file in new_data_files)
+        )
+        merged_files = set(sources)
+        for source in sources:
+            self._dead_bytes.pop(source, None)
+        if self._cache is not None:
+            self._cache.invalidate_files(merged_files)
+        if self._blooms is not None:
+            self._blooms.invalidate_files(merged_files)
+        if self._tiered:
+            self._key_dir.replace_files(
+                merged_files,
+                [
+                    (
+                        new_data_file,
+                        read_index_file(
+                            utils.get_index_filename_for_data_file(new_data_file.name)
+                        ),
                     )
-                    # Delete except last file, which has been created just now
-                    files_to_delete = files_to_merge[:-1]
-                    for file_path in files_to_delete:
-                        os.remove(file_path)
-                        os.remove(utils.get_hint_filename_for_data_file(file_path))
-                        del self._read_files[os.path.basename(file_path)]
-                    new_data_file = CaskDataFile(
-                        self._file_path, last_id, True, os_sync=self._os_sync
+                    for new_data_file in new_data_files
+                ],
+            )
+        for key, source, offset in dead_keys:
+            # Unless written again meanwhile the key still points at its
+            # old record
+            entry = self._key_dir.get(key)
+            if (
+                entry is not None
+                and entry.file_obj is source
+                and entry.value_pos == offset
+            ):
+                self._key_dir.delete(key)
+        for new_data_file in new_data_files:
+            hint_file_path = utils.get_hint_filename_for_data_file(new_data_file.name)
+            live_bytes = self._key_dir.merge_index(
+                scan_hint_file(hint_file_path),
+                new_data_file,
+                outputs[new_data_file.file_id].moved,
+            )
+            # Records overwritten while merge ran were copied but are dead
+            self._dead_bytes[new_data_file] = new_data_file.size - live_bytes
+
+    def close(self):
+        # Filters and indexes of rotated files are complete once closed
+        self._wait_for_seals()
+        with self._lock:
+            data_file = self._data_file
+            if data_file is not None and self._os_sync:
+                self._data_file.sync()
+                self._hint_file.sync()
+            self._close_current_write_files()
+            if data_file is not None:
+                self._seal_file(data_file)
+        if self._keydir_snapshot:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        """
+        Write the KeyDir to the snapshot file, returns whether it was. The
+        lock is held while the entries are copied, not while they are
+        written. Skipped while the index is still loading, and dropped if a
+        merge swapped files in the meantime.
+        """
+        with self._snapshot_write_lock:
+            with self._lock:
+                if self._tiered or self._unindexed_files or not self._read_files:
+                    return False
+                read_files = self._read_files.values()
+                newest = max(read_files, key=lambda data_file: data_file.file_id)
+                covered_file_id, covered_offset = newest.file_id, newest.size
+                files = [
+                    (
+                        data_file.file_id,
+                        data_file.size,
+                        self._dead_bytes.get(data_file, 0),
                     )
-                    self._read_files[new_data_file.basename] = new_data_file
-                    self._key_dir.merge_index(merged_index, new_data_file)
-        finally:
-            self._merge_running = False
+                    for data_file in read_files
+                ]
+                entries = self._key_dir.items()
+                generation = self._merge_generation
+            start = time.monotonic()
+            temp_path = self._snapshot_path + ".tmp"
+            write_snapshot(temp_path, covered_file_id, covered_offset, files, entries)
+            with self._lock:
+                if generation != self._merge_generation:
+                    os.remove(temp_path)
+                    return False
+                os.replace(temp_path, self._snapshot_path)
+            self.logger.debug(
+                "Wrote KeyDir snapshot of {} keys up to {}:{} in {:.2f}s".format(
+                    len(entries),
+                    covered_file_id,
+                    covered_offset,
+                    time.monotonic() - start,
+                )
+            )
+            return True
+
+    def cache_stats(self):
+        """Hit, miss and eviction counters of the value cache, None if disabled."""
+        return self._cache.stats() if self._cache is not None else None
+
+    def index_stats(self):
+        """Number of keys in the KeyDir and its estimated memory use."""
+        return {
+            "keys": len(self._key_dir),
+            "memory_bytes": self._key_dir.memory_usage(),
+        }
+
+    def read_files(self):
+        return list(self._read_files.values())
+
+    def rebuild_progress(self):
+        """Snapshot of the index rebuild progress, safe to poll from any thread."""
+        return dict(self._rebuild_progress)
+
+    def _scan_files(self, jobs, workers):
+        """
+        Run the scan jobs and yield their results in job order. With more
+        than one worker the files are parsed in a process pool, at most
+        2 * workers results are held at once.
+        """
+        if workers <= 1 or len(jobs) < 2:
+            for scan, file_name in jobs:
+                yield scan(file_name)
+            return
+        # Spawned, not forked: a fork would copy the gRPC and writer threads'
+        # locks into the workers in whatever state they are in.
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            window = deque()
+            for scan, file_name in jobs:
+                window.append(executor.submit(scan, file_name))
+                if len(window) >= 2 * workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
 
-    def rebuild_index(self):
+    def rebuild_index(self, workers=1, background=False, on_error=None):
+        """
+        Build the KeyDir from hint files, or data files lacking one. With
+        background=True this returns once the data files are open and the
+        index is filled by a thread. Until then reads and deletes of keys
+        not indexed yet fall back to scanning the remaining files, newest
+        first, and writes go to a fresh active file as usual. If the thread
+        fails it retries the remaining files without the worker pool, then
+        gives up and calls on_error with the exception.
+
+        With KeyDir snapshots enabled and a valid one on disk, the index is
+        loaded from it instead and only records written after it are
+        replayed, synchronously whatever background says.
+        """
         data_files = utils.get_datafiles(self._file_path)
-        hint_files = utils.get_hintfiles(self._file_path)
+        hint_files = set(utils.get_hintfiles(self._file_path))
+        self._rebuild_progress = {
+            "files_total": len(data_files),
+            "files_done": 0,
+            "keys_indexed": 0,
+            "done": not data_files,
+            "started": time.monotonic(),
+        }
         if not data_files:
             return []
-        for index, data_file in enumerate(data_files):
-            data_file_id = utils.get_file_id_from_absolute_path(data_file)
-            data_file_obj = CaskDataFile(self._file_path, data_file_id, True)
+        if self._tiered:
+            self._load_sorted_indexes(data_files, background)
+            return
+        unindexed = []
+        for data_file in data_files:
+            data_file_obj = CaskDataFile(
+                self._file_path,
+                utils.get_file_id_from_absolute_path(data_file),
+                True,
+                use_mmap=self._use_mmap,
+            )
             hint_file_path = utils.get_hint_filename_for_data_file(data_file)
-            self._read_files[data_file_obj.basename] = data_file_obj
             if hint_file_path in hint_files:
-                hint_file = CaskHintFile(self._file_path, data_file_id, True)
-                for (
-                    key,
-                    entry_size,
-                    entry_offset,
-                    timestamp,
-                ) in hint_file.read_all_entries():
-                    self._key_dir.add(
-                        key,
-                        CaskKeyDirEntry(
-                            data_file_obj, entry_size, entry_offset, timestamp
-                        ),
-                    )
+                unindexed.append((data_file_obj, hint_file_path, lookup_hint_file))
             else:
-                for (
+                unindexed.append((data_file_obj, data_file, lookup_data_file))
+        snapshot = read_snapshot(self._snapshot_path) if self._keydir_snapshot else None
+        if snapshot is not None and self._load_snapshot(snapshot, unindexed):
+            return
+        # Newest file first, so the first entry seen for a key is the live
+        # one and older records never turn into KeyDir entries.
+        unindexed.reverse()
+        with self._lock:
+            self._publish_read_files(added=[item[0] for item in unindexed])
+            self._unindexed_files = tuple(unindexed)
+        if background:
+            Thread(
+                target=self._index_in_background,
+                args=(workers, on_error),
+                daemon=True,
+            ).start()
+        else:
+            self._index_files(unindexed, workers)
+
+    def _load_sorted_indexes(self, data_files, background):
+        """
+        Start a tiered KeyDir: attach the sorted index of every data file,
+        writing missing ones from the hint file, or the data file lacking
+        one. No key is loaded into memory. The dead bytes of the files are
+        then counted from the indexes, by a thread with background=True,
+        merges wait for it.
+        """
+        hint_files = set(utils.get_hintfiles(self._file_path))
+        attached = []
+        for data_file in data_files:
+            data_file_obj = CaskDataFile(
+                self._file_path,
+                utils.get_file_id_from_absolute_path(data_file),
+                True,
+                use_mmap=self._use_mmap,
+            )
+            index_path = utils.get_index_filename_for_data_file(data_file)
+            index = read_index_file(index_path)
+            if index is None:
+                hint_file_path = utils.get_hint_filename_for_data_file(data_file)
+                if hint_file_path in hint_files:
+                    entries = scan_file_entries(hint_file_path)
+                else:
+                    entries = scan_file_entries(data_file, hint_file=False)
+                write_index_file(index_path + ".tmp", entries, self._os_sync)
+                os.replace(index_path + ".tmp", index_path)
+                index = read_index_file(index_path)
+            attached.append((data_file_obj, index))
+            self._rebuild_progress["files_done"] += 1
+        with self._lock:
+            self._publish_read_files(added=[item[0] for item in attached])
+            for data_file_obj, _ in attached:
+                self._dead_bytes[data_file_obj] = 0
+            self._key_dir.replace_files((), attached)
+        for data_file_obj, index in attached:
+            if not os.path.exists(
+                utils.get_bloom_filename_for_data_file(data_file_obj.name)
+            ):
+                self._write_bloom(
+                    data_file_obj, [key for key, *_ in index.iter_entries()]
+                )
+        if background:
+            Thread(target=self._count_dead_bytes, args=(attached,), daemon=True).start()
+        else:
+            self._count_dead_bytes(attached)
+
+    @staticmethod
+    def _keyed_entries(file_id, index):
+        # Newest file first among the entries of a key
+        for key, entry_size, _, _, _, tombstone in index.iter_entries():
+            yield key, -file_id, entry_size, tombstone
+
+    def _count_dead_bytes(self, attached):
+        """
+        Add the dead bytes of the (data file, index) pairs of attached, from
+        one pass over all their indexes merged in key order: every record
+        but the newest of its key is dead, and so is a tombstone. Only a
+        block of each index is held at a time.
+        """
+        try:
+            live_bytes = dict.fromkeys(
+                (data_file.file_id for data_file, _ in attached), 0
+            )
+            previous = None
+            for key, negative_id, entry_size, tombstone in heapq.merge(
+                *(
+                    self._keyed_entries(data_file.file_id, index)
+                    for data_file, index in attached
+                )
+            ):
+                if key == previous:
+                    continue
+                previous = key
+                if not tombstone:
+                    live_bytes[-negative_id] += entry_size
+                    self._rebuild_progress["keys_indexed"] += 1
+            # Records overwritten since startup were counted by the writes
+            with self._lock:
+                for data_file, _ in attached:
+                    if data_file in self._dead_bytes:
+                        self._dead_bytes[data_file] += (
+                            data_file.size - live_bytes[data_file.file_id]
+                        )
+        except Exception as ex:
+            self.logger.error("Counting dead bytes failed: {}".format(ex))
+        self._rebuild_progress["done"] = True
+        metrics.REBUILD_DURATION.set(
+            time.monotonic() - self._rebuild_progress["started"]
+        )
+
+    def _load_snapshot(self, snapshot, unindexed):
+        """
+        Fill the KeyDir from snapshot, then replay the hint or data file
+        records written after the point it covers. unindexed is the list of
+        (data file, path to scan, lookup) of every data file, oldest first.
+        Returns False, leaving the KeyDir untouched, if the files the
+        snapshot covers don't match the ones on disk.
+        """
+        covered_file_id, covered_offset, files, entries = snapshot
+        by_id = {item[0].file_id: item for item in unindexed}
+        # Covered files are immutable, the newest one may only have grown
+        for file_id, (size, _) in files.items():
+            data_file = by_id[file_id][0] if file_id in by_id else None
+            if (
+                data_file is None
+                or data_file.size < size
+                or (file_id != covered_file_id and data_file.size != size)
+            ):
+                self.logger.warning("Ignoring stale KeyDir snapshot")
+                return False
+        if any(
+            file_id <= covered_file_id and file_id not in files for file_id in by_id
+        ):
+            self.logger.warning("Ignoring stale KeyDir snapshot")
+            return False
+        replay = [
+            (by_id[file_id], covered_offset if file_id == covered_file_id else 0)
+            for file_id in sorted(by_id)
+            if file_id >= covered_file_id
+        ]
+        with self._lock:
+            self._publish_read_files(added=[item[0] for item in unindexed])
+            for data_file, path, lookup in unindexed:
+                size, dead_bytes = files.get(data_file.file_id, (0, 0))
+                # Bytes past the snapshot count as dead until replayed
+                self._dead_bytes[data_file] = dead_bytes + data_file.size - size
+            keys = 0
+            for key, file_id, value_pos, value_size, tstamp, expires in entries:
+                self._key_dir.add(
                     key,
-                    entry_size,
-                    entry_offset,
-                    timestamp,
-                ) in data_file_obj.read_all_entries():
-                    self._key_dir.add(
-                        key,
-                        CaskKeyDirEntry(
-                            data_file_obj, entry_size, entry_offset, timestamp
-                        ),
-                    )
+                    CaskKeyDirEntry(
+                        by_id[file_id][0], value_size, value_pos, tstamp, expires
+                    ),
+                )
+                if expires:
+                    self._expiry_heap.append((expires, key))
+                keys += 1
+            replayed = 0
+            for (data_file, path, lookup), start_offset in replay:
+                scan = scan_hint_file if lookup is lookup_hint_file else scan_data_file
+                for key, metadata in scan(path).items():
+                    if metadata is None:
+                        # Tombstone, its bytes stay dead. Positions aren't
+                        # kept for them, so one already covered by the
+                        # snapshot is replayed again, to the same effect.
+                        old_entry = self._key_dir.get(key)
+                        if old_entry is not None:
+                            self._mark_dead(old_entry.file_obj, old_entry.value_size)
+                            self._key_dir.delete(key)
+                            keys -= 1
+                        replayed += 1
+                        continue
+                    entry_size, entry_offset, timestamp, expires = metadata
+                    if entry_offset < start_offset:
+                        continue
+                    old_entry = self._key_dir.get(key)
+                    if old_entry is None:
+                        keys += 1
+                    else:
+                        self._mark_dead(old_entry.file_obj, old_entry.value_size)
+                    self._dead_bytes[data_file] -= entry_size
+                    self._key_dir.add(key, CaskKeyDirEntry(data_file, *metadata))
+                    if expires:
+                        self._expiry_heap.append((expires, key))
+                    replayed += 1
+            heapq.heapify(self._expiry_heap)
+        self._rebuild_progress.update(
+            files_done=len(unindexed), keys_indexed=keys, done=True
+        )
+        metrics.REBUILD_DURATION.set(
+            time.monotonic() - self._rebuild_progress["started"]
+        )
+        self.logger.debug(
+            "Loaded KeyDir snapshot up to {}:{}, replayed {} records of {} files".format(
+                covered_file_id, covered_offset, replayed, len(replay)
+            )
+        )
+        return True
+
+    def _index_in_background(self, workers, on_error):
+        try:
+            self._index_files(self._unindexed_files, workers)
+            return
+        except Exception as ex:
+            self.logger.error("Background index build failed, retrying: {}".format(ex))
+        try:
+            # Files indexed so far have left _unindexed_files
+            self._index_files(self._unindexed_files, 1)
+        except Exception as ex:
+            self.logger.error("Background index build failed: {}".format(ex))
+            self._rebuild_progress["error"] = str(ex)
+            if on_error is not None:
+                on_error(ex)
+
+    def _index_files(self, unindexed, workers):
+        jobs = [
+            (scan_hint_file if lookup is lookup_hint_file else scan_data_file, path)
+            for _, path, lookup in unindexed
+        ]
+        for (data_file_obj, _, _), entries in zip(
+            unindexed, self._scan_files(jobs, workers)
+        ):
+            # Under the write lock so a concurrent store or delete of the
+            # same key is ordered against this file as a whole.
+            with self._lock:
+                live_bytes = 0
+                for key, metadata in entries.items():
+                    if (
+                        self._key_dir.get(key) is None
+                        and key not in self._loading_deletes
+                    ):
+                        if metadata is None:
+                            # Deleted here, older records of the key are dead
+                            self._loading_deletes.add(key)
+                            continue
+                        live_bytes += metadata[0]
+                        self._key_dir.add(
+                            key, CaskKeyDirEntry(data_file_obj, *metadata)
+                        )
+                        if metadata[3]:
+                            heapq.heappush(self._expiry_heap, (metadata[3], key))
+                        self._rebuild_progress["keys_indexed"] += 1
+                self._dead_bytes[data_file_obj] = data_file_obj.size - live_bytes
+                self._unindexed_files = self._unindexed_files[1:]
+            # Files from before Bloom filters, or a crash before theirs
+            # was written, get one from the keys just read
+            if not os.path.exists(
+                utils.get_bloom_filename_for_data_file(data_file_obj.name)
+            ):
+                self._write_bloom(data_file_obj, entries)
+            self._rebuild_progress["files_done"] += 1
+            self.logger.debug(
+                "Indexed {} ({}/{} files)".format(
+                    data_file_obj.basename,
+                    self._rebuild_progress["files_done"],
+                    self._rebuild_progress["files_total"],
+                )
+            )
+        with self._lock:
+            self._loading_deletes = set()
+        self._rebuild_progress["done"] = True
+        metrics.REBUILD_DURATION.set(
+            time.monotonic() - self._rebuild_progress["started"]
+        )
+
+
+def check_shard_layout(file_path, shards):
+    """
+    Raise ValueError unless file_path is empty or split in shards shards.
+    Keys are routed by hash, the shard count can't change once data exists.
+    """
+    if utils.get_datafiles(file_path):
+        raise ValueError(
+            "{} holds unsharded data files, can't open it with {} shards".format(
+                file_path, shards
+            )
+        )
+    existing = glob.glob(os.path.join(file_path, consts.SHARD_DIR_GLOB))
+    if existing and len(existing) != shards:
+        raise ValueError(
+            "{} has {} shards, can't open it with {}".format(
+                file_path, len(existing), shards
+            )
+        )
+
+
+def shard_path(file_path, index):
+    """Directory of shard index, created if missing."""
+    path = os.path.join(file_path, consts.SHARD_DIR_FORMAT.format(index))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ShardRouter(object):
+    """
+    Routes keys to shards by a stable hash. Single key calls go to the
+    owning shard, batches are split per shard and the parts run in
+    parallel, so every shard only has to be storage like: store, store_many,
+    retrieve, retrieve_many, delete, delete_many and export.
+    """
+
+    def __init__(self, shards, fan_out_workers):
+        self._shards = list(shards)
+        self._executor = ThreadPoolExecutor(
+            max_workers=fan_out_workers, thread_name_prefix="shard-fan-out"
+        )
+
+    @property
+    def shards(self):
+        return list(self._shards)
+
+    def _shard(self, key):
+        return self._shards[utils.key_shard(key, len(self._shards))]
+
+    def _split(self, items, key_of):
+        """Group items per shard: {shard: ([item index], [item])}."""
+        groups = {}
+        for index, item in enumerate(items):
+            shard = self._shard(key_of(item))
+            indexes, shard_items = groups.setdefault(shard, ([], []))
+            indexes.append(index)
+            shard_items.append(item)
+        return groups
+
+    def _fan_out(self, method, groups):
+        """
+        Call method of each shard with its items, in parallel when more than
+        one shard is involved. The first group runs in the calling thread.
+        Returns [(indexes, result)].
+        """
+        if not groups:
+            return []
+        groups = list(groups.items())
+        futures = [
+            (indexes, self._executor.submit(getattr(shard, method), items))
+            for shard, (indexes, items) in groups[1:]
+        ]
+        shard, (indexes, items) = groups[0]
+        results = [(indexes, getattr(shard, method)(items))]
+        return results + [(indexes, future.result()) for indexes, future in futures]
+
+    def store(self, key, value, ttl=0):
+        key = utils.to_bytes(key)
+        self._shard(key).store(key, value, ttl)
+
+    def store_many(self, items):
+        if items:
+            self._fan_out(
+                "store_many",
+                self._split(
+                    [(utils.to_bytes(item[0]),) + tuple(item[1:]) for item in items],
+                    lambda item: item[0],
+                ),
+            )
+
+    def retrieve(self, key):
+        key = utils.to_bytes(key)
+        return self._shard(key).retrieve(key)
+
+    def retrieve_many(self, keys):
+        keys = [utils.to_bytes(key) for key in keys]
+        values = [None] * len(keys)
+        for indexes, shard_values in self._fan_out(
+            "retrieve_many", self._split(keys, lambda key: key)
+        ):
+            for index, value in zip(indexes, shard_values):
+                values[index] = value
+        return values
+
+    def delete(self, key):
+        key = utils.to_bytes(key)
+        return self._shard(key).delete(key)
+
+    def delete_many(self, keys):
+        keys = [utils.to_bytes(key) for key in keys]
+        results = [False] * len(keys)
+        for indexes, shard_results in self._fan_out(
+            "delete_many", self._split(keys, lambda key: key)
+        ):
+            for index, result in zip(indexes, shard_results):
+                results[index] = result
+        return results
+
+    def scan(self, start=b"", end=None, limit=consts.DEFAULT_SCAN_LIMIT):
+        """
+        Scan every shard in parallel and merge the pages. A shard that
+        stopped at limit has only been scanned up to its resume key, so
+        the merged page ends before the lowest of those.
+        """
+        start = utils.to_bytes(start)
+        end = utils.to_bytes(end) if end is not None else None
+        futures = [
+            self._executor.submit(shard.scan, start, end, limit)
+            for shard in self._shards[1:]
+        ]
+        pages = [self._shards[0].scan(start, end, limit)]
+        pages.extend(future.result() for future in futures)
+        bounds = [next_start for _, next_start in pages if next_start is not None]
+        bound = min(bounds) if bounds else None
+        items = sorted(
+            (
+                item
+                for page, _ in pages
+                for item in page
+                if bound is None or item[0] < bound
+            ),
+            key=lambda item: item[0],
+        )
+        if len(items) > limit:
+            items = items[:limit]
+            return items, items[-1][0] + b"\x00"
+        return items, bound
+
+    def export(self, prefix=b""):
+        """Export of each shard in turn."""
+        prefix = utils.to_bytes(prefix)
+        for shard in self._shards:
+            yield from shard.export(prefix)
+
+
+class ShardedCaskStorage(ShardRouter):
+    """
+    CaskStorage split in independent shards, each with its own directory
+    below file_path, active file, KeyDir and merges. Each part of a batch
+    is a group commit of its own shard.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        shards,
+        key_dir_factory,
+        cache_bytes=0,
+        bloom_cache_bytes=consts.DEFAULT_BLOOM_CACHE_BYTES,
+        **kwargs
+    ):
+        if shards < 2:
+            raise ValueError("A sharded storage needs at least 2 shards")
+        check_shard_layout(file_path, shards)
+        super().__init__(
+            [
+                CaskStorage(
+                    shard_path(file_path, index),
+                    key_dir_factory(),
+                    cache_bytes=cache_bytes // shards,
+                    bloom_cache_bytes=bloom_cache_bytes // shards,
+                    **kwargs
+                )
+                for index in range(shards)
+            ],
+            shards,
+        )
+        self._file_path = file_path
+        self.logger = CustomAdapter(
+            logging.getLogger(__name__),
+            {"logger": "{}".format("SHARDEDCASKSTORAGE")},
+        )
+
+    def file_stats(self):
+        stats = []
+        for index, shard in enumerate(self._shards):
+            for file_stats in shard.file_stats():
+                file_stats["file"] = os.path.join(
+                    consts.SHARD_DIR_FORMAT.format(index), file_stats["file"]
+                )
+                stats.append(file_stats)
+        return stats
+
+    def merge_candidates(self, dead_ratio, min_dead_bytes):
+        candidates = []
+        for shard in self._shards:
+            candidates.extend(shard.merge_candidates(dead_ratio, min_dead_bytes))
+        return candidates
+
+    def merge(self, files=None):
+        """
+        Merge shard by shard, each of them only the given files it owns.
+        Shards are merged one after the other, so at most one shard's worth
+        of merge output is being written at a time.
+        """
+        for shard in self._shards:
+            if files is None:
+                shard.merge()
+                continue
+            owned = set(shard.read_files())
+            shard_files = [data_file for data_file in files if data_file in owned]
+            if shard_files:
+                shard.merge(shard_files)
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        self._executor.shutdown()
+
+    def cache_stats(self):
+        shard_stats = [shard.cache_stats() for shard in self._shards]
+        if shard_stats[0] is None:
+            return None
+        return {
+            stat: sum(stats[stat] for stats in shard_stats) for stat in shard_stats[0]
+        }
+
+    def write_snapshot(self):
+        return all([shard.write_snapshot() for shard in self._shards])
+
+    def sweep_expired(self, limit=consts.DEFAULT_TTL_SWEEP_BATCH):
+        """Sweep each shard in turn, up to limit keys per shard."""
+        return sum(shard.sweep_expired(limit) for shard in self._shards)
+
+    def index_stats(self):
+        shard_stats = [shard.index_stats() for shard in self._shards]
+        return {
+            stat: sum(stats[stat] for stats in shard_stats) for stat in shard_stats[0]
+        }
+
+    def read_files(self):
+        read_files = []
+        for shard in self._shards:
+            read_files.extend(shard.read_files())
+        return read_files
+
+    def rebuild_progress(self):
+        shard_progress = [shard.rebuild_progress() for shard in self._shards]
+        if not all(shard_progress):
+            return {}
+        totals = {
+            "files_total": sum(progress["files_total"] for progress in shard_progress),
+            "files_done": sum(progress["files_done"] for progress in shard_progress),
+            "keys_indexed": sum(
+                progress["keys_indexed"] for progress in shard_progress
+            ),
+            "done": all(progress["done"] for progress in shard_progress),
+            "started": min(progress["started"] for progress in shard_progress),
+        }
+        errors = [stats["error"] for stats in shard_progress if "error" in stats]
+        if errors:
+            totals["error"] = errors[0]
+        return totals
+
+    def rebuild_index(self, workers=1, background=False, on_error=None):
+        """
+        Rebuild the shards in parallel, the workers split between them.
+        With background=True every shard indexes from its own thread and
+        on_error is called for each shard whose build gives up.
+        """
+        shard_workers = max(1, workers // len(self._shards))
+        list(
+            self._executor.map(
+                lambda shard: shard.rebuild_index(shard_workers, background, on_error),
+                self._shards,
+            )
+        )
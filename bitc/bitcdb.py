@@ -1,63 +1,610 @@
+import asyncio
+import itertools
 import logging
+import os
+import signal
+import time
 from threading import Thread, Timer
 
-from bitc import bitc_pb2, bitc_pb2_grpc, consts
-from bitc.keydir import KeyDir
+import grpc
+
+from bitc import bitc_pb2, bitc_pb2_grpc, consts, metrics, utils
+from bitc.keydir import CompactKeyDir, KeyDir, OrderedKeyDir, TieredKeyDir
 from bitc.logger import CustomAdapter
-from bitc.bitc_storage import CaskStorage, CustomAdapter
+from bitc.bitc_storage import (
+    CaskStorage,
+    CustomAdapter,
+    ShardedCaskStorage,
+    shard_path,
+)
+from bitc.partition import PartitionedStorage
+from bitc.utils import CaskIOException
+
+
+def _to_text(value):
+    """Value as returned by the string API, missing and deleted keys are empty."""
+    if value is None:
+        return ""
+    return value.decode("utf-8", errors="replace")
+
+
+def _scan(persistor, request, context):
+    """
+    Run the scan described by a ScanRequest or BytesScanRequest. Returns
+    (items, next_start), with a FAILED_PRECONDITION status set and no
+    items when the storage can't scan.
+    """
+    start = utils.to_bytes(request.start)
+    end = utils.to_bytes(request.end) if request.end else None
+    if request.prefix:
+        prefix = utils.to_bytes(request.prefix)
+        start = max(start, prefix)
+        prefix_end = utils.prefix_end(prefix)
+        if prefix_end is not None and (end is None or prefix_end < end):
+            end = prefix_end
+    limit = min(request.limit or consts.DEFAULT_SCAN_LIMIT, consts.MAX_SCAN_LIMIT)
+    try:
+        return persistor.scan(start, end, limit)
+    except CaskIOException as ex:
+        # Not abort(), this also runs on executor threads of the aio server
+        context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+        context.set_details(str(ex))
+        return [], None
 
 
 class BitCdb(bitc_pb2_grpc.BitCdbKeyValueServiceServicer):
-    def __init__(self, file_path, cask_file_size, merge_interval=3600 * 12):
+    def __init__(
+        self,
+        file_path,
+        cask_file_size,
+        merge_interval=consts.DEFAULT_MERGE_CHECK_INTERVAL,
+        durability=consts.DURABILITY_ALWAYS,
+        batch_window_ms=consts.DEFAULT_BATCH_WINDOW_MS,
+        batch_max_bytes=consts.DEFAULT_BATCH_MAX_BYTES,
+        use_mmap=False,
+        compact_keydir=False,
+        rebuild_workers=1,
+        lazy_index=False,
+        merge_dead_ratio=consts.DEFAULT_MERGE_DEAD_RATIO,
+        merge_min_dead_bytes=consts.DEFAULT_MERGE_MIN_DEAD_BYTES,
+        merge_bytes_per_sec=0,
+        cache_bytes=0,
+        bloom_cache_bytes=consts.DEFAULT_BLOOM_CACHE_BYTES,
+        compression="none",
+        compression_min_size=consts.DEFAULT_COMPRESSION_MIN_SIZE,
+        shards=1,
+        partition_index=None,
+        partition_peers=None,
+        snapshot_interval=0,
+        ordered_index=False,
+        ttl_sweep_interval=consts.DEFAULT_TTL_SWEEP_INTERVAL,
+        keydir_memory_bytes=0,
+    ):
         self.logger = CustomAdapter(
             logging.getLogger(__name__),
             {"logger": "{}".format("CASK")},
         )
 
         self._file_path = file_path
-        self._persistor = CaskStorage(
-            file_path, KeyDir(), os_sync=True, max_file_size=cask_file_size
+        self._batch_max_bytes = batch_max_bytes
+        key_dir_class = CompactKeyDir if compact_keydir else KeyDir
+        if keydir_memory_bytes > 0:
+            if compact_keydir or ordered_index or snapshot_interval > 0:
+                raise ValueError(
+                    "A KeyDir memory cap can't be combined with the compact "
+                    "KeyDir, the ordered index or KeyDir snapshots"
+                )
+            # Hot keys in memory, the rest in sorted index files on disk
+            key_dir_factory = lambda: TieredKeyDir(
+                keydir_memory_bytes // max(shards, 1)
+            )
+        elif ordered_index:
+            # Range and prefix scans, at the cost of a sorted copy of the keys
+            key_dir_factory = lambda: OrderedKeyDir(key_dir_class())
+        else:
+            key_dir_factory = key_dir_class
+        storage_options = dict(
+            max_file_size=cask_file_size,
+            durability=durability,
+            batch_window_ms=batch_window_ms,
+            batch_max_bytes=batch_max_bytes,
+            use_mmap=use_mmap,
+            merge_bytes_per_sec=merge_bytes_per_sec,
+            cache_bytes=cache_bytes,
+            bloom_cache_bytes=bloom_cache_bytes,
+            compression=compression,
+            compression_min_size=compression_min_size,
+            keydir_snapshot=snapshot_interval > 0,
         )
+        if partition_peers:
+            # One worker of a multi process server, partitions are laid out
+            # like shards so a directory can be served either way. The
+            # layout is checked by the server before the workers start.
+            if shards > 1:
+                raise ValueError(
+                    "Partitions of a multi process server can't be sharded"
+                )
+            self._persistor = PartitionedStorage(
+                CaskStorage(
+                    shard_path(file_path, partition_index),
+                    key_dir_factory(),
+                    **storage_options
+                ),
+                partition_index,
+                partition_peers,
+            )
+        elif shards > 1:
+            # Batches fan out to the shards, merges only touch one at a time
+            self._persistor = ShardedCaskStorage(
+                file_path, shards, key_dir_factory, **storage_options
+            )
+        else:
+            self._persistor = CaskStorage(
+                file_path, key_dir_factory(), **storage_options
+            )
+        # Fragmentation is checked every merge_interval seconds, files are
+        # merged once their garbage crosses one of the thresholds.
         self._merge_interval_seconds = merge_interval
-        # This can be moved out of init to boost up start process
+        self._merge_dead_ratio = merge_dead_ratio
+        self._merge_min_dead_bytes = merge_min_dead_bytes
+        self._rebuild_workers = rebuild_workers
+        self._lazy_index = lazy_index
+        metrics.KEYDIR_KEYS.set_function(lambda: self._persistor.index_stats()["keys"])
+        metrics.KEYDIR_MEMORY.set_function(
+            lambda: self._persistor.index_stats()["memory_bytes"]
+        )
+        # Read from the rebuild progress when scraped, so they move while
+        # the index loads, summed over the shards
+        for gauge, stat in (
+            (metrics.REBUILD_FILES_DONE, "files_done"),
+            (metrics.REBUILD_FILES_TOTAL, "files_total"),
+            (metrics.REBUILD_KEYS_INDEXED, "keys_indexed"),
+        ):
+            gauge.set_function(
+                lambda stat=stat: self._persistor.rebuild_progress().get(stat, 0)
+            )
+        for gauge, stat in (
+            (metrics.CACHE_HITS, "hits"),
+            (metrics.CACHE_MISSES, "misses"),
+            (metrics.CACHE_EVICTIONS, "evictions"),
+        ):
+            gauge.set_function(
+                lambda stat=stat: (self._persistor.cache_stats() or {}).get(stat, 0)
+            )
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_timer = None
+        # Expired keys are hidden from reads right away, the sweeper drops
+        # them from the KeyDir every ttl_sweep_interval seconds.
+        self._ttl_sweep_interval = ttl_sweep_interval
+        self._sweep_timer = None
         self._build_key_dir()
         self._schedule_merge_timer()
+        if snapshot_interval > 0:
+            self._schedule_snapshot_timer()
+        if ttl_sweep_interval > 0:
+            self._schedule_sweep_timer()
 
     def _schedule_merge_timer(self):
         self._timer = Timer(self._merge_interval_seconds, self._merge)
         self._timer.daemon = True
         self._timer.start()
 
+    def _schedule_snapshot_timer(self):
+        self._snapshot_timer = Timer(self._snapshot_interval, self._write_snapshot)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
+
+    def _schedule_sweep_timer(self):
+        self._sweep_timer = Timer(self._ttl_sweep_interval, self._sweep_expired)
+        self._sweep_timer.daemon = True
+        self._sweep_timer.start()
+
+    def _sweep_expired(self):
+        try:
+            # One batch per lock hold, until a batch comes back short
+            swept = 0
+            while True:
+                batch = self._persistor.sweep_expired(consts.DEFAULT_TTL_SWEEP_BATCH)
+                swept += batch
+                if batch < consts.DEFAULT_TTL_SWEEP_BATCH:
+                    break
+            if swept:
+                self.logger.debug("Swept {} expired keys".format(swept))
+        except Exception as ex:
+            self.logger.error("TTL sweep failed: {}".format(ex))
+        finally:
+            self._schedule_sweep_timer()
+
+    def _write_snapshot(self):
+        try:
+            self._persistor.write_snapshot()
+        except Exception as ex:
+            self.logger.error("KeyDir snapshot failed: {}".format(ex))
+        finally:
+            self._schedule_snapshot_timer()
+
+    def close(self):
+        """Stop the timers and close the storage, snapshotting the KeyDir."""
+        self._timer.cancel()
+        if self._snapshot_timer is not None:
+            self._snapshot_timer.cancel()
+        if self._sweep_timer is not None:
+            self._sweep_timer.cancel()
+        self._persistor.close()
+
     def _build_key_dir(self):
+        if self._lazy_index:
+            # Serve right away, misses fall back to the unindexed files
+            self.logger.debug("Building Index in background")
+            self._persistor.rebuild_index(
+                workers=self._rebuild_workers,
+                background=True,
+                on_error=self._index_failed,
+            )
+            return
         self.logger.debug("Start Building Index")
-        self._persistor.rebuild_index()
-        self.logger.debug("End Building Index")
+        start = time.monotonic()
+        self._persistor.rebuild_index(workers=self._rebuild_workers)
+        self.logger.debug(
+            "End Building Index, {} keys in {:.2f}s".format(
+                self._persistor.rebuild_progress()["keys_indexed"],
+                time.monotonic() - start,
+            )
+        )
+
+    def _index_failed(self, ex):
+        # Merges stay off and misses keep scanning files until the index is
+        # complete, so rather than limp along the server stops.
+        self.logger.error("Index build failed, shutting down: {}".format(ex))
+        os.kill(os.getpid(), signal.SIGTERM)
 
     def _merge(self):
         try:
-            self.logger.debug("Start merge process")
-            self._persistor.merge()
-            self.logger.debug("End merge process")
+            files = self._persistor.merge_candidates(
+                self._merge_dead_ratio, self._merge_min_dead_bytes
+            )
+            if files:
+                self.logger.debug("Start merge process for {} files".format(len(files)))
+                self._persistor.merge(files)
+                self.logger.debug("End merge process")
         finally:
             self._schedule_merge_timer()
 
     def put(self, request, context):
-        self.logger.debug(
-            "Got put request with k={}, v={}".format(request.key, request.value)
-        )
-        self._persistor.store(request.key, request.value)
-        return bitc_pb2.PutReply()
+        with metrics.RPC_LATENCY.time("put"):
+            self.logger.debug(
+                "Got put request with k={}, v={}".format(request.key, request.value)
+            )
+            self._persistor.store(request.key, request.value, request.ttl)
+            return bitc_pb2.PutReply()
 
     def get(self, request, context):
-        self.logger.debug("Got get request with k={}".format(request.key))
-        value = self._persistor.retrieve(request.key)
-        if value is None:
-            return bitc_pb2.GetReply(value="")
-        else:
-            return bitc_pb2.GetReply(
-                value="" if value == consts.TOMBSTONE_ENTRY else value
+        with metrics.RPC_LATENCY.time("get"):
+            self.logger.debug("Got get request with k={}".format(request.key))
+            value = self._persistor.retrieve(request.key)
+            return bitc_pb2.GetReply(value=_to_text(value))
+
+    def delete(self, request, context):
+        with metrics.RPC_LATENCY.time("delete"):
+            deleted = self._persistor.delete(request.key)
+            return bitc_pb2.DeleteReply(result=deleted)
+
+    def multi_get(self, request, context):
+        with metrics.RPC_LATENCY.time("multi_get"):
+            self.logger.debug(
+                "Got multi_get request for {} keys".format(len(request.keys))
+            )
+            keys = list(request.keys)
+            values = self._persistor.retrieve_many(keys)
+            return bitc_pb2.MultiGetReply(
+                items=[
+                    bitc_pb2.KeyValue(key=key, value=_to_text(value))
+                    for key, value in zip(keys, values)
+                ]
+            )
+
+    def multi_put(self, request, context):
+        with metrics.RPC_LATENCY.time("multi_put"):
+            self.logger.debug(
+                "Got multi_put request for {} keys".format(len(request.items))
+            )
+            self._persistor.store_many(
+                [(item.key, item.value, item.ttl) for item in request.items]
+            )
+            return bitc_pb2.MultiPutReply()
+
+    def multi_delete(self, request, context):
+        with metrics.RPC_LATENCY.time("multi_delete"):
+            deleted = self._persistor.delete_many(list(request.keys))
+            return bitc_pb2.MultiDeleteReply(results=deleted)
+
+    def put_stream(self, request_iterator, context):
+        """
+        Store the streamed pairs in batches of up to batch_max_bytes, each
+        written like a multi_put, and ack the running count after each one.
+        """
+        stored = 0
+        batch, batch_bytes = [], 0
+        for request in request_iterator:
+            batch.append((request.key, request.value, request.ttl))
+            batch_bytes += len(request.key) + len(request.value)
+            if batch_bytes >= self._batch_max_bytes:
+                self._persistor.store_many(batch)
+                stored += len(batch)
+                batch, batch_bytes = [], 0
+                yield bitc_pb2.PutStreamReply(stored=stored)
+        if batch or not stored:
+            self._persistor.store_many(batch)
+            stored += len(batch)
+            yield bitc_pb2.PutStreamReply(stored=stored)
+        self.logger.debug("Stored {} keys from put_stream".format(stored))
+
+    def export(self, request, context):
+        # Records are read lazily, the next one only when gRPC flow control
+        # lets the previous one out.
+        self.logger.debug("Got export request with prefix={}".format(request.prefix))
+        for key, value in self._persistor.export(request.prefix):
+            yield bitc_pb2.KeyValue(
+                key=key.decode("utf-8", errors="replace"), value=_to_text(value)
             )
 
+    def scan(self, request, context):
+        with metrics.RPC_LATENCY.time("scan"):
+            items, next_start = _scan(self._persistor, request, context)
+            return bitc_pb2.ScanReply(
+                items=[
+                    bitc_pb2.KeyValue(
+                        key=key.decode("utf-8", errors="replace"),
+                        value=_to_text(value),
+                    )
+                    for key, value in items
+                ],
+                next_start=(next_start or b"").decode("utf-8", errors="replace"),
+                more=next_start is not None,
+            )
+
+
+class AsyncBitCdb(BitCdb):
+    """
+    BitCdb for a grpc.aio server. Handlers run on the event loop and hand
+    the storage calls, which block on disk and on the storage locks, to
+    executor. Requests arriving while max_in_flight storage calls are
+    queued or running are rejected with RESOURCE_EXHAUSTED, streams are
+    only checked when they start.
+    """
+
+    def __init__(self, *args, executor=None, max_in_flight=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = executor
+        self._max_in_flight = max_in_flight
+        # Only touched from the event loop thread
+        self._in_flight = 0
+
+    async def _admit(self, context):
+        if self._max_in_flight and self._in_flight >= self._max_in_flight:
+            await context.abort(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                "{} requests in flight".format(self._in_flight),
+            )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+
+    async def put(self, request, context):
+        await self._admit(context)
+        return await self._run(super().put, request, context)
+
+    async def get(self, request, context):
+        await self._admit(context)
+        return await self._run(super().get, request, context)
+
+    async def delete(self, request, context):
+        await self._admit(context)
+        return await self._run(super().delete, request, context)
+
+    async def multi_get(self, request, context):
+        await self._admit(context)
+        return await self._run(super().multi_get, request, context)
+
+    async def multi_put(self, request, context):
+        await self._admit(context)
+        return await self._run(super().multi_put, request, context)
+
+    async def multi_delete(self, request, context):
+        await self._admit(context)
+        return await self._run(super().multi_delete, request, context)
+
+    async def scan(self, request, context):
+        await self._admit(context)
+        return await self._run(super().scan, request, context)
+
+    async def put_stream(self, request_iterator, context):
+        await self._admit(context)
+        stored = 0
+        batch, batch_bytes = [], 0
+        async for request in request_iterator:
+            batch.append((request.key, request.value, request.ttl))
+            batch_bytes += len(request.key) + len(request.value)
+            if batch_bytes >= self._batch_max_bytes:
+                await self._run(self._persistor.store_many, batch)
+                stored += len(batch)
+                batch, batch_bytes = [], 0
+                yield bitc_pb2.PutStreamReply(stored=stored)
+        if batch or not stored:
+            await self._run(self._persistor.store_many, batch)
+            stored += len(batch)
+            yield bitc_pb2.PutStreamReply(stored=stored)
+        self.logger.debug("Stored {} keys from put_stream".format(stored))
+
+    async def export(self, request, context):
+        await self._admit(context)
+        self.logger.debug("Got export request with prefix={}".format(request.prefix))
+        records = self._persistor.export(request.prefix)
+        while True:
+            # Records are read in chunks on the executor, one hop per chunk
+            chunk = await self._run(
+                list, itertools.islice(records, consts.EXPORT_CHUNK_SIZE)
+            )
+            if not chunk:
+                break
+            for key, value in chunk:
+                yield bitc_pb2.KeyValue(
+                    key=key.decode("utf-8", errors="replace"), value=_to_text(value)
+                )
+
+
+class BitCdbV2(bitc_pb2_grpc.BitCdbKeyValueServiceV2Servicer):
+    """
+    Binary safe API over the storage of a BitCdb, keys and values are
+    passed through as bytes without any transcoding.
+    """
+
+    def __init__(self, kv_svc, persistor=None):
+        """persistor overrides the storage of kv_svc, e.g. with a single partition."""
+        self.logger = kv_svc.logger
+        self._kv_svc = kv_svc
+        self._persistor = persistor if persistor is not None else kv_svc._persistor
+        self._batch_max_bytes = kv_svc._batch_max_bytes
+
+    def _item(self, key, value):
+        if value is None:
+            return bitc_pb2.BytesKeyValue(key=key, found=False)
+        return bitc_pb2.BytesKeyValue(key=key, value=value, found=True)
+
+    def put(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.put"):
+            self._persistor.store(request.key, request.value, request.ttl)
+            return bitc_pb2.PutReply()
+
+    def get(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.get"):
+            value = self._persistor.retrieve(request.key)
+            if value is None:
+                return bitc_pb2.BytesGetReply(found=False)
+            return bitc_pb2.BytesGetReply(value=value, found=True)
+
     def delete(self, request, context):
-        deleted = self._persistor.delete(request.key)
-        return bitc_pb2.DeleteReply(result=deleted)
+        with metrics.RPC_LATENCY.time("v2.delete"):
+            deleted = self._persistor.delete(request.key)
+            return bitc_pb2.DeleteReply(result=deleted)
+
+    def multi_get(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.multi_get"):
+            keys = list(request.keys)
+            values = self._persistor.retrieve_many(keys)
+            return bitc_pb2.BytesMultiGetReply(
+                items=[self._item(key, value) for key, value in zip(keys, values)]
+            )
+
+    def multi_put(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.multi_put"):
+            self._persistor.store_many(
+                [(item.key, item.value, item.ttl) for item in request.items]
+            )
+            return bitc_pb2.MultiPutReply()
+
+    def multi_delete(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.multi_delete"):
+            deleted = self._persistor.delete_many(list(request.keys))
+            return bitc_pb2.MultiDeleteReply(results=deleted)
+
+    def put_stream(self, request_iterator, context):
+        stored = 0
+        batch, batch_bytes = [], 0
+        for request in request_iterator:
+            batch.append((request.key, request.value, request.ttl))
+            batch_bytes += len(request.key) + len(request.value)
+            if batch_bytes >= self._batch_max_bytes:
+                self._persistor.store_many(batch)
+                stored += len(batch)
+                batch, batch_bytes = [], 0
+                yield bitc_pb2.PutStreamReply(stored=stored)
+        if batch or not stored:
+            self._persistor.store_many(batch)
+            stored += len(batch)
+            yield bitc_pb2.PutStreamReply(stored=stored)
+
+    def export(self, request, context):
+        for key, value in self._persistor.export(request.prefix):
+            yield bitc_pb2.BytesKeyValue(key=key, value=value, found=True)
+
+    def scan(self, request, context):
+        with metrics.RPC_LATENCY.time("v2.scan"):
+            items, next_start = _scan(self._persistor, request, context)
+            return bitc_pb2.BytesScanReply(
+                items=[
+                    bitc_pb2.BytesKeyValue(key=key, value=value, found=True)
+                    for key, value in items
+                ],
+                next_start=next_start or b"",
+                more=next_start is not None,
+            )
+
+
+class AsyncBitCdbV2(BitCdbV2):
+    """
+    BitCdbV2 for a grpc.aio server, sharing the executor and admission
+    control of the AsyncBitCdb it wraps.
+    """
+
+    async def put(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().put, request, context)
+
+    async def get(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().get, request, context)
+
+    async def delete(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().delete, request, context)
+
+    async def multi_get(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().multi_get, request, context)
+
+    async def multi_put(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().multi_put, request, context)
+
+    async def multi_delete(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().multi_delete, request, context)
+
+    async def scan(self, request, context):
+        await self._kv_svc._admit(context)
+        return await self._kv_svc._run(super().scan, request, context)
+
+    async def put_stream(self, request_iterator, context):
+        await self._kv_svc._admit(context)
+        stored = 0
+        batch, batch_bytes = [], 0
+        async for request in request_iterator:
+            batch.append((request.key, request.value, request.ttl))
+            batch_bytes += len(request.key) + len(request.value)
+            if batch_bytes >= self._batch_max_bytes:
+                await self._kv_svc._run(self._persistor.store_many, batch)
+                stored += len(batch)
+                batch, batch_bytes = [], 0
+                yield bitc_pb2.PutStreamReply(stored=stored)
+        if batch or not stored:
+            await self._kv_svc._run(self._persistor.store_many, batch)
+            stored += len(batch)
+            yield bitc_pb2.PutStreamReply(stored=stored)
+
+    async def export(self, request, context):
+        await self._kv_svc._admit(context)
+        records = self._persistor.export(request.prefix)
+        while True:
+            chunk = await self._kv_svc._run(
+                list, itertools.islice(records, consts.EXPORT_CHUNK_SIZE)
+            )
+            if not chunk:
+                break
+            for key, value in chunk:
+                yield bitc_pb2.BytesKeyValue(key=key, value=value, found=True)
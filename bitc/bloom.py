@@ -0,0 +1,189 @@
+"""
+Bloom filter of the keys of a data file, stored next to its hint file.
+Lookups that can't use the KeyDir, keys of files the background indexer
+hasn't reached, check it first and skip files that can't hold the key.
+
+A filter only has to be right about absence: a missing, truncated or
+corrupt filter file is ignored and its data file scanned as before.
+
+Layout, little endian, followed by a crc32 of everything before it:
+    header      magic, version, hash count, bit count
+    bits        the bit array, bit i is bit i % 8 of byte i // 8
+"""
+
+import math
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+
+from bitc import consts, utils
+
+BLOOM_MAGIC = b"BCBF"
+BLOOM_VERSION = 1
+_HEADER = struct.Struct("<4sHHQ")
+_CRC = struct.Struct("<I")
+# Rough per filter bookkeeping cost on top of the bit array
+ENTRY_OVERHEAD = 200
+
+
+def key_hashes(key):
+    """
+    The two hashes probe positions of key are derived from, the same for
+    every filter, so a key checked against many filters is hashed once.
+    """
+    digest = blake2b(key, digest_size=16).digest()
+    # The second hash is the stride of the probes, odd so it never is 0
+    return (
+        int.from_bytes(digest[:8], "little"),
+        int.from_bytes(digest[8:], "little") | 1,
+    )
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter over bytes keys. Probe positions come from two
+    halves of one blake2b digest, h1 + i * h2, so a key is hashed once
+    whatever the number of probes.
+    """
+
+    def __init__(self, bit_count, hash_count, bits=None):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self._bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+
+    @classmethod
+    def for_keys(cls, keys, fp_rate=consts.BLOOM_FALSE_POSITIVE_RATE):
+        """Filter holding keys, sized for their count and fp_rate."""
+        keys = list(keys)
+        count = max(len(keys), 1)
+        bit_count = max(int(-count * math.log(fp_rate) / math.log(2) ** 2), 64)
+        hash_count = max(int(round(bit_count / count * math.log(2))), 1)
+        bloom = cls(bit_count, hash_count)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    @property
+    def size(self):
+        return len(self._bits)
+
+    def add(self, key):
+        h1, h2 = key_hashes(key)
+        bits, bit_count = self._bits, self.bit_count
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % bit_count
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return self.may_contain(key_hashes(key))
+
+    def may_contain(self, hashes):
+        """False if the key of hashes, from key_hashes(), was never added."""
+        h1, h2 = hashes
+        bits, bit_count = self._bits, self.bit_count
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % bit_count
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def write_bloom_file(path, bloom, sync):
+    """
+    Write bloom to path. Callers write to a temporary path and rename it
+    over the filter, so readers never see a partial one.
+    """
+    header = _HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION, bloom.hash_count, bloom.bit_count)
+    crc = zlib.crc32(bloom._bits, zlib.crc32(header))
+    with open(path, "wb") as fh:
+        fh.write(header)
+        fh.write(bloom._bits)
+        fh.write(_CRC.pack(crc))
+        if sync:
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def read_bloom_file(path):
+    """The filter stored at path, None when it is missing, truncated or corrupt."""
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER.size + _CRC.size:
+        return None
+    (crc,) = _CRC.unpack_from(data, len(data) - _CRC.size)
+    if zlib.crc32(memoryview(data)[: len(data) - _CRC.size]) != crc:
+        return None
+    magic, version, hash_count, bit_count = _HEADER.unpack_from(data)
+    bits = bytearray(data[_HEADER.size : len(data) - _CRC.size])
+    if (
+        magic != BLOOM_MAGIC
+        or version != BLOOM_VERSION
+        or not hash_count
+        or len(bits) != (bit_count + 7) // 8
+    ):
+        return None
+    return BloomFilter(bit_count, hash_count, bits)
+
+
+class BloomFilterCache(object):
+    """
+    LRU of the Bloom filters of data files, loaded on first use and bounded
+    by max_bytes of bit arrays. Files without a usable filter are cached as
+    None, so they aren't looked for again. A filter larger than the whole
+    budget is used once and not kept.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(bloom):
+        return (bloom.size if bloom is not None else 0) + ENTRY_OVERHEAD
+
+    def get(self, data_file):
+        """Filter of data_file, a CaskDataFile, None if it has none."""
+        with self._lock:
+            if data_file in self._entries:
+                self._entries.move_to_end(data_file)
+                return self._entries[data_file]
+        bloom = read_bloom_file(utils.get_bloom_filename_for_data_file(data_file.name))
+        size = self._size(bloom)
+        with self._lock:
+            self.loads += 1
+            if size > self._max_bytes or data_file in self._entries:
+                return bloom
+            self._entries[data_file] = bloom
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.evictions += 1
+        return bloom
+
+    def invalidate_files(self, files):
+        """Drop the filters of files, e.g. after a merge replaced them."""
+        with self._lock:
+            for data_file in files:
+                if data_file in self._entries:
+                    self._bytes -= self._size(self._entries.pop(data_file))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "filters": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from threading import Lock
+
+# Rough per entry bookkeeping cost on top of the key and value
+ENTRY_OVERHEAD = 100
+
+
+class ValueCache(object):
+    """
+    LRU cache of decoded values, bounded by max_bytes of keys plus values.
+
+    Each value is stored with the data file and offset it was read from.
+    get() only returns it while the caller's KeyDir entry still points
+    there, so a value read just before a write or merge moved the key can
+    never be served after it, however the insert raced the invalidation.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value) + ENTRY_OVERHEAD
+
+    def _remove(self, key):
+        _, _, value = self._entries.pop(key)
+        self._bytes -= self._size(key, value)
+
+    def get(self, key, file_obj, value_pos):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            if cached[0] is not file_obj or cached[1] != value_pos:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[2]
+
+    def put(self, key, file_obj, value_pos, value):
+        size = self._size(key, value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (file_obj, value_pos, value)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                evicted, (_, _, evicted_value) = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted, evicted_value)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_files(self, files):
+        """Drop every value read from one of files, e.g. after a merge."""
+        with self._lock:
+            for key in [
+                key
+                for key, (file_obj, _, _) in self._entries.items()
+                if file_obj in files
+            ]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,9 +1,11 @@
 import binascii
+import mmap
 import os
 import struct
+from contextlib import contextmanager
 from threading import Lock
 
-from bitc import consts
+from bitc import compression, consts, metrics
 from bitc.utils import CaskIOException
 
 
@@ -14,25 +16,206 @@ def calculate_checksum(header, key, value):
     return crc
 
 
+def _read_whole_file(file_name):
+    with open(file_name, "rb") as fh:
+        return memoryview(fh.read())
+
+
+def _iter_hint_buffer(buf):
+    unpack_from = struct.Struct(consts.HINT_HEADER_FORMAT).unpack_from
+    unpack_expiry = struct.Struct(consts.EXPIRY_FORMAT).unpack_from
+    offset, end = 0, len(buf)
+    while offset + consts.HINT_HEADER_SIZE <= end:
+        timestamp, key_len, entry_size, entry_offset = unpack_from(buf, offset)
+        offset += consts.HINT_HEADER_SIZE
+        expires = 0
+        if entry_size & consts.HINT_EXPIRY_FLAG:
+            (expires,) = unpack_expiry(buf, offset)
+            offset += consts.EXPIRY_SIZE
+        tombstone = bool(entry_size & consts.HINT_TOMBSTONE_FLAG)
+        entry_size &= consts.HINT_ENTRY_SIZE_MASK
+        key = buf[offset : offset + key_len]
+        yield key, entry_size, entry_offset, timestamp, expires, tombstone
+        offset += key_len
+
+
+def _iter_data_buffer(buf, file_name, verify=True):
+    unpack_from = struct.Struct(consts.DATA_HEADER_FORMAT).unpack_from
+    unpack_expiry = struct.Struct(consts.EXPIRY_FORMAT).unpack_from
+    offset, end = 0, len(buf)
+    while offset + consts.DATA_HEADER_SIZE <= end:
+        crc, timestamp, key_len, value_len = unpack_from(buf, offset)
+        key_start = offset + consts.DATA_HEADER_SIZE
+        expires = 0
+        if value_len & consts.DATA_EXPIRY_FLAG:
+            (expires,) = unpack_expiry(buf, key_start)
+            key_start += consts.EXPIRY_SIZE
+        flags = value_len & ~consts.DATA_VALUE_LEN_MASK
+        value_len &= consts.DATA_VALUE_LEN_MASK
+        entry_size = key_start - offset + key_len + value_len
+        key = buf[key_start : key_start + key_len]
+        value = buf[key_start + key_len : offset + entry_size]
+        tombstone = bool(flags & consts.DATA_TOMBSTONE_FLAG) or (
+            # Deletion written before tombstones were flagged
+            not flags
+            and value_len == len(consts.TOMBSTONE_ENTRY)
+            and value == consts.TOMBSTONE_ENTRY
+        )
+        if verify and calculate_checksum(buf[offset:key_start], key, value) != crc:
+            raise CaskIOException(
+                "Mismatching CRC in {} at offset {}".format(file_name, offset)
+            )
+        yield key, entry_size, offset, timestamp, expires, tombstone
+        offset += entry_size
+
+
+def _metadata(entry_size, entry_offset, timestamp, expires, tombstone):
+    if tombstone:
+        return None
+    return entry_size, entry_offset, timestamp, expires
+
+
+def scan_hint_file(file_name):
+    """
+    Decode a whole hint file read with a single read. Later entries for a
+    key win. Module level so it can run in a process pool.
+
+    Returns {key: (entry_size, entry_offset, timestamp, expires)}, expires
+    is 0 for keys without a TTL. Keys deleted in the file map to None.
+    """
+    entries = {}
+    for key, *entry in _iter_hint_buffer(_read_whole_file(file_name)):
+        entries[bytes(key)] = _metadata(*entry)
+    return entries
+
+
+def scan_data_file(file_name):
+    """
+    Same as scan_hint_file, for a data file that has no hint file.
+    Checksums are verified but values are never decoded.
+    """
+    entries = {}
+    for key, *entry in _iter_data_buffer(_read_whole_file(file_name), file_name):
+        entries[bytes(key)] = _metadata(*entry)
+    return entries
+
+
+def scan_file_entries(file_name, hint_file=True):
+    """
+    Same as scan_hint_file, or scan_data_file with hint_file=False, but
+    tombstones are kept like other entries. Returns {key: (entry_size,
+    entry_offset, timestamp, expires, tombstone)}.
+    """
+    buf = _read_whole_file(file_name)
+    records = _iter_hint_buffer(buf) if hint_file else _iter_data_buffer(buf, file_name)
+    return {bytes(key): tuple(entry) for key, *entry in records}
+
+
+def lookup_hint_file(file_name, key, default=None):
+    """
+    Latest entry of key in a hint file, as returned by scan_hint_file, or
+    default if the file doesn't hold the key.
+    """
+    found = default
+    for entry_key, *entry in _iter_hint_buffer(_read_whole_file(file_name)):
+        if entry_key == key:
+            found = _metadata(*entry)
+    return found
+
+
+def lookup_data_file(file_name, key, default=None):
+    """Same as lookup_hint_file, for a data file that has no hint file."""
+    found = default
+    for entry_key, *entry in _iter_data_buffer(_read_whole_file(file_name), file_name):
+        if entry_key == key:
+            found = _metadata(*entry)
+    return found
+
+
 class CaskDataEncoder(object):
-    def encode(self, timestamp, key, value):
+    """
+    Values of at least min_size bytes are compressed with codec when that
+    makes them smaller. The codec goes in the flag bits of the value length,
+    records without flags are stored raw. A non zero expires is written
+    after the header and flagged the same way. Tombstones are flagged too
+    and have an empty value.
+
+    Deletions used to be stored as the value TOMBSTONE_ENTRY. Such records,
+    without any flag, still read as deleted, and a value equal to it is
+    stored compressed so it can't be taken for one.
+    """
+
+    def __init__(self, codec=consts.CODEC_NONE, min_size=0):
+        self._codec = codec
+        self._min_size = min_size
+
+    def encode(self, timestamp, key, value, expires=0, tombstone=False):
+        flags = 0
+        if tombstone:
+            value, flags = b"", consts.DATA_TOMBSTONE_FLAG
+        elif value == consts.TOMBSTONE_ENTRY:
+            value = compression.compress(consts.CODEC_ZLIB, value)
+            flags = consts.CODEC_ZLIB << consts.DATA_CODEC_SHIFT
+        elif self._codec != consts.CODEC_NONE and len(value) >= self._min_size:
+            compressed = compression.compress(self._codec, value)
+            if len(compressed) < len(value):
+                value, flags = compressed, self._codec << consts.DATA_CODEC_SHIFT
+        if len(value) > consts.DATA_VALUE_LEN_MASK:
+            raise CaskIOException("Value of {} bytes is too large".format(len(value)))
+        if expires:
+            flags |= consts.DATA_EXPIRY_FLAG
         header = struct.pack(
-            consts.DATA_HEADER_FORMAT, 0, timestamp, len(key), len(value)
+            consts.DATA_HEADER_FORMAT, 0, timestamp, len(key), len(value) | flags
         )
-        key = str.encode(key)
-        value = str.encode(value)
+        if expires:
+            header += struct.pack(consts.EXPIRY_FORMAT, expires)
         crc = calculate_checksum(header, key, value)
         return struct.pack(consts.CRC_FORMAT, crc) + header[4:] + key + value
 
     def decode(self, value_bytes):
-        existing_crc, timestamp, key_len, value_len = struct.unpack(
-            consts.DATA_HEADER_FORMAT, value_bytes[: consts.DATA_HEADER_SIZE]
+        """
+        Decode the header at the start of value_bytes, which must hold the
+        expiry too when the record has one. Returns (crc, timestamp, key_len,
+        value_len, codec, expires, header_size, tombstone).
+        """
+        existing_crc, timestamp, key_len, value_len = struct.unpack_from(
+            consts.DATA_HEADER_FORMAT, value_bytes
+        )
+        codec = (value_len >> consts.DATA_CODEC_SHIFT) & consts.DATA_CODEC_MASK
+        expires, header_size = 0, consts.DATA_HEADER_SIZE
+        if value_len & consts.DATA_EXPIRY_FLAG:
+            (expires,) = struct.unpack_from(
+                consts.EXPIRY_FORMAT, value_bytes, consts.DATA_HEADER_SIZE
+            )
+            header_size += consts.EXPIRY_SIZE
+        return (
+            existing_crc,
+            timestamp,
+            key_len,
+            value_len & consts.DATA_VALUE_LEN_MASK,
+            codec,
+            expires,
+            header_size,
+            bool(value_len & consts.DATA_TOMBSTONE_FLAG),
         )
-        return existing_crc, timestamp, key_len, value_len
 
 
 class CaskHintEncoder(object):
-    def encode(self, timestamp, key, offset, entry_size):
+    def encode(self, timestamp, key, offset, entry_size, expires=0, tombstone=False):
+        if tombstone:
+            entry_size |= consts.HINT_TOMBSTONE_FLAG
+        if expires:
+            return (
+                struct.pack(
+                    consts.HINT_HEADER_FORMAT,
+                    timestamp,
+                    len(key),
+                    entry_size | consts.HINT_EXPIRY_FLAG,
+                    offset,
+                )
+                + struct.pack(consts.EXPIRY_FORMAT, expires)
+                + key
+            )
         hint_header = struct.pack(
             consts.HINT_HEADER_FORMAT,
             timestamp,
@@ -40,23 +223,34 @@ class CaskHintEncoder(object):
             entry_size,
             offset,
         )
-        key = str.encode(key)
         return hint_header + key
 
     def decode(self, header):
+        """
+        Returns (key_len, entry_size, entry_offset, timestamp, has_expiry,
+        tombstone), with has_expiry set the expiry follows the header.
+        """
         (
             timestamp,
             key_len,
             entry_size,
             entry_offset,
         ) = struct.unpack(consts.HINT_HEADER_FORMAT, header)
-        return key_len, entry_size, entry_offset, timestamp
+        return (
+            key_len,
+            entry_size & consts.HINT_ENTRY_SIZE_MASK,
+            entry_offset,
+            timestamp,
+            bool(entry_size & consts.HINT_EXPIRY_FLAG),
+            bool(entry_size & consts.HINT_TOMBSTONE_FLAG),
+        )
 
 
 class CaskFile(object):
     def __init__(self, path, file_id, read_only, encoder, file_format, os_sync=False):
         self._wfh, self._rfh = None, None
         self._open(path, file_id, read_only, file_format)
+        self._fileno = self.file_handler.fileno()
         self._id = file_id
         self._os_sync = os_sync
         self._lock = Lock()
@@ -101,6 +295,17 @@ class CaskFile(object):
         with self._lock:
             return self._offset
 
+    def seal(self):
+        """
+        Stop accepting writes but keep the handle open for readers.
+        Entries handed out while this file was active keep pointing at
+        this object, so it must stay readable after rotation.
+        """
+        with self._lock:
+            if self._wfh is not None:
+                self._wfh.flush()
+                self._rfh, self._wfh = self._wfh, None
+
     def close(self):
         if self._wfh is not None:
             self._wfh.close()
@@ -109,7 +314,22 @@ class CaskFile(object):
 
     def sync(self):
         if self._wfh is not None:
-            os.sync(self._wfh.fileno())
+            with metrics.FSYNC_LATENCY.time(self.file_type.lower()):
+                os.fsync(self._wfh.fileno())
+
+    def append(self, entries):
+        """
+        Append already encoded entries with a single write and flush.
+        Syncing is left to the caller so one fsync can cover a whole batch.
+        """
+        if self._wfh is None:
+            raise CaskIOException("{} is not opened for writing".format(self.name))
+        with self._lock:
+            data_len = self._wfh.write(entries)
+            self._wfh.flush()
+            self._offset += data_len
+        metrics.BYTES_WRITTEN.inc(data_len, self.file_type.lower())
+        return data_len
 
     def read(self, *args, **kwargs):
         raise NotImplementedError()
@@ -122,7 +342,7 @@ class CaskFile(object):
 
 
 class CaskDataFile(CaskFile):
-    def __init__(self, path, file_id, read_only, os_sync=False):
+    def __init__(self, path, file_id, read_only, os_sync=False, use_mmap=False):
         super().__init__(
             path,
             file_id,
@@ -131,48 +351,155 @@ class CaskDataFile(CaskFile):
             consts.DATA_FILE_NAME_FORMAT,
             os_sync=False,
         )
+        self._use_mmap = use_mmap
+        self._mmap = None
+        self._view = None
+        if read_only:
+            self._map()
+
+    def _map(self):
+        # Only immutable files are mapped, an empty file can't be mapped
+        # and keeps using pread.
+        if not self._use_mmap or self._offset == 0:
+            return
+        self._mmap = mmap.mmap(self._fileno, 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    @property
+    def mapped(self):
+        return self._view is not None
+
+    def seal(self):
+        super().seal()
+        self._map()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._mmap.close()
+            self._view, self._mmap = None, None
+        super().close()
+
+    @contextmanager
+    def raw_view(self):
+        """Read only memoryview of the whole file, mapped for the duration."""
+        if self._view is not None:
+            yield self._view
+        elif self._offset == 0:
+            yield memoryview(b"")
+        else:
+            with mmap.mmap(self._fileno, 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def iter_raw_entries(self, view):
+        """
+        Yield (key, entry_size, offset, timestamp, expires, tombstone) of each
+        record in view, as returned by raw_view(). Values are neither decoded
+        nor checked, the record bytes are meant to be copied as they are once
+        raw_entry_intact() passed.
+        """
+        for key, *entry in _iter_data_buffer(view, self.name, verify=False):
+            yield (bytes(key), *entry)
+
+    def raw_entry_intact(self, view, offset, entry_size):
+        """Whether the record at offset of view, from raw_view(), matches its CRC."""
+        (crc,) = struct.unpack_from(consts.CRC_FORMAT, view, offset)
+        return binascii.crc32(view[offset + 4 : offset + entry_size]) == crc
+
+    def drop_page_cache(self):
+        """Evict this file from the page cache, used to benchmark cold reads."""
+        if self._mmap is not None:
+            self._mmap.madvise(mmap.MADV_DONTNEED)
+        os.posix_fadvise(self._fileno, 0, 0, os.POSIX_FADV_DONTNEED)
 
     def read(self, offset, size):
-        fh = self._wfh if self._wfh is not None else self._rfh
-        fh.seek(offset, consts.WHENCE_BEGINING)
-        value_bytes = fh.read(size)
-        crc, _, key_len, value_len = self._encoder.decode(value_bytes)
-        if consts.DATA_HEADER_SIZE + key_len + value_len != size:
+        """Value of the record at offset, None if it is a tombstone."""
+        view = self._view
+        if view is not None:
+            # Slice the mapping, no syscall and no copy until decode
+            value_bytes = view[offset : offset + size]
+        else:
+            # Positional read, it neither moves nor depends on the shared
+            # file offset so concurrent readers need no lock.
+            value_bytes = memoryview(os.pread(self._fileno, size, offset))
+        if len(value_bytes) != size:
+            raise CaskIOException("Short read at offset {}".format(offset))
+        (
+            crc,
+            _,
+            key_len,
+            value_len,
+            codec,
+            expires,
+            header_size,
+            tombstone,
+        ) = self._encoder.decode(value_bytes)
+        if header_size + key_len + value_len != size:
             raise CaskIOException("Bad Entry Size")
-        key = value_bytes[consts.DATA_HEADER_SIZE : consts.DATA_HEADER_SIZE + key_len]
-        value = value_bytes[consts.DATA_HEADER_SIZE + key_len :]
-        new_crc = calculate_checksum(value_bytes[:14], key, value)
+        key = value_bytes[header_size : header_size + key_len]
+        value = value_bytes[header_size + key_len :]
+        new_crc = calculate_checksum(value_bytes[:header_size], key, value)
         if new_crc != crc:
             raise CaskIOException("Mismatching CRC")
-        return value.decode("utf-8")
-
-    def write(self, timestamp, key, value):
+        if tombstone:
+            return None
+        if codec != consts.CODEC_NONE:
+            return compression.decompress(codec, value)
+        if not expires and value == consts.TOMBSTONE_ENTRY:
+            # Deletion written before tombstones were flagged
+            return None
+        # The only copy of the value, header and key are checked in place
+        return bytes(value)
+
+    def write(self, timestamp, key, value, expires=0, tombstone=False):
         if self._wfh is None:
             raise CaskIOException("{} is not opened for writing".format(self.name))
         with self._lock:
-            entry = self._encoder.encode(timestamp, key, value)
+            entry = self._encoder.encode(timestamp, key, value, expires, tombstone)
             data_len = self._wfh.write(entry)
             self._wfh.flush()
             if self._os_sync:
-                os.fsync(self._wfh.fileno())
+                with metrics.FSYNC_LATENCY.time(consts.DATA_FILE.lower()):
+                    os.fsync(self._wfh.fileno())
             self._offset += data_len
+        metrics.BYTES_WRITTEN.inc(data_len, consts.DATA_FILE.lower())
+        return data_len
 
     def read_all_entries(self):
         if self._rfh is None:
             raise CaskIOException("File {} is not opened in RO mode".format(self.name))
-        current_offset = self._rfh.tell()
+        self._rfh.seek(0, consts.WHENCE_BEGINING)
+        current_offset = 0
         header = self._rfh.read(consts.DATA_HEADER_SIZE)
         while header:
-            existing_crc, timestamp, key_size, value_size = self._encoder.decode(header)
+            value_len = struct.unpack(consts.DATA_HEADER_FORMAT, header)[3]
+            if value_len & consts.DATA_EXPIRY_FLAG:
+                header += self._rfh.read(consts.EXPIRY_SIZE)
+            (
+                existing_crc,
+                timestamp,
+                key_size,
+                value_size,
+                codec,
+                expires,
+                header_size,
+                tombstone,
+            ) = self._encoder.decode(header)
             key = self._rfh.read(key_size)
             value = self._rfh.read(value_size)
             crc = calculate_checksum(header, key, value)
             if crc != existing_crc:
                 raise CaskIOException("Mismatching CRC")
-            entry_size = consts.DATA_HEADER_SIZE + len(key) + len(value)
-            yield key.decode(
-                "utf-8"
-            ), entry_size, current_offset, timestamp, value.decode("utf-8")
+            entry_size = header_size + len(key) + len(value)
+            if tombstone:
+                value = None
+            elif codec != consts.CODEC_NONE:
+                value = compression.decompress(codec, value)
+            yield key, entry_size, current_offset, timestamp, value, expires
             current_offset = self._rfh.tell()
             header = self._rfh.read(consts.DATA_HEADER_SIZE)
 
@@ -188,19 +515,35 @@ class CaskHintFile(CaskFile):
             os_sync,
         )
 
+    def _read_expiry(self, fh, has_expiry):
+        if not has_expiry:
+            return 0
+        (expires,) = struct.unpack(consts.EXPIRY_FORMAT, fh.read(consts.EXPIRY_SIZE))
+        return expires
+
     def read(self, offset):
         fh = self._wfh if self._wfh is not None else self._rfh
         fh.seek(offset, consts.WHENCE_BEGINING)
         value_bytes = fh.read(consts.HINT_HEADER_SIZE)
-        key_len, entry_size, entry_offset, timestamp = self._encoder.decode(value_bytes)
-        key = fh.read(key_len).decode("utf-8")
-        return key, entry_size, entry_offset, timestamp
-
-    def write(self, key, timestamp, offset, entry_size):
+        (
+            key_len,
+            entry_size,
+            entry_offset,
+            timestamp,
+            has_expiry,
+            tombstone,
+        ) = self._encoder.decode(value_bytes)
+        expires = self._read_expiry(fh, has_expiry)
+        key = fh.read(key_len)
+        return key, entry_size, entry_offset, timestamp, expires, tombstone
+
+    def write(self, key, timestamp, offset, entry_size, expires=0, tombstone=False):
         if self._wfh is None:
             raise CaskIOException("{} is not opened for writing".format(self.name))
         with self._lock:
-            entry = self._encoder.encode(timestamp, key, offset, entry_size)
+            entry = self._encoder.encode(
+                timestamp, key, offset, entry_size, expires, tombstone
+            )
             data_len = self._wfh.write(entry)
             self._wfh.flush()
             if self._os_sync:
@@ -212,7 +555,15 @@ class CaskHintFile(CaskFile):
             raise CaskIOException("File {} is not opened in RO mode")
         header = self._rfh.read(consts.HINT_HEADER_SIZE)
         while header:
-            key_len, entry_size, entry_offset, timestamp = self._encoder.decode(header)
-            key = self._rfh.read(key_len).decode("utf-8")
-            yield key, entry_size, entry_offset, timestamp
+            (
+                key_len,
+                entry_size,
+                entry_offset,
+                timestamp,
+                has_expiry,
+                tombstone,
+            ) = self._encoder.decode(header)
+            expires = self._read_expiry(self._rfh, has_expiry)
+            key = self._rfh.read(key_len)
+            yield key, entry_size, entry_offset, timestamp, expires, tombstone
             header = self._rfh.read(consts.HINT_HEADER_SIZE)
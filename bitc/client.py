@@ -17,6 +17,15 @@ class ConnectionFailedException(Exception):
     pass
 
 
+def _with_ttl(items):
+    """
+    (key, value, ttl) of a dict or an iterable of (key, value) pairs or
+    (key, value, ttl) triples, ttl is 0 for pairs.
+    """
+    for key, value, *ttl in items.items() if isinstance(items, dict) else items:
+        yield key, value, ttl[0] if ttl else 0
+
+
 class RPCClient(object):
     """
     Top level object to access RPyc API
@@ -68,11 +77,13 @@ class BitCdbRpcClient(RPCClient):
         except Exception as ex:
             raise RPCFailedError("RPC Call 'get' failed due to {}".format(ex))
 
-    def put(self, key, value):
+    def put(self, key, value, ttl=0):
+        """Store value under key, expiring after ttl seconds unless ttl is 0."""
         try:
             request = bitc_pb2.PutRequest(
                 key=key,
                 value=value,
+                ttl=ttl,
             )
             stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
             response = stub.put(request)
@@ -101,6 +112,291 @@ class BitCdbRpcClient(RPCClient):
         except Exception as ex:
             raise RPCFailedError("RPC Call 'Delete' failed due to {}".format(ex))
 
+    def multi_get(self, keys):
+        try:
+            request = bitc_pb2.MultiGetRequest(keys=keys)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            response = stub.multi_get(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiGet' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiGet' failed due to {}".format(ex))
+
+    def multi_put(self, items):
+        """Store a dict or (key, value) pairs, or (key, value, ttl) triples."""
+        try:
+            request = bitc_pb2.MultiPutRequest(
+                items=[
+                    bitc_pb2.KeyValue(key=key, value=value, ttl=ttl)
+                    for key, value, ttl in _with_ttl(items)
+                ]
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            response = stub.multi_put(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiPut' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiPut' failed due to {}".format(ex))
+
+    def multi_delete(self, keys):
+        try:
+            request = bitc_pb2.MultiDeleteRequest(keys=keys)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            response = stub.multi_delete(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiDelete' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiDelete' failed due to {}".format(ex))
+
+    def put_stream(self, items):
+        """
+        Stream (key, value) pairs, a dict or any iterable of pairs or of
+        (key, value, ttl) triples, to the server. Returns the number of
+        pairs stored.
+        """
+        try:
+            requests = (
+                bitc_pb2.PutRequest(key=key, value=value, ttl=ttl)
+                for key, value, ttl in _with_ttl(items)
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            stored = 0
+            for response in stub.put_stream(requests):
+                stored = response.stored
+            return stored
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'PutStream' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'PutStream' failed due to {}".format(ex))
+
+    def export(self, prefix=""):
+        """Yield (key, value) of every live key starting with prefix."""
+        try:
+            request = bitc_pb2.ExportRequest(prefix=prefix)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            for item in stub.export(request):
+                yield item.key, item.value
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Export' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Export' failed due to {}".format(ex))
+
+    def scan(self, start="", end="", limit=0, prefix=""):
+        """One page of keys from start to end, see scan_iter for all of them."""
+        try:
+            request = bitc_pb2.ScanRequest(
+                start=start, end=end, limit=limit, prefix=prefix
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceStub(self._conn())
+            response = stub.scan(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Scan' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Scan' failed due to {}".format(ex))
+
+    def scan_iter(self, start="", end="", prefix="", page_size=0):
+        """Yield (key, value) of every key from start to end, a page at a time."""
+        while True:
+            response = self.scan(start, end, page_size, prefix)
+            for item in response.items:
+                yield item.key, item.value
+            if not response.more:
+                return
+            start = response.next_start
+
+
+class BitCdbBytesRpcClient(RPCClient):
+    """
+    Client of the binary safe service, keys and values are bytes. Replies
+    carry a found flag, so an empty value is told apart from a missing key.
+    """
+
+    def get(self, key):
+        try:
+            request = bitc_pb2.BytesGetRequest(key=key)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.get(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Get' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Get' failed due to {}".format(ex))
+
+    def put(self, key, value, ttl=0):
+        try:
+            request = bitc_pb2.BytesPutRequest(key=key, value=value, ttl=ttl)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.put(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Put' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Put' failed due to {}".format(ex))
+
+    def delete(self, key):
+        try:
+            request = bitc_pb2.BytesDeleteRequest(key=key)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.delete(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Delete' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Delete' failed due to {}".format(ex))
+
+    def multi_get(self, keys):
+        try:
+            request = bitc_pb2.BytesMultiGetRequest(keys=keys)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.multi_get(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiGet' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiGet' failed due to {}".format(ex))
+
+    def multi_put(self, items):
+        try:
+            request = bitc_pb2.BytesMultiPutRequest(
+                items=[
+                    bitc_pb2.BytesKeyValue(key=key, value=value, ttl=ttl)
+                    for key, value, ttl in _with_ttl(items)
+                ]
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.multi_put(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiPut' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiPut' failed due to {}".format(ex))
+
+    def multi_delete(self, keys):
+        try:
+            request = bitc_pb2.BytesMultiDeleteRequest(keys=keys)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.multi_delete(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'MultiDelete' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'MultiDelete' failed due to {}".format(ex))
+
+    def put_stream(self, items):
+        try:
+            requests = (
+                bitc_pb2.BytesPutRequest(key=key, value=value, ttl=ttl)
+                for key, value, ttl in _with_ttl(items)
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            stored = 0
+            for response in stub.put_stream(requests):
+                stored = response.stored
+            return stored
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'PutStream' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'PutStream' failed due to {}".format(ex))
+
+    def export(self, prefix=b""):
+        try:
+            request = bitc_pb2.BytesExportRequest(prefix=prefix)
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            for item in stub.export(request):
+                yield item.key, item.value
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Export' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Export' failed due to {}".format(ex))
+
+    def scan(self, start=b"", end=b"", limit=0, prefix=b""):
+        """One page of keys from start to end, see scan_iter for all of them."""
+        try:
+            request = bitc_pb2.BytesScanRequest(
+                start=start, end=end, limit=limit, prefix=prefix
+            )
+            stub = bitc_pb2_grpc.BitCdbKeyValueServiceV2Stub(self._conn())
+            response = stub.scan(request)
+            return response
+        except grpc.RpcError as rpc_error:
+            raise RPCFailedError(
+                "RPC Call 'Scan' failed due to: code={}, message={}".format(
+                    rpc_error.code(), rpc_error.details()
+                )
+            )
+        except Exception as ex:
+            raise RPCFailedError("RPC Call 'Scan' failed due to {}".format(ex))
+
+    def scan_iter(self, start=b"", end=b"", prefix=b"", page_size=0):
+        """Yield (key, value) of every key from start to end, a page at a time."""
+        while True:
+            response = self.scan(start, end, page_size, prefix)
+            for item in response.items:
+                yield item.key, item.value
+            if not response.more:
+                return
+            start = response.next_start
+
 
 if __name__ == "__main__":
     client = BitCdbRpcClient()
@@ -0,0 +1,66 @@
+import zlib
+
+from bitc import consts
+
+# Optional fast codecs, used only when installed
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _lz4_compress(data):
+    return lz4_block.compress(data)
+
+
+def _lz4_decompress(data):
+    return lz4_block.decompress(data)
+
+
+# codec id stored in the record header: (compress, decompress)
+_CODECS = {consts.CODEC_ZLIB: (zlib.compress, zlib.decompress)}
+if lz4_block is not None:
+    _CODECS[consts.CODEC_LZ4] = (_lz4_compress, _lz4_decompress)
+if zstandard is not None:
+    _CODECS[consts.CODEC_ZSTD] = (_zstd_compress, _zstd_decompress)
+
+
+def available_codecs():
+    """Names of the codecs usable in this process, "none" included."""
+    return [
+        name
+        for name, codec_id in consts.CODEC_IDS.items()
+        if codec_id == consts.CODEC_NONE or codec_id in _CODECS
+    ]
+
+
+def codec_id(name):
+    if name not in consts.CODEC_IDS:
+        raise ValueError("Unknown compression codec {}".format(name))
+    codec = consts.CODEC_IDS[name]
+    if codec != consts.CODEC_NONE and codec not in _CODECS:
+        raise ValueError("Compression codec {} is not installed".format(name))
+    return codec
+
+
+def compress(codec, data):
+    return _CODECS[codec][0](data)
+
+
+def decompress(codec, data):
+    if codec not in _CODECS:
+        raise ValueError("Value compressed with unavailable codec {}".format(codec))
+    return _CODECS[codec][1](data)
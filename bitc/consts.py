@@ -9,4 +9,60 @@ HINT_HEADER_FORMAT = "<IHII"
 DATA_HEADER_SIZE = 14
 HINT_HEADER_SIZE = 14
 CRC_FORMAT = "<I"
-TOMBSTONE_ENTRY = "TOMBSTONE"
+# Value of deletions written before tombstones had a flag of their own
+TOMBSTONE_ENTRY = b"TOMBSTONE"
+DURABILITY_ALWAYS = "always"
+DURABILITY_BATCH = "batch"
+DURABILITY_OS = "os"
+DURABILITY_MODES = (DURABILITY_ALWAYS, DURABILITY_BATCH, DURABILITY_OS)
+DEFAULT_BATCH_WINDOW_MS = 2
+DEFAULT_BATCH_MAX_BYTES = 1024 * 1024
+MERGE_BUFFER_SIZE = 1024 * 1024
+DEFAULT_MERGE_CHECK_INTERVAL = 300
+DEFAULT_MERGE_DEAD_RATIO = 0.5
+DEFAULT_MERGE_MIN_DEAD_BYTES = 64 * 1024 * 1024
+SERVER_MODE_THREAD = "thread"
+SERVER_MODE_AIO = "aio"
+SERVER_MODES = (SERVER_MODE_THREAD, SERVER_MODE_AIO)
+DEFAULT_IO_WORKERS = 20
+EXPORT_CHUNK_SIZE = 256
+# The top 4 bits of a data record's value length are flags, the rest is
+# the length. Records written before flags existed have them all clear.
+DATA_VALUE_LEN_MASK = 0x0FFFFFFF
+DATA_CODEC_SHIFT = 28
+DATA_CODEC_MASK = 0x3
+# Records written with a TTL set this flag and carry their expiry time, in
+# epoch seconds, right after the header. The crc covers it.
+DATA_EXPIRY_FLAG = 0x80000000
+EXPIRY_FORMAT = "<I"
+EXPIRY_SIZE = 4
+# Deletions set this flag and have an empty value
+DATA_TOMBSTONE_FLAG = 0x40000000
+# Same flags for hint entries, in the top bits of the entry size. The
+# expiry of a hint entry follows its header.
+HINT_EXPIRY_FLAG = 0x80000000
+HINT_TOMBSTONE_FLAG = 0x40000000
+HINT_ENTRY_SIZE_MASK = 0x3FFFFFFF
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 3
+CODEC_IDS = {
+    "none": CODEC_NONE,
+    "zlib": CODEC_ZLIB,
+    "lz4": CODEC_LZ4,
+    "zstd": CODEC_ZSTD,
+}
+DEFAULT_COMPRESSION_MIN_SIZE = 256
+SHARD_DIR_FORMAT = "shard-{:03d}"
+SHARD_DIR_GLOB = "shard-*"
+KEYDIR_SNAPSHOT_FILE = "keydir.snapshot"
+SHUTDOWN_GRACE_SECONDS = 5
+DEFAULT_SCAN_LIMIT = 1000
+MAX_SCAN_LIMIT = 10000
+DEFAULT_TTL_SWEEP_INTERVAL = 1
+DEFAULT_TTL_SWEEP_BATCH = 1000
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+DEFAULT_BLOOM_CACHE_BYTES = 16 * 1024 * 1024
+# Entries of a sorted index file per fence pointer held in memory
+INDEX_FENCE_INTERVAL = 16
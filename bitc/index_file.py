@@ -0,0 +1,158 @@
+"""
+Sorted index of a data file, for a TieredKeyDir: the file's hint entries
+in key order, the newest one of each key, tombstones included, followed by
+a sparse fence index. The fences, every INDEX_FENCE_INTERVAL-th key and
+where its entry starts, are the only part held in memory. A lookup binary
+searches them and decodes the one block of entries the key can be in from
+the mapped file.
+
+Layout, little endian:
+    entries     hint entries, same encoding as a hint file, sorted by key
+    fences      key length, key and entry offset of every
+                INDEX_FENCE_INTERVAL-th entry
+    footer      magic, version, entry count, fence count, offset of the
+                fences, crc32 of the fences and the footer before it
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from bitc import consts
+from bitc.cask_file import CaskHintEncoder, _iter_hint_buffer, _metadata
+
+INDEX_MAGIC = b"BCIX"
+INDEX_VERSION = 1
+_FOOTER = struct.Struct("<4sHIIQ")
+_FENCE_KEY_LEN = struct.Struct("<H")
+_FENCE_OFFSET = struct.Struct("<Q")
+_CRC = struct.Struct("<I")
+
+
+def write_index_file(path, entries, sync):
+    """
+    Write the index of entries, {key: (entry_size, entry_offset, timestamp,
+    expires, tombstone)}, to path. Callers write to a temporary path and
+    rename it over the index, so readers never see a partial one.
+    """
+    encoder = CaskHintEncoder()
+    body = bytearray()
+    fences = bytearray()
+    fence_count = 0
+    for count, key in enumerate(sorted(entries)):
+        entry_size, entry_offset, timestamp, expires, tombstone = entries[key]
+        if count % consts.INDEX_FENCE_INTERVAL == 0:
+            fences += _FENCE_KEY_LEN.pack(len(key)) + key
+            fences += _FENCE_OFFSET.pack(len(body))
+            fence_count += 1
+        body += encoder.encode(
+            timestamp, key, entry_offset, entry_size, expires, tombstone
+        )
+    footer = _FOOTER.pack(
+        INDEX_MAGIC, INDEX_VERSION, len(entries), fence_count, len(body)
+    )
+    crc = zlib.crc32(footer, zlib.crc32(fences))
+    with open(path, "wb") as fh:
+        fh.write(body)
+        fh.write(fences)
+        fh.write(footer)
+        fh.write(_CRC.pack(crc))
+        if sync:
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def read_index_file(path):
+    """
+    Open the index at path, None when it is missing, truncated or its
+    fences are corrupt.
+    """
+    try:
+        fh = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with fh:
+        size = os.fstat(fh.fileno()).st_size
+        tail_size = _FOOTER.size + _CRC.size
+        if size < tail_size:
+            return None
+        fh.seek(size - tail_size)
+        tail = fh.read(tail_size)
+        footer = tail[: _FOOTER.size]
+        magic, version, entry_count, fence_count, fences_offset = _FOOTER.unpack(footer)
+        if (
+            magic != INDEX_MAGIC
+            or version != INDEX_VERSION
+            or fences_offset > size - tail_size
+        ):
+            return None
+        fh.seek(fences_offset)
+        fences = fh.read(size - tail_size - fences_offset)
+        (crc,) = _CRC.unpack_from(tail, _FOOTER.size)
+        if zlib.crc32(footer, zlib.crc32(fences)) != crc:
+            return None
+        fence_keys = []
+        fence_offsets = array("Q")
+        position = 0
+        for _ in range(fence_count):
+            (key_len,) = _FENCE_KEY_LEN.unpack_from(fences, position)
+            position += _FENCE_KEY_LEN.size
+            fence_keys.append(fences[position : position + key_len])
+            position += key_len
+            fence_offsets.append(_FENCE_OFFSET.unpack_from(fences, position)[0])
+            position += _FENCE_OFFSET.size
+        view = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return SortedIndexFile(view, entry_count, fence_keys, fence_offsets, fences_offset)
+
+
+class SortedIndexFile(object):
+    """A mapped sorted index, see read_index_file()."""
+
+    def __init__(self, view, entry_count, fence_keys, fence_offsets, entries_end):
+        self._view = view
+        self.entry_count = entry_count
+        self._fence_keys = fence_keys
+        self._fence_offsets = fence_offsets
+        self._entries_end = entries_end
+        self._memory = (
+            sys.getsizeof(fence_keys)
+            + sum(sys.getsizeof(key) for key in fence_keys)
+            + fence_offsets.itemsize * len(fence_offsets)
+        )
+
+    def lookup(self, key, default=None):
+        """
+        Entry of key as returned by scan_hint_file, None for a tombstone,
+        or default if the data file doesn't hold the key.
+        """
+        block = bisect.bisect_right(self._fence_keys, key) - 1
+        if block < 0:
+            return default
+        for entry_key, *entry in _iter_hint_buffer(self._block(block)):
+            if entry_key == key:
+                return _metadata(*entry)
+            if entry_key > key:
+                break
+        return default
+
+    def _block(self, block):
+        start = self._fence_offsets[block]
+        if block + 1 < len(self._fence_offsets):
+            return self._view[start : self._fence_offsets[block + 1]]
+        return self._view[start : self._entries_end]
+
+    def iter_entries(self):
+        """
+        Yield (key, entry_size, entry_offset, timestamp, expires, tombstone)
+        in key order, reading one block at a time.
+        """
+        for block in range(len(self._fence_offsets)):
+            yield from _iter_hint_buffer(self._block(block))
+
+    def memory_usage(self):
+        """Bytes held in memory for the fences, the entries stay on disk."""
+        return self._memory
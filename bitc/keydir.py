@@ -1,6 +1,25 @@
+import bisect
+import functools
+import itertools
+import sys
+import time
+import weakref
+from array import array
+from collections import OrderedDict
 from threading import Lock
 
 from bitc.bitc_storage import CaskKeyDirEntry
+from bitc.bloom import key_hashes
+from bitc import metrics
+
+
+def _points_at(entry, position):
+    """Whether entry is the record at position, a (data file, offset) or None."""
+    return (
+        position is not None
+        and entry.file_obj is position[0]
+        and entry.value_pos == position[1]
+    )
 
 
 class KeyDir(object):
@@ -16,14 +35,677 @@ class KeyDir(object):
     def get(self, key):
         return self._index.get(key)
 
-    def merge_index(self, new_index, data_file):
+    def __len__(self):
+        return len(self._index)
+
+    def items(self):
+        """List of (key, entry) of the whole index at one point in time."""
+        return list(self._index.items())
+
+    def memory_usage(self):
+        """
+        Estimate of the bytes held by the index: the dict, plus per key an
+        entry object with its ints and the key, sized from a sample of keys.
+        """
+        count = len(self._index)
+        if not count:
+            return sys.getsizeof(self._index)
+        sample = list(itertools.islice(self._index.items(), 1000))
+        per_key = sum(
+            sys.getsizeof(key)
+            + sys.getsizeof(entry)
+            + sys.getsizeof(entry.value_size)
+            + sys.getsizeof(entry.value_pos)
+            + sys.getsizeof(entry.tstamp)
+            for key, entry in sample
+        ) / len(sample)
+        return int(sys.getsizeof(self._index) + count * per_key)
+
+    def merge_index(self, new_index, data_file, moved):
+        """
+        Point keys at their copy in data_file, unless they were written or
+        deleted since merge copied them, i.e. the entry no longer is the
+        (data file, offset) moved holds for the key. Returns the bytes of
+        data_file the KeyDir now points at.
+        """
+        live_bytes = 0
         for key, metadata in new_index.items():
+            if metadata is None:
+                # Tombstone kept by the merge
+                continue
             entry = self._index.get(key)
+            if entry is not None and _points_at(entry, moved.get(key)):
+                self._index[key] = CaskKeyDirEntry(data_file, *metadata)
+                live_bytes += metadata[0]
+        return live_bytes
+
+
+def _release_slot(free_slots, slot, _):
+    free_slots.append(slot)
+
+
+class CompactKeyDir(object):
+    """
+    KeyDir for large keyspaces. Instead of a dict of entry objects it keeps
+    an open addressing hash table as parallel packed arrays, one slot per
+    key, plus a byte arena holding the keys. That is roughly 45 bytes
+    per key on top of the key itself, against 200+ for KeyDir. Deleted
+    keys leave their bytes in the arena until they outweigh the live keys,
+    then the table and arena are rebuilt.
+
+    Data files are stored as a small integer slot into a registry of weak
+    references, so a file dropped by merge is not kept open by the index.
+    Once merge has moved every key off a file and the file is collected,
+    its slot is reused by the next new file. The file column also holds the
+    generation of the slot, so an entry left behind on a collected file
+    reads as a dead file instead of the file that took over its slot.
+    Entries are materialized on get(), callers see the same
+    CaskKeyDirEntry objects as with KeyDir.
+    """
+
+    _EMPTY = -1
+    _DELETED = -2
+    _MAX_LOAD = 0.7
+    # File column layout: slot in the low bits, slot generation above
+    _SLOT_BITS = 20
+    _SLOT_MASK = (1 << _SLOT_BITS) - 1
+    _GENERATION_MASK = (1 << (32 - _SLOT_BITS)) - 1
+
+    def __init__(self, capacity=1024):
+        self._lock = Lock()
+        self._file_refs = []
+        self._file_generations = []
+        self._file_slots = weakref.WeakKeyDictionary()
+        # Slots of collected files. Filled by weakref callbacks, which can
+        # run at any allocation, so appended to without the lock.
+        self._free_file_slots = []
+        self._allocate(self._table_size_for(capacity))
+        self._arena = bytearray()
+
+    @classmethod
+    def _table_size_for(cls, capacity):
+        return max(8, int(capacity / cls._MAX_LOAD) + 1)
+
+    def _allocate(self, size):
+        self._size = size
+        self._count = 0
+        self._used = 0
+        # Arena bytes of deleted keys, reclaimed by _resize
+        self._garbage = 0
+        self._hashes = array("q", bytes(8 * size))
+        self._key_offsets = array("q", [self._EMPTY]) * size
+        self._key_lens = array("H", bytes(2 * size))
+        self._files = array("I", bytes(4 * size))
+        self._sizes = array("I", bytes(4 * size))
+        self._offsets = array("Q", bytes(8 * size))
+        self._tstamps = array("I", bytes(4 * size))
+        self._expires = array("I", bytes(4 * size))
+
+    def _file_slot(self, file_obj):
+        """File column value of file_obj, its slot and the slot generation."""
+        file_slot = self._file_slots.get(file_obj)
+        if file_slot is None:
+            if self._free_file_slots:
+                slot = self._free_file_slots.pop()
+                self._file_generations[slot] = (
+                    self._file_generations[slot] + 1
+                ) & self._GENERATION_MASK
+            else:
+                slot = len(self._file_refs)
+                self._file_refs.append(None)
+                self._file_generations.append(0)
+            self._file_refs[slot] = weakref.ref(
+                file_obj, functools.partial(_release_slot, self._free_file_slots, slot)
+            )
+            file_slot = slot | self._file_generations[slot] << self._SLOT_BITS
+            self._file_slots[file_obj] = file_slot
+        return file_slot
+
+    def _file_obj(self, file_slot):
+        slot = file_slot & self._SLOT_MASK
+        if file_slot >> self._SLOT_BITS != self._file_generations[slot]:
+            # Its file was collected and the slot taken by another one
+            return None
+        return self._file_refs[slot]()
+
+    def _find(self, key, key_hash):
+        """Slot holding key, or the slot it should be inserted into."""
+        index = key_hash % self._size
+        free = None
+        while True:
+            key_offset = self._key_offsets[index]
+            if key_offset == self._EMPTY:
+                return (index, False) if free is None else (free, False)
+            if key_offset == self._DELETED:
+                if free is None:
+                    free = index
+            elif (
+                self._hashes[index] == key_hash
+                and self._arena[key_offset : key_offset + self._key_lens[index]] == key
+            ):
+                return index, True
+            index = (index + 1) % self._size
+
+    def _set(self, index, file_slot, value_size, value_pos, tstamp, expires):
+        self._files[index] = file_slot
+        self._sizes[index] = value_size
+        self._offsets[index] = value_pos
+        self._tstamps[index] = tstamp
+        self._expires[index] = expires
+
+    def _insert(self, index, key, key_hash):
+        if self._key_offsets[index] == self._EMPTY:
+            self._used += 1
+        self._hashes[index] = key_hash
+        self._key_offsets[index] = len(self._arena)
+        self._key_lens[index] = len(key)
+        self._arena += key
+        self._count += 1
+
+    def _resize(self):
+        old = (
+            self._key_offsets,
+            self._key_lens,
+            self._hashes,
+            self._files,
+            self._sizes,
+            self._offsets,
+            self._tstamps,
+            self._expires,
+            self._arena,
+        )
+        self._allocate(self._table_size_for(self._count * 2))
+        self._arena = bytearray()
+        (
+            key_offsets,
+            key_lens,
+            hashes,
+            files,
+            sizes,
+            offsets,
+            tstamps,
+            expires,
+            arena,
+        ) = old
+        for old_index, key_offset in enumerate(key_offsets):
+            if key_offset < 0:
+                continue
+            key = arena[key_offset : key_offset + key_lens[old_index]]
+            index, _ = self._find(key, hashes[old_index])
+            self._insert(index, key, hashes[old_index])
+            self._set(
+                index,
+                files[old_index],
+                sizes[old_index],
+                offsets[old_index],
+                tstamps[old_index],
+                expires[old_index],
+            )
+
+    def _entry(self, index):
+        file_obj = self._file_obj(self._files[index])
+        return CaskKeyDirEntry(
+            file_obj,
+            self._sizes[index],
+            self._offsets[index],
+            self._tstamps[index],
+            self._expires[index],
+        )
+
+    def add(self, key, value):
+        key_hash = hash(key)
+        with self._lock:
+            index, found = self._find(key, key_hash)
+            if not found:
+                self._insert(index, key, key_hash)
+            self._set(
+                index,
+                self._file_slot(value.file_obj),
+                value.value_size,
+                value.value_pos,
+                value.tstamp,
+                value.expires,
+            )
             if (
-                entry is not None
-                and entry.tstamp == metadata[2]
-                and entry.file_name != data_file
+                self._used > self._size * self._MAX_LOAD
+                or self._garbage > len(self._arena) - self._garbage
             ):
-                self._index[key] = CaskKeyDirEntry(
-                    data_file, metadata[0], metadata[1], metadata[2]
+                self._resize()
+
+    def delete(self, key):
+        with self._lock:
+            index, found = self._find(key, hash(key))
+            if not found:
+                raise KeyError(key)
+            self._key_offsets[index] = self._DELETED
+            self._garbage += self._key_lens[index]
+            self._count -= 1
+
+    def get(self, key):
+        with self._lock:
+            index, found = self._find(key, hash(key))
+            return self._entry(index) if found else None
+
+    def merge_index(self, new_index, data_file, moved):
+        with self._lock:
+            file_slot = self._file_slot(data_file)
+            live_bytes = 0
+            for key, metadata in new_index.items():
+                position = moved.get(key)
+                if metadata is None or position is None:
+                    # A tombstone kept by the merge, or a key it didn't move
+                    continue
+                index, found = self._find(key, hash(key))
+                if (
+                    found
+                    and self._files[index] == self._file_slots.get(position[0])
+                    and self._offsets[index] == position[1]
+                ):
+                    self._set(index, file_slot, *metadata)
+                    live_bytes += metadata[0]
+            return live_bytes
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        with self._lock:
+            return [
+                (
+                    bytes(self._arena[key_offset : key_offset + self._key_lens[index]]),
+                    self._entry(index),
                 )
+                for index, key_offset in enumerate(self._key_offsets)
+                if key_offset >= 0
+            ]
+
+    def memory_usage(self):
+        """Bytes held by the table arrays and the key arena."""
+        table = sum(
+            column.buffer_info()[1] * column.itemsize
+            for column in (
+                self._hashes,
+                self._key_offsets,
+                self._key_lens,
+                self._files,
+                self._sizes,
+                self._offsets,
+                self._tstamps,
+                self._expires,
+            )
+        )
+        return table + len(self._arena)
+
+
+class OrderedKeyIndex(object):
+    """
+    Sorted set of keys for range scans, kept as a list of sorted leaves of
+    about LOAD keys each plus the max key of every leaf, so an insert or
+    delete is two bisects and a short list shift, like a flat B+tree.
+
+    Added keys first go to an unsorted buffer. Small buffers are inserted
+    one by one before the next read or delete, larger ones are sorted in
+    with the leaves in one go, so bulk loads like an index rebuild cost a
+    few sorts instead of an insert per key.
+    """
+
+    LOAD = 1000
+    PENDING_MIN = 1024
+
+    def __init__(self):
+        self._lock = Lock()
+        self._leaves = []
+        self._maxes = []
+        self._pending = []
+        self._count = 0
+
+    def add(self, key):
+        with self._lock:
+            self._pending.append(key)
+            if len(self._pending) > max(self.PENDING_MIN, self._count // 2):
+                self._fold()
+
+    def discard(self, key):
+        with self._lock:
+            self._fold()
+            pos = bisect.bisect_left(self._maxes, key)
+            if pos == len(self._maxes):
+                return
+            leaf = self._leaves[pos]
+            index = bisect.bisect_left(leaf, key)
+            if index == len(leaf) or leaf[index] != key:
+                return
+            del leaf[index]
+            self._count -= 1
+            if not leaf:
+                del self._leaves[pos]
+                del self._maxes[pos]
+            elif index == len(leaf):
+                self._maxes[pos] = leaf[-1]
+
+    def _fold(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        if len(pending) * 8 < self._count:
+            for key in pending:
+                self._insert(key)
+            return
+        # Two sorted runs, which sort() merges in linear time
+        keys = list(itertools.chain.from_iterable(self._leaves))
+        keys.extend(sorted(set(pending)))
+        keys.sort()
+        keys = list(dict.fromkeys(keys))
+        self._leaves = [
+            keys[start : start + self.LOAD] for start in range(0, len(keys), self.LOAD)
+        ]
+        self._maxes = [leaf[-1] for leaf in self._leaves]
+        self._count = len(keys)
+
+    def _insert(self, key):
+        if not self._leaves:
+            self._leaves.append([key])
+            self._maxes.append(key)
+            self._count += 1
+            return
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._leaves[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            leaf = self._leaves[pos]
+            index = bisect.bisect_left(leaf, key)
+            if leaf[index] == key:
+                return
+            leaf.insert(index, key)
+        self._count += 1
+        leaf = self._leaves[pos]
+        if len(leaf) > 2 * self.LOAD:
+            self._leaves[pos : pos + 1] = [leaf[: self.LOAD], leaf[self.LOAD :]]
+            self._maxes[pos : pos + 1] = [leaf[self.LOAD - 1], leaf[-1]]
+
+    def range(self, start, end=None, limit=None):
+        """Keys from start (inclusive) to end (exclusive) in order, at most limit."""
+        keys = []
+        with self._lock:
+            self._fold()
+            pos = bisect.bisect_left(self._maxes, start)
+            if pos == len(self._maxes):
+                return keys
+            index = bisect.bisect_left(self._leaves[pos], start)
+            for leaf in itertools.islice(self._leaves, pos, None):
+                for key in itertools.islice(leaf, index, None):
+                    if end is not None and key >= end:
+                        return keys
+                    keys.append(key)
+                    if limit is not None and len(keys) >= limit:
+                        return keys
+                index = 0
+        return keys
+
+    def __len__(self):
+        with self._lock:
+            self._fold()
+            return self._count
+
+    def memory_usage(self):
+        """Bytes of the leaf lists and buffer, the keys are shared with the KeyDir."""
+        with self._lock:
+            return (
+                sys.getsizeof(self._leaves)
+                + sys.getsizeof(self._maxes)
+                + sys.getsizeof(self._pending)
+                + sum(sys.getsizeof(leaf) for leaf in self._leaves)
+            )
+
+
+class OrderedKeyDir(object):
+    """
+    A KeyDir, or CompactKeyDir, with an OrderedKeyIndex of its keys kept
+    up to date on add and delete, for range and prefix scans. merge_index
+    only moves existing keys, so it leaves the order alone.
+    """
+
+    def __init__(self, key_dir):
+        self._key_dir = key_dir
+        self._ordered = OrderedKeyIndex()
+
+    def add(self, key, value):
+        self._key_dir.add(key, value)
+        self._ordered.add(key)
+
+    def delete(self, key):
+        self._key_dir.delete(key)
+        self._ordered.discard(key)
+
+    def get(self, key):
+        return self._key_dir.get(key)
+
+    def range(self, start, end=None, limit=None):
+        return self._ordered.range(start, end, limit)
+
+    def merge_index(self, new_index, data_file, moved):
+        return self._key_dir.merge_index(new_index, data_file, moved)
+
+    def items(self):
+        return self._key_dir.items()
+
+    def __len__(self):
+        return len(self._key_dir)
+
+    def memory_usage(self):
+        return self._key_dir.memory_usage() + self._ordered.memory_usage()
+
+
+class TieredKeyDir(object):
+    """
+    KeyDir for keyspaces larger than memory. Recently written and read keys
+    are kept in an LRU within max_bytes, the rest are looked up in the
+    sorted index files of the data files, newest file first, skipping files
+    whose Bloom filter rules the key out.
+
+    CaskStorage tells it about every file it opens for writing and attaches
+    the index of a file once the file is sealed and its index written.
+    Until then the entries pointing into the file are pinned in memory, and
+    so are deletions until every file up to the one holding their tombstone
+    is attached: an older record on disk would show through. The active
+    file is never attached, max_file_size bounds what it pins.
+    """
+
+    # Rough cost of a slot and its entry object on top of the key
+    ENTRY_OVERHEAD = 250
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        # Entries of attached files, least recently used first
+        self._hot = OrderedDict()
+        # Entries of files not attached yet, and deleted keys with the
+        # newest file id when they were deleted
+        self._pinned = {}
+        self._deleted = {}
+        self._bytes = 0
+        # ((data file, SortedIndexFile), ...) newest first, replaced whole
+        self._cold = ()
+        self._attached = set()
+        self._index_bytes = 0
+        self._pending_ids = set()
+        self._newest_id = -1
+        # Bumped whenever an answer of get() may change, a key read from
+        # disk is only kept when nothing changed during the read.
+        self._version = 0
+        self._blooms = None
+
+    def use_bloom_filters(self, blooms):
+        """Check files against the filters of blooms, a BloomFilterCache."""
+        self._blooms = blooms
+
+    def track_file(self, data_file):
+        """data_file was opened for writing, its entries stay in memory."""
+        with self._lock:
+            self._pending_ids.add(data_file.file_id)
+            self._newest_id = max(self._newest_id, data_file.file_id)
+
+    def attach_index(self, data_file, index):
+        """Look keys of data_file up in index, a SortedIndexFile, from now on."""
+        self.replace_files((), [(data_file, index)])
+
+    def replace_files(self, removed, added):
+        """
+        Detach the indexes of the removed data files and attach the added
+        (data file, index) pairs in one step, e.g. for a merge.
+        """
+        with self._lock:
+            cold = [item for item in self._cold if item[0] not in removed]
+            cold.extend(added)
+            cold.sort(key=lambda item: item[0].file_id, reverse=True)
+            self._cold = tuple(cold)
+            self._attached = set(data_file for data_file, _ in cold)
+            self._index_bytes = sum(index.memory_usage() for _, index in cold)
+            for data_file in removed:
+                self._pending_ids.discard(data_file.file_id)
+            for data_file, _ in added:
+                self._pending_ids.discard(data_file.file_id)
+                self._newest_id = max(self._newest_id, data_file.file_id)
+            if removed:
+                self._version += 1
+            for key, entry in list(self._pinned.items()):
+                if entry.file_obj in self._attached:
+                    del self._pinned[key]
+                    self._hot[key] = entry
+            oldest_pending = min(self._pending_ids, default=self._newest_id + 1)
+            for key, file_id in list(self._deleted.items()):
+                if file_id < oldest_pending:
+                    del self._deleted[key]
+                    self._bytes -= self._size(key)
+            self._trim()
+
+    @classmethod
+    def _size(cls, key):
+        return len(key) + cls.ENTRY_OVERHEAD
+
+    def _discard(self, key):
+        """Forget what memory holds about key, returns whether it held any."""
+        if (
+            self._hot.pop(key, None) is None
+            and self._pinned.pop(key, None) is None
+            and self._deleted.pop(key, None) is None
+        ):
+            return False
+        self._bytes -= self._size(key)
+        return True
+
+    def _put(self, key, entry):
+        self._discard(key)
+        if entry.file_obj in self._attached:
+            self._hot[key] = entry
+        else:
+            self._pinned[key] = entry
+        self._bytes += self._size(key)
+
+    def _trim(self):
+        """Evict least recently used entries while over budget."""
+        while self._hot and self._bytes + self._index_bytes > self._max_bytes:
+            key, _ = self._hot.popitem(last=False)
+            self._bytes -= self._size(key)
+            self._version += 1
+
+    def add(self, key, value):
+        with self._lock:
+            self._put(key, value)
+            self._version += 1
+            self._trim()
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+            self._deleted[key] = self._newest_id
+            self._bytes += self._size(key)
+            self._version += 1
+            self._trim()
+
+    def _lookup_cold(self, key, cold):
+        hashes = key_hashes(key) if self._blooms is not None else None
+        missing = object()
+        skipped = 0
+        found = missing
+        for data_file, index in cold:
+            if hashes is not None:
+                bloom = self._blooms.get(data_file)
+                if bloom is not None and not bloom.may_contain(hashes):
+                    skipped += 1
+                    continue
+            found = index.lookup(key, missing)
+            if found is not missing:
+                break
+        if skipped:
+            metrics.BLOOM_SKIPPED_FILES.inc(skipped)
+        if found is missing or found is None:
+            # Not on disk, or the newest record is a tombstone
+            return None
+        return CaskKeyDirEntry(data_file, *found)
+
+    def _get(self, key, promote):
+        with self._lock:
+            if key in self._deleted:
+                return None
+            entry = self._pinned.get(key)
+            if entry is not None:
+                return entry
+            entry = self._hot.get(key)
+            if entry is not None:
+                if promote:
+                    self._hot.move_to_end(key)
+                return entry
+            version = self._version
+            # Taken after the lookup in memory, a key is only evicted once
+            # its file is attached
+            cold = self._cold
+        entry = self._lookup_cold(key, cold)
+        if (
+            promote
+            and entry is not None
+            and not (entry.expires and entry.expired(time.time()))
+        ):
+            with self._lock:
+                if version == self._version:
+                    self._put(key, entry)
+                    self._trim()
+        return entry
+
+    def get(self, key):
+        return self._get(key, False)
+
+    def lookup(self, key):
+        """get() for reads, a key found on disk is kept in memory as recently used."""
+        return self._get(key, True)
+
+    def merge_index(self, new_index, data_file, moved):
+        """
+        Called once the index of data_file, a merge output, is attached.
+        Entries still pointing at the record moved holds for their key are
+        dropped, the output's index now resolves them. Returns the bytes of
+        data_file that are still the newest record of their key.
+        """
+        live_bytes = 0
+        with self._lock:
+            for key, metadata in new_index.items():
+                if metadata is None or key in self._deleted:
+                    continue
+                entry = self._hot.get(key) or self._pinned.get(key)
+                if entry is None:
+                    live_bytes += metadata[0]
+                elif _points_at(entry, moved.get(key)):
+                    self._discard(key)
+                    live_bytes += metadata[0]
+            self._version += 1
+        return live_bytes
+
+    def __len__(self):
+        """Keys held in memory, keys only on disk aren't counted."""
+        return len(self._hot) + len(self._pinned)
+
+    def memory_usage(self):
+        """Estimated bytes of the entries and deletions held and the index fences."""
+        return self._bytes + self._index_bytes
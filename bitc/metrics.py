@@ -0,0 +1,260 @@
+"""
+Process wide metrics in the Prometheus text format, served over HTTP by
+start_http_server(). Metric objects are module level and shared by every
+CaskStorage and BitCdb of the process.
+"""
+
+import bisect
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in pairs) + "}"
+
+
+class _Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = Lock()
+        REGISTRY.register(self)
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.metric_type),
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [
+            "{}{} {}".format(self.name, _format_labels(self.label_names, labels), value)
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from a function when scraped."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        value = self._function() if self._function is not None else self._value
+        return ["{} {}".format(self.name, value)]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self._buckets = tuple(buckets)
+        # label values: ([count per bucket, +Inf last], sum)
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts_sum = self._values.get(label_values)
+            if counts_sum is None:
+                counts_sum = self._values[label_values] = [
+                    [0] * (len(self._buckets) + 1),
+                    0.0,
+                ]
+            counts_sum[0][index] += 1
+            counts_sum[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def _samples(self):
+        with self._lock:
+            values = {
+                labels: (list(counts), total)
+                for labels, (counts, total) in self._values.items()
+            }
+        samples = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        _format_labels(self.label_names, labels, (("le", bound),)),
+                        cumulative,
+                    )
+                )
+            label_text = _format_labels(self.label_names, labels)
+            samples.append("{}_sum{} {}".format(self.name, label_text, total))
+            samples.append("{}_count{} {}".format(self.name, label_text, cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+class TimedLock(object):
+    """Wraps a lock, recording how long each acquire waited in histogram."""
+
+    def __init__(self, lock, histogram):
+        self._lock = lock
+        self._histogram = histogram
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        self._histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+REGISTRY = Registry()
+
+RPC_LATENCY = Histogram(
+    "bitc_rpc_latency_seconds", "Time spent serving an RPC", ("method",)
+)
+LOCK_WAIT = Histogram(
+    "bitc_storage_lock_wait_seconds", "Time spent waiting for the storage lock"
+)
+BYTES_WRITTEN = Counter(
+    "bitc_bytes_written_total", "Bytes appended to cask files", ("file_type",)
+)
+FSYNC_LATENCY = Histogram(
+    "bitc_fsync_latency_seconds", "Time spent in fsync of cask files", ("file_type",)
+)
+MERGE_DURATION = Histogram(
+    "bitc_merge_duration_seconds", "Duration of merges", buckets=DURATION_BUCKETS
+)
+MERGE_FILES = Counter("bitc_merge_files_total", "Data files merged")
+MERGE_BYTES_RECLAIMED = Counter(
+    "bitc_merge_bytes_reclaimed_total", "Disk bytes freed by merges"
+)
+TTL_EXPIRED_KEYS = Counter(
+    "bitc_ttl_expired_keys_total", "Expired keys purged from the KeyDir"
+)
+BLOOM_SKIPPED_FILES = Counter(
+    "bitc_bloom_skipped_files_total",
+    "Data file lookups skipped because a Bloom filter ruled the key out",
+)
+KEYDIR_KEYS = Gauge("bitc_keydir_keys", "Keys in the KeyDir")
+KEYDIR_MEMORY = Gauge("bitc_keydir_memory_bytes", "Estimated memory held by the KeyDir")
+REBUILD_DURATION = Gauge(
+    "bitc_rebuild_duration_seconds", "Duration of the last index rebuild"
+)
+REBUILD_FILES_DONE = Gauge(
+    "bitc_rebuild_files_done", "Data files indexed by the running or last rebuild"
+)
+REBUILD_FILES_TOTAL = Gauge(
+    "bitc_rebuild_files_total", "Data files to index in the running or last rebuild"
+)
+REBUILD_KEYS_INDEXED = Gauge(
+    "bitc_rebuild_keys_indexed", "Keys indexed by the running or last rebuild"
+)
+CACHE_HITS = Gauge("bitc_cache_hits", "Value cache hits")
+CACHE_MISSES = Gauge("bitc_cache_misses", "Value cache misses")
+CACHE_EVICTIONS = Gauge("bitc_cache_evictions", "Value cache evictions")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host=""):
+    """Serve /metrics from a daemon thread, returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,109 @@
+"""
+Key partitions of a multi process server. Every worker process owns one
+partition, stored like a shard of ShardedCaskStorage, and reaches the
+others through the binary safe API of their workers.
+"""
+
+import logging
+
+from bitc import consts, utils
+from bitc.bitc_storage import ShardRouter
+from bitc.client import BitCdbBytesRpcClient
+from bitc.logger import CustomAdapter
+
+
+class RemotePartition(object):
+    """Storage like access to the partition of another worker process."""
+
+    def __init__(self, host, port):
+        self._address = "{}:{}".format(host, port)
+        self._client = BitCdbBytesRpcClient(host=host, port=port)
+
+    def __repr__(self):
+        return "RemotePartition({})".format(self._address)
+
+    def store(self, key, value, ttl=0):
+        self._client.put(key, utils.to_bytes(value), ttl)
+
+    def store_many(self, items):
+        self._client.multi_put(
+            [(item[0], utils.to_bytes(item[1])) + tuple(item[2:]) for item in items]
+        )
+
+    def retrieve(self, key):
+        reply = self._client.get(key)
+        return reply.value if reply.found else None
+
+    def retrieve_many(self, keys):
+        reply = self._client.multi_get(keys)
+        return [item.value if item.found else None for item in reply.items]
+
+    def delete(self, key):
+        return self._client.delete(key).result
+
+    def delete_many(self, keys):
+        return list(self._client.multi_delete(keys).results)
+
+    def scan(self, start, end, limit):
+        reply = self._client.scan(start, end or b"", limit)
+        items = [(item.key, item.value) for item in reply.items]
+        return items, reply.next_start if reply.more else None
+
+    def export(self, prefix=b""):
+        return self._client.export(prefix)
+
+
+class PartitionedStorage(ShardRouter):
+    """
+    Storage of one worker process: its own partition, local, plus the
+    partitions of the other workers at peers, a (host, port) per partition.
+    Requests for keys of other partitions are forwarded, batches are split
+    and forwarded in parallel. Merges, index rebuilds and stats only
+    concern the local partition, each worker runs its own.
+    """
+
+    def __init__(self, local, index, peers):
+        partitions = [
+            local if peer_index == index else RemotePartition(*peer)
+            for peer_index, peer in enumerate(peers)
+        ]
+        super().__init__(partitions, consts.DEFAULT_IO_WORKERS)
+        self.local = local
+        self.logger = CustomAdapter(
+            logging.getLogger(__name__),
+            {"logger": "{}".format("PARTITION-{}".format(index))},
+        )
+
+    def merge_candidates(self, dead_ratio, min_dead_bytes):
+        return self.local.merge_candidates(dead_ratio, min_dead_bytes)
+
+    def merge(self, files=None):
+        self.local.merge(files)
+
+    def file_stats(self):
+        return self.local.file_stats()
+
+    def write_snapshot(self):
+        return self.local.write_snapshot()
+
+    def sweep_expired(self, limit=consts.DEFAULT_TTL_SWEEP_BATCH):
+        return self.local.sweep_expired(limit)
+
+    def cache_stats(self):
+        return self.local.cache_stats()
+
+    def index_stats(self):
+        return self.local.index_stats()
+
+    def read_files(self):
+        return self.local.read_files()
+
+    def rebuild_progress(self):
+        return self.local.rebuild_progress()
+
+    def rebuild_index(self, workers=1, background=False, on_error=None):
+        self.local.rebuild_index(workers, background, on_error)
+
+    def close(self):
+        self.local.close()
+        self._executor.shutdown()
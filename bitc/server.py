@@ -1,27 +1,235 @@
 import argparse
+import asyncio
 import logging
+import multiprocessing
 import os
+import signal
+import sys
 from concurrent import futures
+from multiprocessing.connection import wait
 
 import grpc
 
 from bitc.logger import setup_logger
-from bitc import bitc_pb2_grpc
-from bitc.bitcdb import BitCdb
+from bitc import bitc_pb2_grpc, compression, consts, metrics
+from bitc.bitc_storage import check_shard_layout, shard_path
+from bitc.bitcdb import AsyncBitCdb, AsyncBitCdbV2, BitCdb, BitCdbV2
 
 setup_logger()
 LOG = logging.getLogger(__name__)
 
 
-def serve(port, db_dir, merge_interval, cask_file_size):
-    kv_svc = BitCdb(db_dir, cask_file_size, merge_interval)
+def serve(
+    port,
+    db_dir,
+    merge_interval,
+    cask_file_size,
+    durability=consts.DURABILITY_ALWAYS,
+    batch_window_ms=consts.DEFAULT_BATCH_WINDOW_MS,
+    batch_max_bytes=consts.DEFAULT_BATCH_MAX_BYTES,
+    use_mmap=False,
+    compact_keydir=False,
+    rebuild_workers=1,
+    lazy_index=False,
+    merge_dead_ratio=consts.DEFAULT_MERGE_DEAD_RATIO,
+    merge_min_dead_bytes=consts.DEFAULT_MERGE_MIN_DEAD_BYTES,
+    merge_bytes_per_sec=0,
+    cache_bytes=0,
+    bloom_cache_bytes=consts.DEFAULT_BLOOM_CACHE_BYTES,
+    compression="none",
+    compression_min_size=consts.DEFAULT_COMPRESSION_MIN_SIZE,
+    shards=1,
+    server_mode=consts.SERVER_MODE_THREAD,
+    io_workers=consts.DEFAULT_IO_WORKERS,
+    max_concurrent_rpcs=None,
+    max_concurrent_streams=None,
+    metrics_port=0,
+    snapshot_interval=0,
+    ordered_index=False,
+    ttl_sweep_interval=consts.DEFAULT_TTL_SWEEP_INTERVAL,
+    keydir_memory_bytes=0,
+    processes=1,
+    partition_index=None,
+):
+    if processes > 1 and partition_index is None:
+        _serve_processes(dict(locals()))
+        return
+    partition_peers, partition_server = None, None
+    if partition_index is not None:
+        # Worker of a multi process server, its partition is reachable by
+        # the other workers on a loopback port of its own.
+        partition_peers = [
+            ("127.0.0.1", port + 1 + index) for index in range(processes)
+        ]
+        if metrics_port:
+            metrics_port += partition_index
+    executor = futures.ThreadPoolExecutor(max_workers=io_workers)
+    if server_mode == consts.SERVER_MODE_AIO:
+        service_class, service_kwargs = AsyncBitCdb, {
+            "executor": executor,
+            "max_in_flight": max_concurrent_rpcs,
+        }
+    else:
+        service_class, service_kwargs = BitCdb, {}
+    kv_svc = service_class(
+        db_dir,
+        cask_file_size,
+        merge_interval,
+        durability=durability,
+        batch_window_ms=batch_window_ms,
+        batch_max_bytes=batch_max_bytes,
+        use_mmap=use_mmap,
+        compact_keydir=compact_keydir,
+        rebuild_workers=rebuild_workers,
+        lazy_index=lazy_index,
+        merge_dead_ratio=merge_dead_ratio,
+        merge_min_dead_bytes=merge_min_dead_bytes,
+        merge_bytes_per_sec=merge_bytes_per_sec,
+        cache_bytes=cache_bytes,
+        bloom_cache_bytes=bloom_cache_bytes,
+        compression=compression,
+        compression_min_size=compression_min_size,
+        shards=shards,
+        partition_index=partition_index,
+        partition_peers=partition_peers,
+        snapshot_interval=snapshot_interval,
+        ordered_index=ordered_index,
+        ttl_sweep_interval=ttl_sweep_interval,
+        keydir_memory_bytes=keydir_memory_bytes,
+        **service_kwargs,
+    )
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+        print("Metrics served on port {}".format(metrics_port))
     port = str(port)
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=20))
+    options = []
+    if max_concurrent_streams:
+        options.append(("grpc.max_concurrent_streams", max_concurrent_streams))
+    if partition_peers:
+        # All workers listen on the public port, the kernel spreads the
+        # client connections over them.
+        options.append(("grpc.so_reuseport", 1))
+        # Held until serving ends, a garbage collected server is stopped
+        partition_server = _start_partition_server(
+            kv_svc, partition_peers[partition_index], io_workers
+        )
+    if server_mode == consts.SERVER_MODE_AIO:
+        asyncio.run(_serve_aio(kv_svc, port, options))
+        _shutdown(kv_svc, partition_server)
+        return
+    # RPCs past max_concurrent_rpcs are rejected with RESOURCE_EXHAUSTED
+    server = grpc.server(
+        executor, options=options, maximum_concurrent_rpcs=max_concurrent_rpcs
+    )
     bitc_pb2_grpc.add_BitCdbKeyValueServiceServicer_to_server(kv_svc, server)
+    bitc_pb2_grpc.add_BitCdbKeyValueServiceV2Servicer_to_server(
+        BitCdbV2(kv_svc), server
+    )
     server.add_insecure_port("[::]:" + port)
     server.start()
     print("Server started, listening on " + port)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(
+            signum,
+            lambda signum, frame: server.stop(consts.SHUTDOWN_GRACE_SECONDS),
+        )
     server.wait_for_termination()
+    _shutdown(kv_svc, partition_server)
+
+
+def _shutdown(kv_svc, partition_server):
+    """Clean shutdown once the server stopped, writes the KeyDir snapshot."""
+    if partition_server is not None:
+        partition_server.stop(consts.SHUTDOWN_GRACE_SECONDS).wait()
+    kv_svc.close()
+    print("Server stopped")
+
+
+def _serve_processes(serve_kwargs):
+    """
+    Start serve_kwargs["processes"] workers, each one serving the
+    partition of the keys hashing to its index, and wait for them. When one
+    of them exits the others are stopped too.
+    """
+    processes = serve_kwargs["processes"]
+    db_dir = serve_kwargs["db_dir"]
+    check_shard_layout(db_dir, processes)
+    for index in range(processes):
+        shard_path(db_dir, index)
+    serve_kwargs["rebuild_workers"] = max(
+        1, serve_kwargs["rebuild_workers"] // processes
+    )
+    # Spawned, gRPC doesn't support forking a process that already used it
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=serve,
+            kwargs=dict(serve_kwargs, partition_index=index),
+            name="bitc-worker-{}".format(index),
+        )
+        for index in range(processes)
+    ]
+    # Stopping the server stops the workers, see the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for worker in workers:
+        worker.start()
+    print(
+        "Started {} worker processes on port {}, partitions on ports {}-{}".format(
+            processes,
+            serve_kwargs["port"],
+            serve_kwargs["port"] + 1,
+            serve_kwargs["port"] + processes,
+        )
+    )
+    try:
+        wait([worker.sentinel for worker in workers])
+        for worker in workers:
+            if worker.exitcode is not None:
+                LOG.error(
+                    "Worker {} exited with {}, stopping".format(
+                        worker.name, worker.exitcode
+                    )
+                )
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def _start_partition_server(kv_svc, address, io_workers):
+    """
+    Serve the local partition of a worker to the other workers. Its own
+    threads, so requests forwarded between workers never wait for a
+    request thread held by a client request that is itself forwarding.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=io_workers))
+    bitc_pb2_grpc.add_BitCdbKeyValueServiceV2Servicer_to_server(
+        BitCdbV2(kv_svc, persistor=kv_svc._persistor.local), server
+    )
+    server.add_insecure_port("{}:{}".format(*address))
+    server.start()
+    return server
+
+
+async def _serve_aio(kv_svc, port, options):
+    # Admission control is done by AsyncBitCdb, grpc.aio.server does not
+    # enforce maximum_concurrent_rpcs.
+    server = grpc.aio.server(options=options)
+    bitc_pb2_grpc.add_BitCdbKeyValueServiceServicer_to_server(kv_svc, server)
+    bitc_pb2_grpc.add_BitCdbKeyValueServiceV2Servicer_to_server(
+        AsyncBitCdbV2(kv_svc), server
+    )
+    server.add_insecure_port("[::]:" + port)
+    await server.start()
+    print("Server started in asyncio mode, listening on " + port)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            signum,
+            lambda: asyncio.ensure_future(server.stop(consts.SHUTDOWN_GRACE_SECONDS)),
+        )
+    await server.wait_for_termination()
 
 
 def main():
@@ -35,8 +243,8 @@ def main():
     parser.add_argument(
         "--merge-interval",
         required=False,
-        default=3600 * 12,
-        help="File merge interval",
+        default=consts.DEFAULT_MERGE_CHECK_INTERVAL,
+        help="Seconds between checks of data file fragmentation",
     )
     parser.add_argument(
         "--max-cask-file-size",
@@ -44,11 +252,206 @@ def main():
         default=100 * 1000 * 1000,
         help="Max cask file size in bytes",
     )
+    parser.add_argument(
+        "--durability",
+        required=False,
+        default=consts.DURABILITY_ALWAYS,
+        choices=consts.DURABILITY_MODES,
+        help="always: fsync every write batch, batch: wait up to "
+        "--batch-window-ms or --batch-max-bytes before writing and syncing a "
+        "batch, os: leave flushing to the OS",
+    )
+    parser.add_argument(
+        "--batch-window-ms",
+        required=False,
+        default=consts.DEFAULT_BATCH_WINDOW_MS,
+        help="Max time a write batch waits for more writes in batch mode",
+    )
+    parser.add_argument(
+        "--batch-max-bytes",
+        required=False,
+        default=consts.DEFAULT_BATCH_MAX_BYTES,
+        help="Batch size that triggers an early write in batch mode",
+    )
+    parser.add_argument(
+        "--mmap-reads",
+        action="store_true",
+        help="Serve reads of rotated (immutable) data files through mmap",
+    )
+    parser.add_argument(
+        "--compact-keydir",
+        action="store_true",
+        help="Use the array backed KeyDir, slower lookups but far less memory per key",
+    )
+    parser.add_argument(
+        "--rebuild-workers",
+        required=False,
+        default=os.cpu_count(),
+        help="Processes used to parse hint files when rebuilding the index",
+    )
+    parser.add_argument(
+        "--lazy-index",
+        action="store_true",
+        help="Start serving before the index is built, build it in the background",
+    )
+    parser.add_argument(
+        "--merge-dead-ratio",
+        required=False,
+        default=consts.DEFAULT_MERGE_DEAD_RATIO,
+        help="Merge a data file once this fraction of it is garbage",
+    )
+    parser.add_argument(
+        "--merge-min-dead-bytes",
+        required=False,
+        default=consts.DEFAULT_MERGE_MIN_DEAD_BYTES,
+        help="Merge a data file once this many of its bytes are garbage",
+    )
+    parser.add_argument(
+        "--merge-bytes-per-sec",
+        required=False,
+        default=0,
+        help="Max rate merge reads data files at, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--cache-bytes",
+        required=False,
+        default=0,
+        help="Size of the LRU cache of hot values in bytes, 0 to disable",
+    )
+    parser.add_argument(
+        "--bloom-cache-bytes",
+        required=False,
+        default=consts.DEFAULT_BLOOM_CACHE_BYTES,
+        help="Memory for the Bloom filters of data files, used by lookups of "
+        "keys not indexed yet with --lazy-index. 0 to disable",
+    )
+    parser.add_argument(
+        "--compression",
+        required=False,
+        default="none",
+        choices=compression.available_codecs(),
+        help="Codec new values are compressed with, lz4 and zstd need the "
+        "lz4 and zstandard packages",
+    )
+    parser.add_argument(
+        "--compression-min-size",
+        required=False,
+        default=consts.DEFAULT_COMPRESSION_MIN_SIZE,
+        help="Values smaller than this many bytes are stored uncompressed",
+    )
+    parser.add_argument(
+        "--shards",
+        required=False,
+        default=1,
+        help="Split the data in this many shards, each with its own files, "
+        "KeyDir and merges. Fixed once the directory holds data",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        required=False,
+        default=0,
+        help="Seconds between KeyDir snapshots, also written on shutdown and "
+        "loaded at startup instead of replaying every hint file. 0 to disable",
+    )
+    parser.add_argument(
+        "--ordered-index",
+        action="store_true",
+        help="Keep the keys sorted in memory too, for the scan RPC",
+    )
+    parser.add_argument(
+        "--ttl-sweep-interval",
+        required=False,
+        default=consts.DEFAULT_TTL_SWEEP_INTERVAL,
+        help="Seconds between sweeps dropping expired keys from the KeyDir, "
+        "expired keys are never returned either way. 0 to disable",
+    )
+    parser.add_argument(
+        "--keydir-memory-bytes",
+        required=False,
+        default=0,
+        help="Keep at most about this many bytes of the KeyDir in memory, keys "
+        "that don't fit are looked up in sorted index files next to the hint "
+        "files. 0 keeps the whole KeyDir in memory",
+    )
+    parser.add_argument(
+        "--processes",
+        required=False,
+        default=1,
+        help="Worker processes, each serving the keys of one hash partition of "
+        "the data. Workers also listen on ports PORT+1 to PORT+N of 127.0.0.1 "
+        "for requests forwarded by the others",
+    )
+    parser.add_argument(
+        "--server-mode",
+        required=False,
+        default=consts.SERVER_MODE_THREAD,
+        choices=consts.SERVER_MODES,
+        help="thread: one worker thread per in flight request, aio: asyncio "
+        "server handing storage calls to --io-workers threads",
+    )
+    parser.add_argument(
+        "--io-workers",
+        required=False,
+        default=consts.DEFAULT_IO_WORKERS,
+        help="Request threads in thread mode, storage I/O threads in aio mode",
+    )
+    parser.add_argument(
+        "--max-concurrent-rpcs",
+        required=False,
+        default=None,
+        help="Reject requests with RESOURCE_EXHAUSTED past this many in flight",
+    )
+    parser.add_argument(
+        "--max-concurrent-streams",
+        required=False,
+        default=None,
+        help="Max concurrent HTTP/2 streams per client connection",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        required=False,
+        default=0,
+        help="Serve Prometheus metrics over HTTP on this port, 0 to disable",
+    )
     args = parser.parse_args()
     cask_file_size = int(args.max_cask_file_size)
     merge_interval = int(args.merge_interval)
     port = int(args.port)
-    serve(port, args.db_dir, merge_interval, cask_file_size)
+    serve(
+        port,
+        args.db_dir,
+        merge_interval,
+        cask_file_size,
+        durability=args.durability,
+        batch_window_ms=float(args.batch_window_ms),
+        batch_max_bytes=int(args.batch_max_bytes),
+        use_mmap=args.mmap_reads,
+        compact_keydir=args.compact_keydir,
+        rebuild_workers=int(args.rebuild_workers),
+        lazy_index=args.lazy_index,
+        merge_dead_ratio=float(args.merge_dead_ratio),
+        merge_min_dead_bytes=int(args.merge_min_dead_bytes),
+        merge_bytes_per_sec=int(args.merge_bytes_per_sec),
+        cache_bytes=int(args.cache_bytes),
+        bloom_cache_bytes=int(args.bloom_cache_bytes),
+        compression=args.compression,
+        compression_min_size=int(args.compression_min_size),
+        shards=int(args.shards),
+        server_mode=args.server_mode,
+        io_workers=int(args.io_workers),
+        max_concurrent_rpcs=(
+            int(args.max_concurrent_rpcs) if args.max_concurrent_rpcs else None
+        ),
+        max_concurrent_streams=(
+            int(args.max_concurrent_streams) if args.max_concurrent_streams else None
+        ),
+        metrics_port=int(args.metrics_port),
+        snapshot_interval=float(args.snapshot_interval),
+        ordered_index=args.ordered_index,
+        ttl_sweep_interval=float(args.ttl_sweep_interval),
+        keydir_memory_bytes=int(args.keydir_memory_bytes),
+        processes=int(args.processes),
+    )
 
 
 if __name__ == "__main__":
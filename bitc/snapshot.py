@@ -0,0 +1,125 @@
+"""
+KeyDir snapshot file. One sequential file holding every KeyDir entry plus
+the point of the log it covers: the newest data file and its size when
+the snapshot was taken. Fixed size fields are stored column by column so
+a snapshot loads with a few bulk array reads instead of a decode per key.
+
+Layout, little endian, followed by a crc32 of everything before it:
+    header      magic, version, covered file id, covered offset,
+                file count, entry count
+    files       file id, size, dead bytes of every data file
+    columns     file ids, value positions, value sizes, timestamps, key
+                lengths and expiry times of the entries, one array each
+    keys        the keys of the entries, concatenated
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+SNAPSHOT_MAGIC = b"BCKS"
+# Version 2 added the expiry column, older snapshots are ignored
+SNAPSHOT_VERSION = 2
+_HEADER = struct.Struct("<4sHIQII")
+_FILE = struct.Struct("<IQQ")
+_CRC = struct.Struct("<I")
+# typecode of each entry column, in file order
+_COLUMNS = ("I", "Q", "I", "I", "H", "I")
+
+
+def _little_endian(column):
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def write_snapshot(path, covered_file_id, covered_offset, files, entries):
+    """
+    Write and sync a snapshot to path. Callers write to a temporary path
+    and rename it over the snapshot, so a crash leaves the old or the new.
+
+    files is [(file_id, size, dead_bytes)], entries is [(key, entry)] with
+    CaskKeyDirEntry values.
+    """
+    columns = [array(typecode) for typecode in _COLUMNS]
+    file_ids, positions, sizes, tstamps, key_lens, expires = columns
+    for key, entry in entries:
+        file_ids.append(entry.file_obj.file_id)
+        positions.append(entry.value_pos)
+        sizes.append(entry.value_size)
+        tstamps.append(entry.tstamp)
+        key_lens.append(len(key))
+        expires.append(entry.expires)
+    chunks = [
+        _HEADER.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            covered_file_id,
+            covered_offset,
+            len(files),
+            len(entries),
+        ),
+        b"".join(_FILE.pack(*data_file) for data_file in files),
+    ]
+    chunks.extend(_little_endian(column).tobytes() for column in columns)
+    chunks.append(b"".join(key for key, _ in entries))
+    crc = 0
+    with open(path, "wb") as fh:
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            fh.write(chunk)
+        fh.write(_CRC.pack(crc))
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def read_snapshot(path):
+    """
+    Load the snapshot at path. Returns None when it is missing, truncated
+    or corrupt, else (covered_file_id, covered_offset, files, entries) with
+    files {file_id: (size, dead_bytes)} and entries an iterator of
+    (key, file_id, value_pos, value_size, tstamp, expires).
+    """
+    try:
+        with open(path, "rb") as fh:
+            data = memoryview(fh.read())
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER.size + _CRC.size:
+        return None
+    (crc,) = _CRC.unpack_from(data, len(data) - _CRC.size)
+    data = data[: len(data) - _CRC.size]
+    if zlib.crc32(data) != crc:
+        return None
+    magic, version, covered_file_id, covered_offset, file_count, count = (
+        _HEADER.unpack_from(data)
+    )
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    offset = _HEADER.size
+    files = {}
+    for _ in range(file_count):
+        file_id, size, dead_bytes = _FILE.unpack_from(data, offset)
+        files[file_id] = (size, dead_bytes)
+        offset += _FILE.size
+    columns = []
+    for typecode in _COLUMNS:
+        column = array(typecode)
+        end = offset + count * column.itemsize
+        column.frombytes(data[offset:end])
+        columns.append(_little_endian(column))
+        offset = end
+    keys = bytes(data[offset:])
+    return covered_file_id, covered_offset, files, _iter_entries(keys, *columns)
+
+
+def _iter_entries(keys, file_ids, positions, sizes, tstamps, key_lens, expires):
+    key_start = 0
+    for file_id, value_pos, value_size, tstamp, key_len, expiry in zip(
+        file_ids, positions, sizes, tstamps, key_lens, expires
+    ):
+        key_end = key_start + key_len
+        yield keys[key_start:key_end], file_id, value_pos, value_size, tstamp, expiry
+        key_start = key_end
@@ -1,5 +1,8 @@
 import glob
+import math
 import os
+import time
+import zlib
 
 from bitc import consts
 
@@ -8,6 +11,61 @@ class CaskIOException(Exception):
     pass
 
 
+def to_bytes(data):
+    """Keys and values are stored as bytes, str is utf-8 encoded."""
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return bytes(data)
+
+
+def prefix_end(prefix):
+    """Smallest key greater than every key starting with prefix, None if unbounded."""
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def key_shard(key, shards):
+    """
+    Shard of a bytes key. crc32 rather than hash(), whose value for bytes
+    changes with every interpreter start.
+    """
+    return zlib.crc32(key) % shards
+
+
+def expiry_time(ttl):
+    """
+    Epoch second a key stored now with a TTL of ttl seconds expires at,
+    rounded up so it lives at least ttl seconds. 0, never, for a ttl of 0.
+    """
+    if not ttl:
+        return 0
+    if ttl < 0:
+        raise ValueError("TTL must not be negative, got {}".format(ttl))
+    expires = math.ceil(time.time()) + int(ttl)
+    if expires > 0xFFFFFFFF:
+        raise ValueError("TTL of {} seconds is too large".format(ttl))
+    return expires
+
+
+class RateLimiter(object):
+    """Sleeps in consume() to keep the average rate under bytes_per_sec."""
+
+    def __init__(self, bytes_per_sec):
+        self._bytes_per_sec = bytes_per_sec
+        self._start = time.monotonic()
+        self._consumed = 0
+
+    def consume(self, size):
+        if not self._bytes_per_sec:
+            return
+        self._consumed += size
+        ahead = self._consumed / self._bytes_per_sec - (time.monotonic() - self._start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
 def get_datafiles(file_path):
     return sorted(
         glob.glob(os.path.join(file_path, consts.DATA_FILE_NAME_FORMAT.format("*"))),
@@ -35,7 +93,24 @@ def get_hint_filename_for_data_file(data_file):
     return data_file.replace(".data", ".hint")
 
 
+def get_bloom_filename_for_data_file(data_file):
+    return data_file.replace(".data", ".bloom")
+
+
+def get_index_filename_for_data_file(data_file):
+    return data_file.replace(".data", ".index")
+
+
 def has_hint_file(file_path, data_file_name_id):
     return os.path.exists(
         os.path.join(file_path, consts.HINT_FILE_NAME_FORMAT.format(data_file_name_id))
     )
+
+
+def sync_dir(path):
+    """fsync a directory, so renames and deletions in it are durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
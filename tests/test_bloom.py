@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+
+import pytest
+
+from bitc import bitc_storage, utils
+from bitc.bitc_storage import CaskStorage
+from bitc.bloom import BloomFilter, BloomFilterCache, read_bloom_file, write_bloom_file
+from bitc.keydir import KeyDir
+
+
+def test_filter_has_no_false_negatives_and_few_false_positives():
+    keys = [b"k%d" % i for i in range(5000)]
+    bloom = BloomFilter.for_keys(keys, fp_rate=0.01)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(b"other%d" % i in bloom for i in range(20000))
+    assert false_positives < 20000 * 0.03
+
+
+def test_filter_file_roundtrip_and_corruption(tmp_path):
+    path = str(tmp_path / "0.bloom")
+    bloom = BloomFilter.for_keys([b"a", b"b"])
+    write_bloom_file(path, bloom, sync=False)
+    loaded = read_bloom_file(path)
+    assert loaded.bit_count == bloom.bit_count
+    assert b"a" in loaded and b"b" in loaded
+
+    with open(path, "r+b") as fh:
+        fh.seek(20)
+        fh.write(b"\xff")
+    assert read_bloom_file(path) is None
+    with open(path, "r+b") as fh:
+        fh.truncate(10)
+    assert read_bloom_file(path) is None
+    assert read_bloom_file(str(tmp_path / "missing.bloom")) is None
+
+
+class FakeDataFile(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def test_cache_stays_within_its_byte_budget(tmp_path):
+    files = []
+    for i in range(10):
+        name = str(tmp_path / "{}.data".format(i))
+        write_bloom_file(
+            utils.get_bloom_filename_for_data_file(name),
+            BloomFilter.for_keys([b"k%d" % j for j in range(1000)]),
+            sync=False,
+        )
+        files.append(FakeDataFile(name))
+    size = read_bloom_file(utils.get_bloom_filename_for_data_file(files[0].name)).size
+    cache = BloomFilterCache(3 * (size + 200))
+    for data_file in files:
+        assert b"k1" in cache.get(data_file)
+    stats = cache.stats()
+    assert stats["filters"] == 3
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] == 7
+    cache.invalidate_files(files)
+    assert cache.stats()["bytes"] == 0
+
+
+def open_storage(db_dir, background=False):
+    storage = CaskStorage(str(db_dir), KeyDir(), max_file_size=300, durability="os")
+    storage.rebuild_index(background=background)
+    return storage
+
+
+def wait_for_blooms(storage, timeout=10):
+    """Wait for the filters that sealing writes from a thread."""
+    deadline = time.monotonic() + timeout
+    for data_file in storage.read_files():
+        if data_file is storage._data_file:
+            continue
+        path = utils.get_bloom_filename_for_data_file(data_file.name)
+        while not os.path.exists(path):
+            assert time.monotonic() < deadline, "no filter for " + data_file.name
+            time.sleep(0.01)
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Once cleared, holds the background indexer before each file until set."""
+    gate = threading.Event()
+    gate.set()
+    for name in ("scan_hint_file", "scan_data_file"):
+        scan = getattr(bitc_storage, name)
+
+        def gated_scan(file_name, scan=scan):
+            gate.wait()
+            return scan(file_name)
+
+        monkeypatch.setattr(bitc_storage, name, gated_scan)
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Names of the files scanned by lookups of unindexed keys."""
+    looked_up = []
+    for name in ("lookup_hint_file", "lookup_data_file"):
+        lookup = getattr(bitc_storage, name)
+
+        def recording_lookup(file_name, *args, lookup=lookup):
+            looked_up.append(os.path.basename(file_name))
+            return lookup(file_name, *args)
+
+        monkeypatch.setattr(bitc_storage, name, recording_lookup)
+    return looked_up
+
+
+def fill(db_dir):
+    storage = open_storage(db_dir)
+    model = {}
+    for i in range(60):
+        key = b"k%d" % (i % 40)
+        model[key] = b"v%d" % i
+        storage.store(key, model[key])
+    storage.delete(b"k5")
+    model[b"k5"] = None
+    wait_for_blooms(storage)
+    storage.close()
+    return model
+
+
+def test_lookups_of_unindexed_keys_skip_files_by_filter(tmp_path, gate, lookups):
+    model = fill(tmp_path)
+    gate.clear()
+    storage = open_storage(tmp_path, background=True)
+    files = len(storage.read_files())
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+    assert storage.retrieve(b"missing") is None
+    # Without filters every key is looked for file by file, newest first
+    assert len(lookups) < len(model) * files / 2
+
+
+def test_missing_or_corrupt_filters_fall_back_to_scanning(tmp_path, gate):
+    model = fill(tmp_path)
+    for index, data_file in enumerate(utils.get_datafiles(str(tmp_path))):
+        path = utils.get_bloom_filename_for_data_file(data_file)
+        if index % 2:
+            os.remove(path)
+        else:
+            with open(path, "r+b") as fh:
+                fh.write(b"junk")
+    gate.clear()
+    storage = open_storage(tmp_path, background=True)
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize("survived_ops", range(24))
+def test_merge_crash_never_leaves_a_stale_filter(
+    tmp_path, monkeypatch, gate, survived_ops
+):
+    storage = open_storage(tmp_path)
+    model = {}
+    for round_ in range(3):
+        for i in range(round_, 40, round_ + 1):
+            model[b"k%d" % i] = b"v%d-%d" % (round_, i)
+            storage.store(b"k%d" % i, model[b"k%d" % i])
+    wait_for_blooms(storage)
+    ops = []
+
+    def crashing(op):
+        def crash_after_survived_ops(*args):
+            if len(ops) == survived_ops:
+                raise Crash()
+            ops.append(args)
+            return op(*args)
+
+        return crash_after_survived_ops
+
+    with monkeypatch.context() as crash_patch:
+        for name in ("rename", "remove", "replace"):
+            crash_patch.setattr(bitc_storage.os, name, crashing(getattr(os, name)))
+        try:
+            storage.merge()
+        except Crash:
+            pass
+
+    gate.clear()
+    reopened = open_storage(tmp_path, background=True)
+    # Served by lookups through the filters of the files on disk
+    for key, value in model.items():
+        assert reopened.retrieve(key) == value
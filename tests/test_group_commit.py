@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from bitc import cask_file
+from bitc.bitc_storage import CaskStorage
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir, **kwargs):
+    storage = CaskStorage(str(db_dir), KeyDir(), max_file_size=1 << 20, **kwargs)
+    storage.rebuild_index()
+    return storage
+
+
+def store_concurrently(storage, writers, per_writer):
+    start = threading.Barrier(writers)
+
+    def write(writer):
+        start.wait()
+        for i in range(per_writer):
+            storage.store(b"w%d-%d" % (writer, i), b"v%d" % i)
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    fsync = cask_file.os.fsync
+
+    def counting_fsync(fd):
+        calls.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(cask_file.os, "fsync", counting_fsync)
+    return calls
+
+
+@pytest.mark.parametrize("durability", ["always", "batch", "os"])
+def test_concurrent_writes_are_all_readable_after_reopen(tmp_path, durability):
+    storage = open_storage(tmp_path, durability=durability, batch_window_ms=1)
+    store_concurrently(storage, writers=8, per_writer=50)
+
+    reopened = open_storage(tmp_path)
+    for writer in range(8):
+        for i in range(50):
+            assert reopened.retrieve(b"w%d-%d" % (writer, i)) == b"v%d" % i
+
+
+def test_batch_mode_shares_one_fsync_between_writers(tmp_path, fsyncs):
+    storage = open_storage(tmp_path, durability="batch", batch_window_ms=20)
+    store_concurrently(storage, writers=8, per_writer=10)
+    # Data and hint file are synced once per batch
+    assert 0 < len(fsyncs) < 2 * 8 * 10
+
+
+def test_os_mode_never_fsyncs(tmp_path, fsyncs):
+    storage = open_storage(tmp_path, durability="os")
+    store_concurrently(storage, writers=4, per_writer=10)
+    assert fsyncs == []
+
+
+def test_delete_reports_whether_key_existed(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.store(b"k1", b"v1")
+    assert storage.delete(b"k1")
+    assert not storage.delete(b"k1")
+    assert storage.retrieve(b"k1") is None
+
+
+def test_offsets_count_encoded_bytes(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.store("ключ".encode(), "значение".encode())
+    storage.store(b"k2", b"v2")
+    reopened = open_storage(tmp_path)
+    assert reopened.retrieve("ключ".encode()) == "значение".encode()
+    assert reopened.retrieve(b"k2") == b"v2"
+
+
+def test_unknown_durability_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        CaskStorage(str(tmp_path), KeyDir(), durability="sometimes")
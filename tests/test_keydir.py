@@ -0,0 +1,122 @@
+import gc
+import random
+
+from bitc.bitc_storage import CaskKeyDirEntry, CaskStorage
+from bitc.keydir import CompactKeyDir
+
+
+class FakeDataFile(object):
+    pass
+
+
+def test_compact_keydir_roundtrip():
+    key_dir = CompactKeyDir(capacity=4)
+    data_file = FakeDataFile()
+    for i in range(100):
+        key_dir.add(b"key-%d" % i, CaskKeyDirEntry(data_file, 10, i * 10, 5))
+    for i in range(0, 100, 2):
+        key_dir.delete(b"key-%d" % i)
+    assert len(key_dir) == 50
+    entry = key_dir.get(b"key-7")
+    assert (entry.file_obj, entry.value_size, entry.value_pos) == (data_file, 10, 70)
+    assert entry.tstamp == 5
+    assert key_dir.get(b"key-8") is None
+
+
+def test_compact_keydir_matches_dict_under_random_updates():
+    rng = random.Random(3)
+    key_dir = CompactKeyDir(capacity=8)
+    files = [FakeDataFile() for _ in range(3)]
+    model = {}
+    for step in range(5000):
+        key = b"k%d" % rng.randrange(300)
+        if key in model and rng.random() < 0.3:
+            key_dir.delete(key)
+            del model[key]
+        else:
+            model[key] = (rng.choice(files), rng.randrange(100), step)
+            key_dir.add(key, CaskKeyDirEntry(model[key][0], *model[key][1:], 1))
+    assert len(key_dir) == len(model)
+    for i in range(300):
+        entry = key_dir.get(b"k%d" % i)
+        expected = model.get(b"k%d" % i)
+        if expected is None:
+            assert entry is None
+        else:
+            assert (entry.file_obj, entry.value_size, entry.value_pos) == expected
+
+
+def test_compact_keydir_handles_non_ascii_keys():
+    key_dir = CompactKeyDir()
+    data_file = FakeDataFile()
+    key_dir.add("ключ".encode(), CaskKeyDirEntry(data_file, 1, 2, 3))
+    key_dir.add("键".encode(), CaskKeyDirEntry(data_file, 4, 5, 6))
+    assert key_dir.get("ключ".encode()).value_pos == 2
+    assert key_dir.get("键".encode()).value_pos == 5
+
+
+def test_compact_keydir_does_not_keep_files_alive():
+    key_dir = CompactKeyDir()
+    data_file = FakeDataFile()
+    key_dir.add(b"key", CaskKeyDirEntry(data_file, 10, 0, 5))
+    del data_file
+    assert key_dir.get(b"key").file_obj is None
+
+
+def test_compact_keydir_reuses_slots_of_collected_files():
+    key_dir = CompactKeyDir()
+    data_file = FakeDataFile()
+    key_dir.add(b"key", CaskKeyDirEntry(data_file, 10, 0, 5))
+    for i in range(50):
+        # The key moves to a new file and the old one is dropped, as a
+        # merge does
+        data_file = FakeDataFile()
+        key_dir.add(b"key", CaskKeyDirEntry(data_file, 10, i, 5))
+        gc.collect()
+    assert len(key_dir._file_refs) <= 2
+    assert key_dir.get(b"key").file_obj is data_file
+
+
+def test_compact_keydir_entry_left_on_collected_file_stays_dead():
+    key_dir = CompactKeyDir()
+    key_dir.add(b"stale", CaskKeyDirEntry(FakeDataFile(), 10, 0, 5))
+    gc.collect()
+    # Takes over the slot of the collected file
+    data_file = FakeDataFile()
+    key_dir.add(b"live", CaskKeyDirEntry(data_file, 10, 0, 5))
+    assert len(key_dir._file_refs) == 1
+    assert key_dir.get(b"live").file_obj is data_file
+    assert key_dir.get(b"stale").file_obj is None
+
+
+def test_compact_keydir_file_slots_stay_bounded_across_merges(tmp_path):
+    key_dir = CompactKeyDir()
+    storage = CaskStorage(str(tmp_path), key_dir, max_file_size=200, durability="os")
+    storage.rebuild_index()
+    rounds = 12
+    for round_ in range(rounds):
+        for i in range(20):
+            storage.store(b"k%d" % i, b"v%d-%d" % (round_, i))
+        storage.merge()
+        gc.collect()
+    # Every round opens new data files and merges old ones away
+    assert len(key_dir._file_refs) < rounds
+    for i in range(20):
+        assert storage.retrieve(b"k%d" % i) == b"v%d-%d" % (rounds - 1, i)
+    storage.close()
+
+
+def test_compact_keydir_arena_stays_bounded_under_churn():
+    key_dir = CompactKeyDir()
+    data_file = FakeDataFile()
+    keys = [b"key-%d" % i for i in range(100)]
+    for key in keys:
+        key_dir.add(key, CaskKeyDirEntry(data_file, 10, 0, 5))
+    live_bytes = sum(len(key) for key in keys)
+    for round_ in range(200):
+        for key in keys:
+            key_dir.delete(key)
+            key_dir.add(key, CaskKeyDirEntry(data_file, 10, round_, 5))
+    assert len(key_dir._arena) <= 2 * live_bytes + len(keys[-1])
+    assert len(key_dir) == len(keys)
+    assert key_dir.get(b"key-42").value_pos == 199
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from bitc import bitc_storage
+from bitc.bitc_storage import CaskStorage
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir):
+    return CaskStorage(str(db_dir), KeyDir(), max_file_size=200, durability="os")
+
+
+def wait_until_indexed(storage, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not storage.rebuild_progress()["done"]:
+        assert time.monotonic() < deadline, "index build did not finish"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def model(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.rebuild_index()
+    model = {}
+    for i in range(90):
+        key = b"k%d" % (i % 30)
+        model[key] = b"v%d" % i
+        storage.store(key, model[key])
+    storage.close()
+    return model
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Holds the background indexer before each file until set."""
+    gate = threading.Event()
+    for name in ("scan_hint_file", "scan_data_file"):
+        scan = getattr(bitc_storage, name)
+
+        def gated_scan(file_name, scan=scan):
+            gate.wait()
+            return scan(file_name)
+
+        monkeypatch.setattr(bitc_storage, name, gated_scan)
+    yield gate
+    gate.set()
+
+
+def test_reads_are_served_before_the_index_is_built(tmp_path, model, gate):
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(background=True)
+    assert len(storage._key_dir) == 0
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+    assert storage.retrieve(b"missing") is None
+
+    gate.set()
+    wait_until_indexed(storage)
+    assert len(storage._key_dir) == len(model)
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_writes_while_loading_win_over_older_records(tmp_path, model, gate):
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(background=True)
+    storage.store(b"k1", b"new")
+    assert storage.delete(b"k2")
+    assert not storage.delete(b"k2")
+    assert storage.retrieve(b"k1") == b"new"
+    assert storage.retrieve(b"k2") is None
+
+    gate.set()
+    wait_until_indexed(storage)
+    assert storage.retrieve(b"k1") == b"new"
+    assert storage.retrieve(b"k2") is None
+    assert storage.retrieve(b"k3") == model[b"k3"]
+
+
+def test_merge_waits_for_the_index(tmp_path, model, gate):
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(background=True)
+    files = len(storage.read_files())
+    storage.merge()
+    assert len(storage.read_files()) == files
+
+    gate.set()
+    wait_until_indexed(storage)
+    storage.merge()
+    assert len(storage.read_files()) < files
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_background_rebuild_parses_files_in_spawned_workers(
+    tmp_path, model, monkeypatch
+):
+    start_methods = []
+    pool = bitc_storage.ProcessPoolExecutor
+
+    def recording_pool(*args, **kwargs):
+        start_methods.append(kwargs["mp_context"].get_start_method())
+        return pool(*args, **kwargs)
+
+    monkeypatch.setattr(bitc_storage, "ProcessPoolExecutor", recording_pool)
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(workers=2, background=True)
+    wait_until_indexed(storage)
+    assert start_methods == ["spawn"]
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def failing_scan(monkeypatch, failures):
+    scan = bitc_storage.scan_hint_file
+
+    def flaky_scan(file_name):
+        if failures:
+            failures.pop()
+            raise OSError("flaky disk")
+        return scan(file_name)
+
+    monkeypatch.setattr(bitc_storage, "scan_hint_file", flaky_scan)
+
+
+def test_background_rebuild_retries_after_a_failure(tmp_path, model, monkeypatch):
+    failing_scan(monkeypatch, [1])
+    errors = []
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(background=True, on_error=errors.append)
+    wait_until_indexed(storage)
+    assert errors == []
+    assert len(storage._key_dir) == len(model)
+    storage.merge()
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_background_rebuild_reports_persistent_failure(tmp_path, model, monkeypatch):
+    failing_scan(monkeypatch, [1] * 2)
+    errors = threading.Event()
+    storage = open_storage(tmp_path)
+    storage.rebuild_index(background=True, on_error=lambda ex: errors.set())
+    assert errors.wait(10)
+    progress = storage.rebuild_progress()
+    assert not progress["done"]
+    assert progress["error"] == "flaky disk"
@@ -0,0 +1,218 @@
+import os
+import random
+
+import pytest
+
+from bitc import bitc_storage, utils
+from bitc.bitc_storage import CaskStorage
+from bitc.cask_file import scan_data_file
+from bitc.keydir import CompactKeyDir, KeyDir
+from bitc.utils import CaskIOException
+
+KEY_DIRS = {
+    "dict": KeyDir,
+    "compact": CompactKeyDir,
+}
+
+
+@pytest.fixture(params=sorted(KEY_DIRS))
+def key_dir_factory(request):
+    return KEY_DIRS[request.param]
+
+
+@pytest.fixture
+def same_second(monkeypatch):
+    # Records written within one second share their timestamp
+    monkeypatch.setattr(bitc_storage.time, "time", lambda: 1700000000.0)
+
+
+def open_storage(db_dir, key_dir, **kwargs):
+    storage = CaskStorage(
+        str(db_dir), key_dir, max_file_size=300, durability="os", **kwargs
+    )
+    storage.rebuild_index()
+    return storage
+
+
+def check(storage, model):
+    for key, value in model.items():
+        assert storage.retrieve(key) == value, key
+
+
+def test_random_merges_never_serve_stale_values(tmp_path, same_second, key_dir_factory):
+    rng = random.Random(7)
+    storage = open_storage(tmp_path, key_dir_factory())
+    model = {}
+    for step in range(300):
+        key = b"k%d" % rng.randrange(20)
+        roll = rng.random()
+        if roll < 0.1:
+            storage.delete(key)
+            model[key] = None
+        elif roll < 0.15:
+            files = storage.read_files()
+            storage.merge(rng.sample(files, rng.randint(1, len(files))))
+        else:
+            model[key] = b"v%d" % step
+            storage.store(key, model[key])
+        if step % 20 == 0:
+            check(storage, model)
+    check(storage, model)
+
+    reopened = open_storage(tmp_path, key_dir_factory())
+    check(reopened, model)
+
+
+def test_merge_keeps_same_second_write_made_while_merging(
+    tmp_path, same_second, monkeypatch, key_dir_factory
+):
+    storage = open_storage(tmp_path, key_dir_factory())
+    storage.store(b"k1", b"old")
+    for i in range(20):
+        storage.store(b"pad%d" % i, b"x" * 40)
+    finish = bitc_storage.CaskMergeOutput.finish
+
+    def write_then_finish(output, sync):
+        # Lands in the active file after merge copied the old record
+        if storage.retrieve(b"k1") == b"old":
+            storage.store(b"k1", b"new")
+        finish(output, sync)
+
+    monkeypatch.setattr(bitc_storage.CaskMergeOutput, "finish", write_then_finish)
+    storage.merge()
+    assert storage.retrieve(b"k1") == b"new"
+
+
+def test_merge_streams_into_files_of_bounded_size(tmp_path, key_dir_factory):
+    storage = open_storage(tmp_path, key_dir_factory())
+    model = {}
+    for round_ in range(5):
+        for i in range(20):
+            model[b"k%d" % i] = b"v%d-%d" % (round_, i)
+            storage.store(b"k%d" % i, model[b"k%d" % i])
+    files_before = len(storage.read_files())
+    storage.merge()
+    merged = storage.read_files()
+    assert len(merged) < files_before
+    assert all(data_file.size <= 300 for data_file in merged)
+    check(storage, model)
+    check(open_storage(tmp_path, key_dir_factory()), model)
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize("survived_ops", range(40))
+def test_merge_crash_while_swapping_loses_nothing(tmp_path, monkeypatch, survived_ops):
+    storage = open_storage(tmp_path, KeyDir())
+    model = {}
+    for round_ in range(2):
+        # Every other key is rewritten, merged files keep some records
+        for i in range(round_, 40, round_ + 1):
+            model[b"k%d" % i] = b"v%d-%d" % (round_, i)
+            storage.store(b"k%d" % i, model[b"k%d" % i])
+    ops = []
+
+    def crashing(op):
+        def crash_after_survived_ops(*args):
+            if len(ops) == survived_ops:
+                raise Crash()
+            ops.append(args)
+            return op(*args)
+
+        return crash_after_survived_ops
+
+    for name in ("rename", "remove"):
+        monkeypatch.setattr(bitc_storage.os, name, crashing(getattr(os, name)))
+    try:
+        storage.merge()
+    except Crash:
+        pass
+    monkeypatch.undo()
+    check(open_storage(tmp_path, KeyDir()), model)
+
+
+def record_bytes(storage, key):
+    entry = storage._key_dir.get(key)
+    with open(entry.file_obj.name, "rb") as fh:
+        fh.seek(entry.value_pos)
+        return fh.read(entry.value_size)
+
+
+def test_merge_copies_records_byte_for_byte(tmp_path, key_dir_factory):
+    storage = open_storage(tmp_path, key_dir_factory())
+    for round_ in range(3):
+        for i in range(15):
+            storage.store(b"k%d" % i, b"v%d-%d" % (round_, i) * (i + 1))
+    live = dict((b"k%d" % i, record_bytes(storage, b"k%d" % i)) for i in range(15))
+    storage.merge()
+    for key, raw in live.items():
+        assert record_bytes(storage, key) == raw
+
+
+def test_merge_leaves_corrupt_records_behind(tmp_path, key_dir_factory):
+    storage = open_storage(tmp_path, key_dir_factory())
+    for i in range(60):
+        storage.store(b"k%d" % i, b"v%d" % i)
+    entry = storage._key_dir.get(b"k3")
+    with open(entry.file_obj.name, "r+b") as fh:
+        # Flip the last byte of the value
+        fh.seek(entry.value_pos + entry.value_size - 1)
+        last = fh.read(1)
+        fh.seek(-1, os.SEEK_CUR)
+        fh.write(bytes([last[0] ^ 0xFF]))
+    with pytest.raises(CaskIOException):
+        storage.retrieve(b"k3")
+    storage.merge()
+    for data_file in utils.get_datafiles(str(tmp_path)):
+        scan_data_file(data_file)
+    reopened = open_storage(tmp_path, key_dir_factory())
+    assert reopened.retrieve(b"k3") is None
+    check(reopened, dict((b"k%d" % i, b"v%d" % i) for i in range(60) if i != 3))
+
+
+def test_dead_bytes_track_overwrites_and_pick_merge_candidates(tmp_path):
+    storage = open_storage(tmp_path, KeyDir())
+    for round_ in range(3):
+        for i in range(10):
+            storage.store(b"k%d" % i, b"v%d-%d" % (round_, i))
+    stats = storage.file_stats()
+    assert all(
+        stat["live_bytes"] + stat["dead_bytes"] == stat["size"] for stat in stats
+    )
+    live = sum(stat["live_bytes"] for stat in stats)
+    assert live == sum(storage._key_dir.get(b"k%d" % i).value_size for i in range(10))
+
+    candidates = storage.merge_candidates(dead_ratio=0.5, min_dead_bytes=1 << 30)
+    assert candidates and storage._data_file not in candidates
+    storage.merge(candidates)
+    assert sum(stat["dead_bytes"] for stat in storage.file_stats()) < sum(
+        stat["dead_bytes"] for stat in stats
+    )
+    assert storage.merge_candidates(dead_ratio=0.5, min_dead_bytes=1 << 30) == []
+
+
+def test_partial_merge_keeps_tombstones_of_keys_in_older_files(tmp_path):
+    storage = open_storage(tmp_path, KeyDir())
+    for i in range(20):
+        storage.store(b"k%d" % i, b"v%d" % i)
+    oldest = storage.read_files()[0]
+    storage.delete(b"k0")
+    for i in range(20, 40):
+        storage.store(b"k%d" % i, b"v%d" % i)
+    storage.merge([f for f in storage.read_files() if f is not oldest])
+    assert storage.retrieve(b"k0") is None
+    assert open_storage(tmp_path, KeyDir()).retrieve(b"k0") is None
+
+
+def test_merge_with_value_cache_serves_current_values(tmp_path):
+    storage = open_storage(tmp_path, KeyDir(), cache_bytes=1 << 16)
+    model = {}
+    for round_ in range(3):
+        for i in range(20):
+            model[b"k%d" % i] = b"v%d-%d" % (round_, i)
+            storage.store(b"k%d" % i, model[b"k%d" % i])
+        check(storage, model)
+        storage.merge()
+        check(storage, model)
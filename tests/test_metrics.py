@@ -0,0 +1,28 @@
+from bitc import metrics
+from bitc.bitcdb import BitCdb
+from bitc.bitc_storage import CaskStorage
+from bitc.keydir import KeyDir
+
+
+def sample(name):
+    for line in metrics.REGISTRY.render().splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    raise AssertionError("{} not rendered".format(name))
+
+
+def test_rebuild_progress_gauges(tmp_path):
+    storage = CaskStorage(str(tmp_path), KeyDir(), max_file_size=200, durability="os")
+    storage.rebuild_index()
+    for i in range(30):
+        storage.store(b"k%d" % i, b"v" * 20)
+    storage.close()
+    data_files = len(storage.read_files())
+
+    db = BitCdb(str(tmp_path), 200, durability="os")
+    try:
+        assert sample("bitc_rebuild_files_total") == data_files
+        assert sample("bitc_rebuild_files_done") == data_files
+        assert sample("bitc_rebuild_keys_indexed") == 30
+    finally:
+        db.close()
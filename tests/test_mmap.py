@@ -0,0 +1,69 @@
+import pytest
+
+from bitc.bitc_storage import CaskStorage
+from bitc.cask_file import CaskDataFile
+from bitc.utils import CaskIOException
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir, **kwargs):
+    storage = CaskStorage(
+        str(db_dir), KeyDir(), max_file_size=200, durability="os", **kwargs
+    )
+    storage.rebuild_index()
+    return storage
+
+
+def fill(storage, count):
+    model = {}
+    for i in range(count):
+        model[b"k%d" % (i % 15)] = b"v%d" % i
+        storage.store(b"k%d" % (i % 15), b"v%d" % i)
+    return model
+
+
+def test_sealed_files_are_mapped_and_active_file_is_not(tmp_path):
+    storage = open_storage(tmp_path, use_mmap=True)
+    model = fill(storage, 40)
+    sealed = [f for f in storage.read_files() if f is not storage._data_file]
+    assert sealed and all(f.mapped for f in sealed)
+    assert not storage._data_file.mapped
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_mapped_reads_match_pread_after_reopen_and_merge(tmp_path):
+    storage = open_storage(tmp_path)
+    model = fill(storage, 40)
+    storage.close()
+
+    mapped = open_storage(tmp_path, use_mmap=True)
+    assert all(f.mapped for f in mapped.read_files())
+    for key, value in model.items():
+        assert mapped.retrieve(key) == value
+    mapped.merge()
+    assert all(f.mapped for f in mapped.read_files())
+    for key, value in model.items():
+        assert mapped.retrieve(key) == value
+
+
+def test_mapped_read_checks_crc(tmp_path):
+    data_file = CaskDataFile(str(tmp_path), 1, False)
+    data_file.write(1700000000, b"k1", b"v1")
+    data_file.close()
+    path = tmp_path / data_file.basename
+    raw = bytearray(path.read_bytes())
+    raw[-1] ^= 0xFF
+    path.write_bytes(bytes(raw))
+
+    mapped = CaskDataFile(str(tmp_path), 1, True, use_mmap=True)
+    assert mapped.mapped
+    with pytest.raises(CaskIOException):
+        mapped.read(0, len(raw))
+
+
+def test_empty_file_falls_back_to_pread(tmp_path):
+    CaskDataFile(str(tmp_path), 1, False).close()
+    empty = CaskDataFile(str(tmp_path), 1, True, use_mmap=True)
+    assert not empty.mapped
+    empty.close()
@@ -0,0 +1,120 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from bitc import consts, server, utils
+from bitc.bitc_storage import CaskStorage, check_shard_layout, shard_path
+from bitc.bitcdb import BitCdb
+from bitc.client import BitCdbBytesRpcClient, RPCFailedError
+from bitc.keydir import KeyDir
+
+PARTITIONS = 3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """The storages of PARTITIONS in process workers serving each other."""
+    peers = [("127.0.0.1", free_port()) for _ in range(PARTITIONS)]
+    services, partition_servers = [], []
+    for index in range(PARTITIONS):
+        kv_svc = BitCdb(
+            str(tmp_path),
+            300,
+            durability="os",
+            partition_index=index,
+            partition_peers=peers,
+        )
+        services.append(kv_svc)
+        partition_servers.append(
+            server._start_partition_server(kv_svc, peers[index], io_workers=4)
+        )
+    yield [kv_svc._persistor for kv_svc in services]
+    for partition_server in partition_servers:
+        partition_server.stop(None)
+    for kv_svc in services:
+        kv_svc.close()
+
+
+def test_keys_are_stored_by_their_owner_and_read_through_any_worker(workers):
+    for i in range(30):
+        workers[i % PARTITIONS].store(b"k%d" % i, b"v%d" % i)
+    for storage in workers:
+        for i in range(30):
+            assert storage.retrieve(b"k%d" % i) == b"v%d" % i
+    for index, storage in enumerate(workers):
+        for i in range(30):
+            key = b"k%d" % i
+            owned = utils.key_shard(key, PARTITIONS) == index
+            assert storage.local.retrieve(key) == (b"v%d" % i if owned else None)
+
+
+def test_batches_are_split_over_the_partitions_in_order(workers):
+    storage = workers[1]
+    storage.store_many([(b"k%d" % i, b"v%d" % i) for i in range(0, 30, 2)])
+    keys = [b"k%d" % i for i in range(29, -1, -1)]
+    expected = [b"v%d" % i if i % 2 == 0 else None for i in range(29, -1, -1)]
+    assert storage.retrieve_many(keys) == expected
+    assert workers[2].delete_many(keys) == [value is not None for value in expected]
+    assert workers[0].retrieve_many(keys) == [None] * len(keys)
+
+
+def test_export_covers_every_partition(workers):
+    model = dict((b"k%d" % i, b"v%d" % i) for i in range(30))
+    workers[0].store_many(list(model.items()))
+    workers[2].store(b"other", b"x")
+    assert dict(workers[1].export(b"k")) == model
+
+
+def test_partition_count_of_a_directory_is_fixed(tmp_path):
+    for index in range(PARTITIONS):
+        shard_path(str(tmp_path), index)
+    check_shard_layout(str(tmp_path), PARTITIONS)
+    with pytest.raises(ValueError):
+        check_shard_layout(str(tmp_path), PARTITIONS + 1)
+
+
+def test_multi_process_server_serves_all_partitions(tmp_path):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bitc.server", "--db-dir", str(tmp_path)]
+        + ["--port", str(port), "--processes", "2", "--durability", "os"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        client = BitCdbBytesRpcClient(host="127.0.0.1", port=port)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                client.put(b"k0", b"v0")
+                break
+            except RPCFailedError:
+                assert time.monotonic() < deadline, "server did not start"
+                time.sleep(0.2)
+        # Every connection lands on one worker, the others are forwarded to
+        client.multi_put([(b"k%d" % i, b"v%d" % i) for i in range(1, 20)])
+        reply = client.multi_get([b"k%d" % i for i in range(20)])
+        assert [item.value for item in reply.items] == [b"v%d" % i for i in range(20)]
+    finally:
+        process.terminate()
+        process.wait(30)
+
+    for index in range(2):
+        partition = CaskStorage(
+            os.path.join(str(tmp_path), consts.SHARD_DIR_FORMAT.format(index)),
+            KeyDir(),
+        )
+        partition.rebuild_index()
+        for i in range(20):
+            key = b"k%d" % i
+            owned = utils.key_shard(key, 2) == index
+            assert partition.retrieve(key) == (b"v%d" % i if owned else None)
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from bitc import utils
+from bitc.bitc_storage import CaskStorage
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir, workers=1):
+    storage = CaskStorage(str(db_dir), KeyDir(), max_file_size=200, durability="os")
+    storage.rebuild_index(workers=workers)
+    return storage
+
+
+@pytest.fixture
+def model(tmp_path):
+    storage = open_storage(tmp_path)
+    model = {}
+    for i in range(120):
+        key = b"k%d" % (i % 30)
+        model[key] = b"v%d" % i
+        storage.store(key, model[key])
+    storage.close()
+    return model
+
+
+def index_of(storage):
+    return {
+        key: (entry.file_obj.basename, entry.value_pos, entry.value_size)
+        for key, entry in storage._key_dir._index.items()
+    }
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_rebuild_keeps_newest_value(tmp_path, model, workers):
+    storage = open_storage(tmp_path, workers=workers)
+    assert len(storage._key_dir) == len(model)
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_parallel_rebuild_matches_sequential(tmp_path, model):
+    assert index_of(open_storage(tmp_path, workers=4)) == index_of(
+        open_storage(tmp_path, workers=1)
+    )
+
+
+def test_rebuild_scans_data_file_without_hint_file(tmp_path, model):
+    for data_file in utils.get_datafiles(str(tmp_path))[::2]:
+        os.remove(utils.get_hint_filename_for_data_file(data_file))
+    storage = open_storage(tmp_path, workers=2)
+    for key, value in model.items():
+        assert storage.retrieve(key) == value
+
+
+def test_rebuild_progress(tmp_path, model):
+    storage = open_storage(tmp_path, workers=2)
+    progress = storage.rebuild_progress()
+    files = len(utils.get_datafiles(str(tmp_path)))
+    assert (
+        progress.items()
+        >= {
+            "files_total": files,
+            "files_done": files,
+            "keys_indexed": len(model),
+            "done": True,
+        }.items()
+    )
+
+
+def test_rebuild_of_empty_directory_is_done(tmp_path):
+    storage = open_storage(tmp_path, workers=4)
+    assert storage.rebuild_progress()["done"]
+    assert len(storage._key_dir) == 0
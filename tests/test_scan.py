@@ -0,0 +1,143 @@
+import random
+import socket
+from concurrent import futures
+
+import grpc
+import pytest
+
+from bitc import bitc_pb2_grpc, consts, utils
+from bitc.bitc_storage import CaskStorage, ShardedCaskStorage
+from bitc.bitcdb import BitCdb, BitCdbV2
+from bitc.client import BitCdbBytesRpcClient
+from bitc.keydir import CompactKeyDir, KeyDir, OrderedKeyDir, OrderedKeyIndex
+from bitc.utils import CaskIOException
+
+KEY_DIRS = {
+    "dict": KeyDir,
+    "compact": CompactKeyDir,
+}
+
+
+@pytest.fixture(params=sorted(KEY_DIRS))
+def key_dir_factory(request):
+    return lambda: OrderedKeyDir(KEY_DIRS[request.param]())
+
+
+def open_storage(db_dir, key_dir):
+    storage = CaskStorage(str(db_dir), key_dir, max_file_size=300, durability="os")
+    storage.rebuild_index()
+    return storage
+
+
+def scan_all(storage, start=b"", end=None, limit=7):
+    """Every pair of the range, paging through it limit keys at a time."""
+    items = []
+    while start is not None:
+        page, start = storage.scan(start, end, limit)
+        assert len(page) <= limit
+        items.extend(page)
+    return items
+
+
+def test_ordered_index_matches_a_sorted_list():
+    rng = random.Random(5)
+    index = OrderedKeyIndex()
+    model = set()
+    for step in range(20000):
+        key = b"k%05d" % rng.randrange(6000)
+        if rng.random() < 0.3:
+            index.discard(key)
+            model.discard(key)
+        else:
+            index.add(key)
+            model.add(key)
+        if step % 2000 == 0:
+            start = b"k%05d" % rng.randrange(6000)
+            expected = sorted(key for key in model if key >= start)[:50]
+            assert index.range(start, limit=50) == expected
+    assert len(index) == len(model)
+    assert index.range(b"") == sorted(model)
+    assert index.range(b"k01000", b"k02000") == sorted(
+        key for key in model if b"k01000" <= key < b"k02000"
+    )
+
+
+def test_scan_pages_through_live_keys_in_order(tmp_path, key_dir_factory):
+    rng = random.Random(9)
+    storage = open_storage(tmp_path, key_dir_factory())
+    model = {}
+    for step in range(600):
+        key = b"k%03d" % rng.randrange(150)
+        roll = rng.random()
+        if roll < 0.2:
+            storage.delete(key)
+            model.pop(key, None)
+        elif roll < 0.22:
+            storage.merge()
+        else:
+            model[key] = b"v%d" % step
+            storage.store(key, model[key])
+    assert scan_all(storage) == sorted(model.items())
+    assert scan_all(storage, b"k050", b"k100") == sorted(
+        item for item in model.items() if b"k050" <= item[0] < b"k100"
+    )
+
+    reopened = open_storage(tmp_path, key_dir_factory())
+    assert scan_all(reopened) == sorted(model.items())
+
+
+def test_scan_needs_the_ordered_index(tmp_path):
+    storage = open_storage(tmp_path, KeyDir())
+    storage.store(b"k", b"v")
+    with pytest.raises(CaskIOException):
+        storage.scan()
+
+
+def test_sharded_scan_merges_the_shard_pages(tmp_path, key_dir_factory):
+    storage = ShardedCaskStorage(
+        str(tmp_path), 4, key_dir_factory, max_file_size=300, durability="os"
+    )
+    storage.rebuild_index()
+    model = dict((b"k%03d" % i, b"v%d" % i) for i in range(100))
+    storage.store_many(list(model.items()))
+    for limit in (1, 7, 100, 1000):
+        assert scan_all(storage, limit=limit) == sorted(model.items())
+
+
+def test_prefix_end():
+    assert utils.prefix_end(b"ab") == b"ac"
+    assert utils.prefix_end(b"a\xff") == b"b"
+    assert utils.prefix_end(b"\xff\xff") is None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_scan_rpc_pages_through_a_prefix(tmp_path):
+    kv_svc = BitCdb(str(tmp_path), 300, durability="os", ordered_index=True)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    bitc_pb2_grpc.add_BitCdbKeyValueServiceV2Servicer_to_server(
+        BitCdbV2(kv_svc), server
+    )
+    port = free_port()
+    server.add_insecure_port("127.0.0.1:{}".format(port))
+    server.start()
+    try:
+        client = BitCdbBytesRpcClient(host="127.0.0.1", port=port)
+        client.multi_put([(b"a%02d" % i, b"v%d" % i) for i in range(30)])
+        client.multi_put([(b"b%02d" % i, b"w%d" % i) for i in range(5)])
+        client.delete(b"a07")
+        assert list(client.scan_iter(prefix=b"a", page_size=4)) == [
+            (b"a%02d" % i, b"v%d" % i) for i in range(30) if i != 7
+        ]
+        page = client.scan(start=b"a25", limit=consts.MAX_SCAN_LIMIT + 1)
+        assert [item.key for item in page.items] == [
+            b"a%02d" % i for i in range(25, 30)
+        ] + [b"b%02d" % i for i in range(5)]
+        assert not page.more
+    finally:
+        server.stop(None)
+        kv_svc.close()
@@ -0,0 +1,128 @@
+import os
+import random
+import threading
+
+import pytest
+
+from bitc import bitc_storage, consts, utils
+from bitc.bitc_storage import CaskStorage, ShardedCaskStorage
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir, shards=4, **kwargs):
+    storage = ShardedCaskStorage(
+        str(db_dir), shards, KeyDir, max_file_size=300, durability="os", **kwargs
+    )
+    storage.rebuild_index(workers=shards)
+    return storage
+
+
+def test_keys_live_in_their_hash_shard(tmp_path):
+    storage = open_storage(tmp_path)
+    for i in range(50):
+        storage.store(b"k%d" % i, b"v%d" % i)
+    storage.close()
+    for index in range(4):
+        shard = CaskStorage(
+            os.path.join(str(tmp_path), consts.SHARD_DIR_FORMAT.format(index)),
+            KeyDir(),
+        )
+        shard.rebuild_index()
+        for i in range(50):
+            key = b"k%d" % i
+            expected = b"v%d" % i if utils.key_shard(key, 4) == index else None
+            assert shard.retrieve(key) == expected
+
+
+def test_random_ops_match_a_dict_across_merges_and_reopen(tmp_path):
+    rng = random.Random(3)
+    storage = open_storage(tmp_path)
+    model = {}
+    for step in range(400):
+        keys = [b"k%d" % rng.randrange(40) for _ in range(rng.randint(1, 5))]
+        roll = rng.random()
+        if roll < 0.1:
+            storage.delete_many(keys)
+            model.update(dict.fromkeys(keys))
+        elif roll < 0.13:
+            storage.merge()
+        else:
+            items = [(key, b"v%d" % step) for key in keys]
+            storage.store_many(items)
+            model.update(items)
+    keys = sorted(model)
+    assert storage.retrieve_many(keys) == [model[key] for key in keys]
+    storage.close()
+
+    reopened = open_storage(tmp_path)
+    assert reopened.retrieve_many(keys) == [model[key] for key in keys]
+
+
+def test_batch_results_keep_the_request_order(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.store_many([(b"k%d" % i, b"v%d" % i) for i in range(0, 20, 2)])
+    keys = [b"k%d" % i for i in range(19, -1, -1)]
+    assert storage.retrieve_many(keys) == [
+        b"v%d" % i if i % 2 == 0 else None for i in range(19, -1, -1)
+    ]
+    assert storage.delete_many(keys) == [i % 2 == 0 for i in range(19, -1, -1)]
+
+
+def test_merge_only_touches_the_given_files(tmp_path):
+    storage = open_storage(tmp_path)
+    for round_ in range(3):
+        for i in range(40):
+            storage.store(b"k%d" % i, b"v%d-%d" % (round_, i))
+    first = storage.shards[0]
+    before = [len(shard.read_files()) for shard in storage.shards]
+    storage.merge(first.read_files())
+    after = [len(shard.read_files()) for shard in storage.shards]
+    assert after[0] < before[0]
+    assert after[1:] == before[1:]
+    for i in range(40):
+        assert storage.retrieve(b"k%d" % i) == b"v2-%d" % i
+
+
+def test_shard_count_of_a_directory_is_fixed(tmp_path):
+    open_storage(tmp_path).close()
+    with pytest.raises(ValueError):
+        open_storage(tmp_path, shards=2)
+
+    unsharded = tmp_path / "unsharded"
+    unsharded.mkdir()
+    storage = CaskStorage(str(unsharded), KeyDir(), durability="os")
+    storage.rebuild_index()
+    storage.store(b"k", b"v")
+    storage.close()
+    with pytest.raises(ValueError):
+        open_storage(unsharded)
+
+
+def test_rebuild_progress_adds_up_the_shards(tmp_path):
+    storage = open_storage(tmp_path)
+    for i in range(60):
+        storage.store(b"k%d" % i, b"v" * 20)
+    storage.close()
+
+    reopened = open_storage(tmp_path)
+    progress = reopened.rebuild_progress()
+    assert progress["done"]
+    assert progress["keys_indexed"] == 60
+    assert progress["files_total"] == len(reopened.read_files())
+
+
+def test_background_rebuild_failure_of_a_shard_is_reported(tmp_path, monkeypatch):
+    storage = open_storage(tmp_path)
+    for i in range(60):
+        storage.store(b"k%d" % i, b"v" * 20)
+    storage.close()
+
+    def failing_scan(file_name):
+        raise OSError("flaky disk")
+
+    monkeypatch.setattr(bitc_storage, "scan_hint_file", failing_scan)
+    failed = threading.Event()
+    reopened = ShardedCaskStorage(str(tmp_path), 4, KeyDir, durability="os")
+    reopened.rebuild_index(background=True, on_error=lambda ex: failed.set())
+    assert failed.wait(10)
+    assert reopened.rebuild_progress()["error"] == "flaky disk"
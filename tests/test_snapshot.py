@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from bitc import bitc_storage, consts
+from bitc.bitc_storage import CaskStorage
+from bitc.keydir import KeyDir
+
+
+def open_storage(db_dir):
+    storage = CaskStorage(
+        str(db_dir), KeyDir(), max_file_size=300, durability="os", keydir_snapshot=True
+    )
+    storage.rebuild_index()
+    return storage
+
+
+@pytest.fixture
+def scanned_files(monkeypatch):
+    """Names of the hint and data files rebuild_index scans."""
+    scanned = []
+    for name in ("scan_hint_file", "scan_data_file"):
+        scan = getattr(bitc_storage, name)
+
+        def recording_scan(path, scan=scan):
+            scanned.append(os.path.basename(path))
+            return scan(path)
+
+        monkeypatch.setattr(bitc_storage, name, recording_scan)
+    return scanned
+
+
+def test_snapshot_load_replays_later_writes(tmp_path, scanned_files):
+    storage = open_storage(tmp_path)
+    for i in range(30):
+        storage.store(b"s%d" % i, b"v%d" % i, ttl=3600 if i == 1 else 0)
+    assert storage.write_snapshot()
+    for i in range(0, 30, 3):
+        storage.delete(b"s%d" % i)
+    storage.store(b"s0", b"again")
+    storage.store(b"late", b"l")
+    files = len(storage.read_files())
+    storage.close()
+    os.remove(os.path.join(str(tmp_path), consts.KEYDIR_SNAPSHOT_FILE))
+    # Only what was written after the snapshot is replayed
+    storage = open_storage(tmp_path)
+    storage.store(b"s2", b"changed")
+    assert storage.write_snapshot()
+    storage.close()
+    del scanned_files[:]
+
+    reopened = open_storage(tmp_path)
+    assert len(scanned_files) < files
+    for i in range(30):
+        expected = b"again" if i == 0 else None if i % 3 == 0 else b"v%d" % i
+        if i == 2:
+            expected = b"changed"
+        assert reopened.retrieve(b"s%d" % i) == expected
+    assert reopened.retrieve(b"late") == b"l"
+    assert reopened._key_dir.get(b"s1").expires > 0
+    assert reopened.rebuild_progress()["keys_indexed"] == 22
+    reopened.close()
+
+
+def test_corrupt_snapshot_falls_back_to_a_full_rebuild(tmp_path, scanned_files):
+    storage = open_storage(tmp_path)
+    for i in range(30):
+        storage.store(b"k%d" % i, b"v%d" % i)
+    storage.close()
+    snapshot_path = os.path.join(str(tmp_path), consts.KEYDIR_SNAPSHOT_FILE)
+    with open(snapshot_path, "r+b") as fh:
+        fh.seek(20)
+        fh.write(b"\xff\xff")
+    del scanned_files[:]
+
+    reopened = open_storage(tmp_path)
+    assert len(scanned_files) == len(reopened.read_files())
+    for i in range(30):
+        assert reopened.retrieve(b"k%d" % i) == b"v%d" % i
+    reopened.close()
+
+
+def test_merge_drops_the_snapshot(tmp_path):
+    storage = open_storage(tmp_path)
+    for round_ in range(3):
+        for i in range(20):
+            storage.store(b"k%d" % i, b"v%d-%d" % (round_, i))
+    assert storage.write_snapshot()
+    storage.merge()
+    assert not os.path.exists(os.path.join(str(tmp_path), consts.KEYDIR_SNAPSHOT_FILE))
+    storage.close()
+
+    reopened = open_storage(tmp_path)
+    for i in range(20):
+        assert reopened.retrieve(b"k%d" % i) == b"v2-%d" % i
+    reopened.close()
@@ -0,0 +1,149 @@
+import glob
+import logging
+import os
+import time
+
+import pytest
+
+from bitc import bitc_storage
+from bitc.bitc_storage import CaskStorage
+from bitc.index_file import read_index_file, write_index_file
+from bitc.keydir import TieredKeyDir
+
+BUDGET = 5000
+
+
+def open_storage(db_dir, **kwargs):
+    storage = CaskStorage(
+        str(db_dir), TieredKeyDir(BUDGET), max_file_size=500, durability="os", **kwargs
+    )
+    storage.rebuild_index()
+    return storage
+
+
+def file_stems(db_dir, extension):
+    return set(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(str(db_dir), "*." + extension))
+    )
+
+
+def test_index_file_lookup(tmp_path):
+    path = str(tmp_path / "0.index")
+    entries = {
+        b"key-%03d" % i: (30, i * 30, 100, 0, i % 10 == 0) for i in range(0, 200, 2)
+    }
+    write_index_file(path, entries, False)
+    index = read_index_file(path)
+    assert index.entry_count == 100
+    assert index.lookup(b"key-004") == (30, 120, 100, 0)
+    # Tombstones resolve to None, missing keys to the default
+    assert index.lookup(b"key-010", "missing") is None
+    assert index.lookup(b"key-005", "missing") == "missing"
+    assert index.lookup(b"a", "missing") == "missing"
+    assert index.lookup(b"z", "missing") == "missing"
+    assert [key for key, *_ in index.iter_entries()] == sorted(entries)
+
+
+def test_corrupt_index_file_is_ignored(tmp_path):
+    path = str(tmp_path / "0.index")
+    write_index_file(path, {b"key": (30, 0, 100, 0, False)}, False)
+    with open(path, "r+b") as fh:
+        fh.seek(-6, os.SEEK_END)
+        fh.write(b"\xff")
+    assert read_index_file(path) is None
+
+
+def test_lookups_past_the_memory_budget(tmp_path):
+    storage = open_storage(tmp_path)
+    model = {}
+    for i in range(600):
+        key = b"key-%d" % (i % 400)
+        model[key] = b"value-%d" % i
+        storage.store(key, model[key])
+    for i in range(0, 400, 7):
+        storage.delete(b"key-%d" % i)
+        model[b"key-%d" % i] = None
+    storage.close()
+    assert file_stems(tmp_path, "index") == file_stems(tmp_path, "data")
+    assert file_stems(tmp_path, "bloom") == file_stems(tmp_path, "data")
+
+    reopened = open_storage(tmp_path)
+    for key, value in model.items():
+        assert reopened.retrieve(key) == value, key
+    assert len(reopened._key_dir) < len(model)
+    # The budget bounds the entries held, index fences always stay loaded
+    fences = reopened._key_dir._index_bytes
+    assert reopened.index_stats()["memory_bytes"] <= BUDGET + fences
+    reopened.merge()
+    for key, value in model.items():
+        assert reopened.retrieve(key) == value, key
+    reopened.close()
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize("survived_ops", range(34))
+def test_merge_crash_never_leaves_a_stale_index(tmp_path, monkeypatch, survived_ops):
+    storage = open_storage(tmp_path)
+    model = {}
+    for round_ in range(3):
+        for i in range(round_, 60, round_ + 1):
+            model[b"key-%d" % i] = b"value-%d-%d" % (round_, i)
+            storage.store(b"key-%d" % i, model[b"key-%d" % i])
+    storage._wait_for_seals()
+    ops = []
+
+    def crashing(op):
+        def crash_after_survived_ops(*args):
+            if len(ops) == survived_ops:
+                raise Crash()
+            ops.append(args)
+            return op(*args)
+
+        return crash_after_survived_ops
+
+    with monkeypatch.context() as crash_patch:
+        for name in ("rename", "remove", "replace"):
+            crash_patch.setattr(bitc_storage.os, name, crashing(getattr(os, name)))
+        try:
+            storage.merge()
+        except Crash:
+            pass
+
+    # Keys past the budget are served from the index files on disk
+    reopened = open_storage(tmp_path)
+    for key, value in model.items():
+        assert reopened.retrieve(key) == value, key
+    reopened.close()
+
+
+def test_merge_and_close_wait_for_sealing_of_rotated_files(
+    tmp_path, caplog, monkeypatch
+):
+    scan_file_entries = bitc_storage.scan_file_entries
+
+    def slow_scan(*args, **kwargs):
+        # Seal threads are still reading when merge and close start
+        time.sleep(0.05)
+        return scan_file_entries(*args, **kwargs)
+
+    monkeypatch.setattr(bitc_storage, "scan_file_entries", slow_scan)
+    storage = open_storage(tmp_path)
+    with caplog.at_level(logging.WARNING):
+        for round_ in range(5):
+            for i in range(40):
+                storage.store(b"k%d" % i, b"v%d-%d" % (round_, i))
+            storage.merge()
+        storage.close()
+    assert not [record for record in caplog.records if "hint" in record.message]
+    # No filter or index outlives its data file
+    assert file_stems(tmp_path, "bloom") == file_stems(tmp_path, "data")
+    assert file_stems(tmp_path, "index") == file_stems(tmp_path, "data")
+
+
+def test_tiered_keydir_has_no_snapshots(tmp_path):
+    with pytest.raises(ValueError):
+        CaskStorage(str(tmp_path), TieredKeyDir(BUDGET), keydir_snapshot=True)
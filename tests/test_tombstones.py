@@ -0,0 +1,118 @@
+import glob
+import os
+import struct
+
+import pytest
+
+from bitc import consts
+from bitc.bitc_storage import CaskStorage
+from bitc.cask_file import calculate_checksum, scan_hint_file
+from bitc.keydir import CompactKeyDir, KeyDir
+
+
+@pytest.fixture(params=[KeyDir, CompactKeyDir], ids=["dict", "compact"])
+def key_dir_class(request):
+    return request.param
+
+
+def open_storage(db_dir, key_dir_class, max_file_size=300):
+    storage = CaskStorage(
+        str(db_dir), key_dir_class(), max_file_size=max_file_size, durability="os"
+    )
+    storage.rebuild_index()
+    return storage
+
+
+def data_size(db_dir):
+    return sum(
+        os.path.getsize(path) for path in glob.glob(os.path.join(str(db_dir), "*.data"))
+    )
+
+
+def hint_tombstones(db_dir):
+    return [
+        key
+        for path in glob.glob(os.path.join(str(db_dir), "*.hint"))
+        for key, metadata in scan_hint_file(path).items()
+        if metadata is None
+    ]
+
+
+def test_delete_writes_a_header_only_tombstone(tmp_path, key_dir_class):
+    storage = open_storage(tmp_path, key_dir_class)
+    storage.store(b"key", b"value")
+    before = data_size(tmp_path)
+    assert storage.delete(b"key") is True
+    assert data_size(tmp_path) - before == consts.DATA_HEADER_SIZE + len(b"key")
+    assert storage.delete(b"key") is False
+    # The old literal marker is an ordinary value
+    storage.store(b"literal", b"TOMBSTONE")
+    assert storage.retrieve(b"literal") == b"TOMBSTONE"
+    storage.close()
+
+
+def test_tombstones_stay_out_of_the_keydir_and_merge_drops_them(
+    tmp_path, key_dir_class
+):
+    storage = open_storage(tmp_path, key_dir_class)
+    for round_ in range(10):
+        for i in range(10):
+            storage.store(b"c%d" % i, b"x" * 10)
+        for i in range(10):
+            storage.delete(b"c%d" % i)
+    storage.store(b"keep", b"k")
+    assert len(storage._key_dir) == 1
+    storage.close()
+
+    reopened = open_storage(tmp_path, key_dir_class)
+    assert len(reopened._key_dir) == 1
+    assert reopened.retrieve(b"c3") is None
+    reopened.store(b"pad", b"p")
+    reopened.merge(reopened.read_files())
+    assert data_size(tmp_path) < 200
+    assert hint_tombstones(tmp_path) == []
+    reopened.close()
+
+    merged = open_storage(tmp_path, key_dir_class)
+    assert merged.retrieve(b"c3") is None
+    assert merged.retrieve(b"keep") == b"k"
+    merged.close()
+
+
+def test_partial_merge_keeps_tombstones_shadowing_older_files(tmp_path):
+    storage = open_storage(tmp_path, KeyDir, max_file_size=200)
+    storage.store(b"k", b"v1")
+    for i in range(20):
+        storage.store(b"f%d" % i, b"x" * 20)
+    storage.delete(b"k")
+    for i in range(20):
+        storage.store(b"g%d" % i, b"y" * 20)
+    files = sorted(storage.read_files(), key=lambda data_file: data_file.file_id)
+    # The file holding the first value of k is left out
+    storage.merge(files[1:-1])
+    assert hint_tombstones(tmp_path) == [b"k"]
+    storage.close()
+
+    reopened = open_storage(tmp_path, KeyDir)
+    assert reopened.retrieve(b"k") is None
+    reopened.merge(reopened.read_files())
+    assert hint_tombstones(tmp_path) == []
+    assert reopened.retrieve(b"k") is None
+    reopened.close()
+
+
+def legacy_record(key, value):
+    header = struct.pack(consts.DATA_HEADER_FORMAT, 0, 1, len(key), len(value))
+    crc = calculate_checksum(header, key, value)
+    return struct.pack("<I", crc) + header[4:] + key + value
+
+
+def test_legacy_literal_tombstones_are_deletions(tmp_path):
+    with open(os.path.join(str(tmp_path), "0.data"), "wb") as fh:
+        fh.write(legacy_record(b"a", b"old") + legacy_record(b"b", b"bv"))
+    with open(os.path.join(str(tmp_path), "1.data"), "wb") as fh:
+        fh.write(legacy_record(b"a", b"TOMBSTONE") + legacy_record(b"c", b"cv"))
+    storage = open_storage(tmp_path, KeyDir)
+    assert storage.retrieve(b"a") is None
+    assert dict(storage.export()) == {b"b": b"bv", b"c": b"cv"}
+    storage.close()
@@ -0,0 +1,114 @@
+import pytest
+
+from bitc import utils
+from bitc.bitc_storage import CaskStorage
+from bitc.cask_file import scan_hint_file
+from bitc.keydir import CompactKeyDir, KeyDir
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(1700000000.0)
+    monkeypatch.setattr("time.time", clock)
+    return clock
+
+
+@pytest.fixture(params=[KeyDir, CompactKeyDir], ids=["dict", "compact"])
+def key_dir_class(request):
+    return request.param
+
+
+def open_storage(db_dir, key_dir_class):
+    storage = CaskStorage(
+        str(db_dir), key_dir_class(), max_file_size=300, durability="os"
+    )
+    storage.rebuild_index()
+    return storage
+
+
+def test_expired_keys_are_never_returned(tmp_path, clock, key_dir_class):
+    storage = open_storage(tmp_path, key_dir_class)
+    storage.store(b"short", b"s", ttl=10)
+    storage.store(b"long", b"l", ttl=100)
+    storage.store(b"forever", b"f")
+    assert storage.retrieve(b"short") == b"s"
+    clock.now += 11
+    assert storage.retrieve(b"short") is None
+    assert storage.retrieve_many([b"short", b"long"]) == [None, b"l"]
+    assert dict(storage.export()) == {b"long": b"l", b"forever": b"f"}
+    # Deleting an expired key is a miss
+    assert storage.delete(b"short") is False
+    clock.now += 100
+    assert storage.retrieve(b"long") is None
+    assert storage.retrieve(b"forever") == b"f"
+    storage.close()
+
+
+def test_sweep_drops_expired_keys_from_the_keydir(tmp_path, clock, key_dir_class):
+    storage = open_storage(tmp_path, key_dir_class)
+    for i in range(10):
+        storage.store(b"t%d" % i, b"v", ttl=10)
+    storage.store(b"t0", b"rewritten")
+    storage.store(b"keep", b"k", ttl=1000)
+    assert storage.sweep_expired() == 0
+    clock.now += 11
+    # A batch is bounded, the rest is left for the next sweep
+    swept = storage.sweep_expired(limit=4)
+    assert 0 < swept <= 4
+    assert swept + storage.sweep_expired() == 9
+    assert len(storage._key_dir) == 2
+    assert storage.retrieve(b"t0") == b"rewritten"
+    assert storage.retrieve(b"keep") == b"k"
+    storage.close()
+
+
+def test_merge_reclaims_expired_records(tmp_path, clock, key_dir_class):
+    storage = open_storage(tmp_path, key_dir_class)
+    for i in range(20):
+        storage.store(b"t%d" % i, b"x" * 20, ttl=10)
+    storage.store(b"keep", b"k")
+    clock.now += 11
+    files_before = len(storage.read_files())
+    storage.merge(storage.read_files())
+    assert len(storage.read_files()) < files_before
+    for data_file in storage.read_files():
+        if data_file is storage._data_file:
+            continue
+        keys = scan_hint_file(utils.get_hint_filename_for_data_file(data_file.name))
+        assert not any(key.startswith(b"t") for key in keys)
+    assert storage.retrieve(b"t3") is None
+    storage.close()
+
+    reopened = open_storage(tmp_path, key_dir_class)
+    assert reopened.retrieve(b"t3") is None
+    assert reopened.retrieve(b"keep") == b"k"
+    # Expired records left in the active file are swept after a restart
+    reopened.sweep_expired()
+    assert len(reopened._key_dir) == 1
+    reopened.close()
+
+
+def test_partial_merge_keeps_expired_records_shadowing_older_ones(
+    tmp_path, clock, key_dir_class
+):
+    storage = open_storage(tmp_path, key_dir_class)
+    storage.store(b"k", b"old")
+    for i in range(20):
+        storage.store(b"pad%d" % i, b"x" * 20)
+    oldest = storage.read_files()[0]
+    storage.store(b"k", b"new", ttl=10)
+    for i in range(20, 40):
+        storage.store(b"pad%d" % i, b"x" * 20)
+    clock.now += 11
+    storage.merge([f for f in storage.read_files() if f is not oldest])
+    assert storage.retrieve(b"k") is None
+    storage.close()
+    assert open_storage(tmp_path, key_dir_class).retrieve(b"k") is None